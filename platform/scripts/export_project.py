@@ -10,51 +10,1110 @@ This script exports all data from an Atlos project including:
 """
 
 import os
+import sys
 import json
+import bisect
+import contextlib
+import hashlib
+import io
+import random
+import re
+import threading
+import time
+import shutil
+import tarfile
+import tempfile
+import zipfile
 import requests
 import argparse
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Any
 from urllib.parse import urlparse
 import mimetypes
+import httpx
 import trio
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:  # Only needed to compress JSON in archives
+    zstandard = None
 
 SCRIPT_VERSION = '1.0'
 
+# Responses worth retrying: rate limiting and (likely transient) server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The start of the range in a 206 response's Content-Range header
+CONTENT_RANGE = re.compile(r'bytes (\d+)-\d+/(?:\d+|\*)')
+
+class RateLimiter:
+    """Token bucket shared by every thread making API requests. (The clock and sleep function can be
+    swapped out for testing.)"""
+    def __init__(self, rate: float, burst: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+        
+    def _take(self) -> float:
+        """Take a token if one is available. Returns zero if so, or else how long to wait for one."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+                
+            return (1 - self.tokens) / self.rate
+            
+    def acquire(self):
+        """Block until a request is allowed"""
+        while (wait := self._take()) > 0:
+            self.sleep(wait)
+            
+    async def acquire_async(self):
+        """Wait (without blocking other trio tasks) until a request is allowed"""
+        while (wait := self._take()) > 0:
+            await trio.sleep(wait)
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with jitter for the given (zero-indexed) retry attempt"""
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+class RetryableDownloadError(Exception):
+    pass
+
+def sha256_of_file(path: Path, chunk_size: int = 1024 * 1024):
+    """The (still updatable) SHA-256 hash object of a file's contents"""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum
+
+def validator_path(temp_path: Path) -> Path:
+    """Where the validator (ETag or Last-Modified) of the response a `.part` file came from is kept"""
+    return temp_path.with_name(temp_path.name + '.validator')
+
+def discard_partial_download(temp_path: Path):
+    temp_path.unlink(missing_ok=True)
+    validator_path(temp_path).unlink(missing_ok=True)
+
+def resume_request(temp_path: Path) -> tuple:
+    """The offset to resume a download into `temp_path` from, and the headers to request the rest of
+    the file with. The request is conditional (If-Range), so that if the remote file has changed since
+    the `.part` file was started, the server sends all of it instead. A `.part` file without a
+    validator can't be resumed safely, so it's discarded."""
+    try:
+        offset = temp_path.stat().st_size
+        validator = validator_path(temp_path).read_text()
+    except FileNotFoundError:
+        discard_partial_download(temp_path)
+        return 0, {}
+    if not offset or not validator:
+        discard_partial_download(temp_path)
+        return 0, {}
+    return offset, {'Range': f'bytes={offset}-', 'If-Range': validator}
+
+def start_partial_download(temp_path: Path, offset: int, status_code: int, headers) -> bool:
+    """Check a download's response against the `.part` file. Returns whether the response continues
+    the `.part` file; otherwise the `.part` file is emptied to start over, and the response's validator
+    is kept so that this download can be resumed in turn. Either way, append the response's body."""
+    if status_code == 206:
+        match = CONTENT_RANGE.fullmatch(headers.get('Content-Range', ''))
+        if not offset or match is None or int(match.group(1)) != offset:
+            discard_partial_download(temp_path)
+            raise RetryableDownloadError(f"unexpected Content-Range {headers.get('Content-Range')!r}")
+        return True
+        
+    # Empty the file before recording the new validator, so that a crash in between can't leave the
+    # old contents looking like the start of the new file
+    temp_path.write_bytes(b'')
+    etag = headers.get('ETag', '')
+    validator = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified', '')
+    if validator:
+        validator_path(temp_path).write_text(validator)
+    else:
+        validator_path(temp_path).unlink(missing_ok=True)
+    return False
+
+def finish_partial_download(temp_path: Path, filepath: Path) -> int:
+    """Move a completed `.part` file into place. Returns the file's size."""
+    size = temp_path.stat().st_size
+    validator_path(temp_path).unlink(missing_ok=True)
+    os.replace(temp_path, filepath)
+    return size
+
+class LatencyHistogram:
+    """Counts of durations (in seconds) in fixed buckets, for reporting percentiles cheaply"""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        
+    def percentile(self, p: float) -> Optional[float]:
+        """The upper bound of the bucket containing the given percentile (or the maximum, if it's in
+        the last bucket)"""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= self.count * p / 100:
+                return bound
+        return self.max
+        
+    def to_dict(self) -> Dict:
+        buckets = {f"<={bound}s": count for bound, count in zip(self.BUCKETS, self.counts)}
+        buckets[f">{self.BUCKETS[-1]}s"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean_seconds': self.total / self.count if self.count else None,
+            'p50_seconds': self.percentile(50),
+            'p95_seconds': self.percentile(95),
+            'p99_seconds': self.percentile(99),
+            'max_seconds': self.max,
+            'buckets': buckets,
+        }
+
+class ExportStats:
+    """Timings, throughput and progress of an export: how long each phase took, how long API requests
+    and downloads take to respond, how often they're retried, and how much was downloaded. Shared by
+    every thread (or trio task) doing the export."""
+    FILENAME = 'export_stats.json'
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.phases: Dict[str, float] = {}
+        self.latencies = {'api': LatencyHistogram(), 'download': LatencyHistogram(),
+                          'incident': LatencyHistogram()}
+        self.retries = {'api': 0, 'download': 0}
+        self.incidents_total = 0
+        self.incidents_processed = 0
+        self.incidents_skipped = 0
+        self.files_planned = 0
+        self.files_skipped = 0
+        self.files_deduplicated = 0
+        self.bytes_deduplicated = 0
+        self.bytes_downloaded = 0
+        self.files_downloaded = 0
+        self.failures: List[str] = []
+        self._progress_stop: Optional[threading.Event] = None
+        
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time a phase of the export"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - started
+            
+    def record_latency(self, kind: str, seconds: float):
+        with self.lock:
+            self.latencies[kind].record(seconds)
+            
+    def record_retry(self, kind: str):
+        with self.lock:
+            self.retries[kind] += 1
+            
+    def record_incident(self, skipped: bool = False):
+        with self.lock:
+            self.incidents_processed += 1
+            self.incidents_skipped += skipped
+            
+    def record_planned_files(self, count: int):
+        with self.lock:
+            self.files_planned += count
+            
+    def record_skipped_file(self):
+        with self.lock:
+            self.files_skipped += 1
+            
+    def record_deduplicated_file(self, size: int):
+        with self.lock:
+            self.files_deduplicated += 1
+            self.bytes_deduplicated += size
+            
+    def record_bytes(self, count: int):
+        with self.lock:
+            self.bytes_downloaded += count
+            
+    def record_file(self):
+        with self.lock:
+            self.files_downloaded += 1
+            
+    def record_failure(self, description: str, error: BaseException):
+        print(f"    Download failed: {description} ({error})")
+        with self.lock:
+            self.failures.append(description)
+            
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+        
+    def throughput(self) -> float:
+        """Average download throughput so far, in bytes per second"""
+        return self.bytes_downloaded / max(self.elapsed(), 1e-9)
+        
+    def eta(self) -> Optional[float]:
+        """Rough estimate of the seconds left, from the rate at which incidents and files have been
+        getting done since the export started processing incidents"""
+        processing_started = self.started + sum(self.phases.get(name, 0) for name in ('fetch', 'organize'))
+        if 'organize' not in self.phases or not self.incidents_total:
+            return None
+        elapsed = time.monotonic() - processing_started
+        
+        # Files are only planned as incidents are processed, so extrapolate from incidents until then
+        if self.incidents_processed < self.incidents_total:
+            done, total = self.incidents_processed, self.incidents_total
+        else:
+            done = (self.files_downloaded + self.files_skipped + self.files_deduplicated
+                    + len(self.failures))
+            total = self.files_planned
+        if not done:
+            return None
+        return max(0.0, elapsed * (total - done) / done)
+        
+    def summary(self) -> str:
+        return (f"Downloaded {self.files_downloaded} files ({self.bytes_downloaded / 1e6:.1f} MB) "
+                f"in {self.elapsed():.1f}s ({self.throughput() / 1e6:.2f} MB/s)")
+        
+    def progress_line(self) -> str:
+        eta = self.eta()
+        return (f"[{self.elapsed():.0f}s] incidents {self.incidents_processed}/{self.incidents_total} | "
+                f"files {self.files_downloaded + self.files_skipped + self.files_deduplicated}/{self.files_planned} "
+                f"({len(self.failures)} failed) | {self.bytes_downloaded / 1e6:.1f} MB at "
+                f"{self.throughput() / 1e6:.2f} MB/s | {self.latencies['api'].count} API requests "
+                f"({self.retries['api']} retried) | ETA {'?' if eta is None else f'{eta:.0f}s'}")
+        
+    def start_progress(self, interval: float = 5.0):
+        """Print a progress line (to stderr) every `interval` seconds until `stop_progress`"""
+        self._progress_stop = threading.Event()
+        
+        def report(stop: threading.Event):
+            while not stop.wait(interval):
+                print(self.progress_line(), file=sys.stderr, flush=True)
+                
+        threading.Thread(target=report, args=(self._progress_stop,), daemon=True).start()
+        
+    def stop_progress(self):
+        if self._progress_stop is not None:
+            self._progress_stop.set()
+            self._progress_stop = None
+            
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'elapsed_seconds': self.elapsed(),
+                'phase_seconds': dict(self.phases),
+                'incidents': {
+                    'total': self.incidents_total,
+                    'processed': self.incidents_processed,
+                    'unchanged': self.incidents_skipped,
+                },
+                'downloads': {
+                    'planned': self.files_planned,
+                    'downloaded': self.files_downloaded,
+                    'already_downloaded': self.files_skipped,
+                    'deduplicated': self.files_deduplicated,
+                    'bytes_deduplicated': self.bytes_deduplicated,
+                    'failed': len(self.failures),
+                    'bytes': self.bytes_downloaded,
+                    'bytes_per_second': self.throughput(),
+                },
+                'retries': dict(self.retries),
+                'latency': {kind: histogram.to_dict() for kind, histogram in self.latencies.items()},
+            }
+            
+    def raise_failures(self):
+        if self.failures:
+            raise RuntimeError(f"{len(self.failures)} downloads failed: {', '.join(self.failures[:10])}")
+
+class DownloadScheduler:
+    """Downloads files on a shared pool of threads, so that the number of downloads in flight is capped
+    across the whole export (rather than per incident). Connections are pooled per host, failed
+    downloads are retried with backoff, and interrupted downloads resume with (conditional) Range
+    requests."""
+    CHUNK_SIZE = 1024 * 1024
+    
+    def __init__(self, stats: ExportStats, concurrency: int = 16, max_retries: int = 5,
+                 timeout: float = 60.0):
+        self.stats = stats
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        
+        # No auth headers, since these are (signed) storage URLs
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+    def submit(self, function: Callable, *args, description: str = '') -> Future:
+        """Run `function(*args)` on the download pool. Failures are recorded (see `raise_failures`)."""
+        future = self.executor.submit(function, *args)
+        
+        def check(future: Future):
+            error = future.exception()
+            if error is not None:
+                self.stats.record_failure(description, error)
+                    
+        future.add_done_callback(check)
+        return future
+        
+    def when_all_done(self, futures: List[Future], callback: Callable[[], None]):
+        """Call `callback` once all of the futures have completed, unless any of them failed"""
+        remaining = [len(futures)]
+        failed = [False]
+        lock = threading.Lock()
+        
+        def done(future: Future):
+            with lock:
+                remaining[0] -= 1
+                failed[0] = failed[0] or future.exception() is not None
+                finished = remaining[0] == 0
+            if finished and not failed[0]:
+                callback()
+                
+        if not futures:
+            callback()
+        for future in futures:
+            future.add_done_callback(done)
+            
+    def fetch(self, url: str, filepath: Path) -> tuple:
+        """Download a URL to a local filepath. Returns the file's size and SHA-256 checksum. The file
+        is written to a `.part` file first, which later attempts (or runs) resume from."""
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = filepath.with_name(filepath.name + '.part')
+        
+        for attempt in range(self.max_retries + 1):
+            offset, headers = resume_request(temp_path)
+            try:
+                requested = time.monotonic()
+                with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as response:
+                    self.stats.record_latency('download', time.monotonic() - requested)
+                    if response.status_code == 416:
+                        # Our partial file doesn't line up with the remote file, so start over
+                        discard_partial_download(temp_path)
+                        raise RetryableDownloadError("HTTP 416")
+                    if response.status_code in RETRY_STATUSES:
+                        raise RetryableDownloadError(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+                    
+                    if start_partial_download(temp_path, offset, response.status_code, response.headers):
+                        # Resuming: the checksum has to cover what we already have
+                        checksum = sha256_of_file(temp_path)
+                    else:
+                        checksum = hashlib.sha256()
+                        
+                    with open(temp_path, 'ab') as f:
+                        for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                            f.write(chunk)
+                            checksum.update(chunk)
+                            self.stats.record_bytes(len(chunk))
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, RetryableDownloadError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"    Download of {filepath.name} failed ({e}), retrying in {delay:.1f}s...")
+                self.stats.record_retry('download')
+                time.sleep(delay)
+                
+        return finish_partial_download(temp_path, filepath), checksum.hexdigest()
+        
+    def shutdown(self):
+        """Wait for all downloads to finish"""
+        self.executor.shutdown(wait=True)
+        
+    def cancel(self):
+        """Drop the downloads that haven't started, and wait for the ones in progress"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+class ExportManifest:
+    """Records what previous exports wrote, so that later (incremental) exports can skip incidents and
+    files that haven't changed. The manifest is an append-only journal of JSON lines, so progress is
+    saved as it happens and survives a crash; later entries take precedence over earlier ones."""
+    FILENAME = '.export_manifest.jsonl'
+    
+    def __init__(self, output_dir: Path, resume: bool = True):
+        self.path = output_dir / self.FILENAME
+        self.watermarks: Dict[str, str] = {}
+        self.incidents: Dict[str, str] = {}  # slug -> digest of the incident's data
+        self.files: Dict[str, Dict] = {}  # path relative to the output directory -> size and sha256
+        self.lock = threading.Lock()
+        
+        if resume and self.path.exists():
+            self._load()
+        self.journal = open(self.path, 'a' if resume else 'w')
+        
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely a partially-written final line from a crash
+                    continue
+                kind = entry.get('kind')
+                if kind == 'watermarks':
+                    self.watermarks = entry['watermarks']
+                elif kind == 'incident':
+                    self.incidents[entry['slug']] = entry['digest']
+                elif kind == 'file':
+                    self.files[entry['path']] = {'size': entry['size'], 'sha256': entry['sha256']}
+                    
+    def _append(self, entry: Dict):
+        with self.lock:
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            
+    def record_watermarks(self, watermarks: Dict[str, str]):
+        self.watermarks = watermarks
+        self._append({'kind': 'watermarks', 'watermarks': watermarks})
+        
+    def record_incident(self, slug: str, digest: str):
+        self.incidents[slug] = digest
+        self._append({'kind': 'incident', 'slug': slug, 'digest': digest})
+        
+    def record_file(self, path: str, size: int, sha256: str):
+        self.files[path] = {'size': size, 'sha256': sha256}
+        self._append({'kind': 'file', 'path': path, 'size': size, 'sha256': sha256})
+        
+    def incident_is_current(self, slug: str, digest: str) -> bool:
+        return self.incidents.get(slug) == digest
+        
+    def file_is_current(self, path: str, filepath: Path, sha256: Optional[str] = None) -> bool:
+        """Whether the file was fully downloaded by a previous export and (when we know what its
+        checksum should be) has the right contents"""
+        recorded = self.files.get(path)
+        if recorded is None or not filepath.exists():
+            return False
+        if filepath.stat().st_size != recorded['size']:
+            return False
+        return sha256 is None or sha256 == recorded['sha256']
+        
+    def compact(self):
+        """Rewrite the journal with only the current state"""
+        with self.lock:
+            self.journal.close()
+            temp_path = self.path.with_suffix('.tmp')
+            with open(temp_path, 'w') as f:
+                f.write(json.dumps({'kind': 'watermarks', 'watermarks': self.watermarks}) + '\n')
+                for slug, digest in self.incidents.items():
+                    f.write(json.dumps({'kind': 'incident', 'slug': slug, 'digest': digest}) + '\n')
+                for path, info in self.files.items():
+                    f.write(json.dumps({'kind': 'file', 'path': path, **info}) + '\n')
+            os.replace(temp_path, self.path)
+            self.journal = open(self.path, 'a')
+            
+    def close(self):
+        self.journal.close()
+
+class BlobStore:
+    """Content-addressed storage for downloaded files, so that a file linked from many incidents is
+    only stored (and, when the API reports its checksum, only downloaded) once. Each file is stored at
+    `blobs/sha256/<first two hex digits>/<sha256>` and hardlinked into incident folders."""
+    DIRECTORY = 'blobs'
+    
+    def __init__(self, output_dir: Path):
+        self.root = output_dir / self.DIRECTORY / 'sha256'
+        self.temp_dir = output_dir / self.DIRECTORY / 'tmp'
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.locks: Dict[str, Any] = {}
+        
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+        
+    def size(self, sha256: str) -> Optional[int]:
+        """The size of the stored file with the given checksum, or None if there isn't one"""
+        try:
+            return self.path(sha256).stat().st_size
+        except FileNotFoundError:
+            return None
+            
+    def lock_for(self, sha256: str, factory: Callable = threading.Lock):
+        """A lock for the given checksum, so that concurrent downloads of the same file wait for one
+        another instead of all downloading it. (Pass `trio.Lock` as the factory for trio tasks.)"""
+        with self.lock:
+            if sha256 not in self.locks:
+                self.locks[sha256] = factory()
+            return self.locks[sha256]
+            
+    def temp_path(self, key: str) -> Path:
+        """Where to download a file before we know its checksum. Stable for the same key, so that
+        interrupted downloads can be resumed."""
+        return self.temp_dir / hashlib.sha256(key.encode()).hexdigest()
+        
+    def add(self, temp_path: Path, sha256: str) -> bool:
+        """Move a downloaded file into the store. Returns whether the store already had it (in which
+        case the download is discarded)."""
+        blob_path = self.path(sha256)
+        if blob_path.exists():
+            temp_path.unlink()
+            return True
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, blob_path)
+        return False
+        
+    def link(self, sha256: str, filepath: Path):
+        """Put the stored file with the given checksum at `filepath`: as a hardlink where the filesystem
+        supports them, otherwise as a relative symlink, and as a last resort as a copy"""
+        blob_path = self.path(sha256)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if filepath.is_symlink() or filepath.exists():
+            filepath.unlink()
+        try:
+            os.link(blob_path, filepath)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(blob_path, filepath.parent), filepath)
+            except OSError:
+                shutil.copyfile(blob_path, filepath)
+
+class IncidentFilter:
+    """Which incidents to export: by slug, status, when they were created or last updated, and (to
+    split an export across several machines) by shard. Source material and updates are exported for
+    the selected incidents only."""
+    
+    def __init__(self, slugs: Optional[List[str]] = None, statuses: Optional[List[str]] = None,
+                 created_after: Optional[str] = None, created_before: Optional[str] = None,
+                 updated_since: Optional[str] = None, shard: Optional[tuple] = None):
+        self.slugs = set(slugs) if slugs else None
+        self.statuses = set(statuses) if statuses else None
+        self.created_after = created_after
+        self.created_before = created_before
+        self.updated_since = updated_since
+        self.shard = shard
+        
+    @staticmethod
+    def parse_shard(value: str) -> tuple:
+        """Parse a shard given as `i/N` (zero-indexed, so the shards of a 4-way split are 0/4 to 3/4)"""
+        try:
+            index, count = (int(part) for part in value.split('/'))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a shard like 0/4, not {value!r}")
+        if not 0 <= index < count:
+            raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}")
+        return index, count
+        
+    @staticmethod
+    def shard_of(slug: str, count: int) -> int:
+        """The shard an incident belongs to. Stable across runs and machines (unlike `hash`)."""
+        return int.from_bytes(hashlib.sha256(slug.encode()).digest()[:8], 'big') % count
+        
+    def is_active(self) -> bool:
+        return any(value is not None for value in (self.slugs, self.statuses, self.created_after,
+                                                   self.created_before, self.updated_since, self.shard))
+        
+    def __call__(self, incident: Dict) -> bool:
+        # ISO 8601 timestamps compare correctly as strings, including against bare dates
+        if self.slugs is not None and incident['slug'] not in self.slugs:
+            return False
+        if self.statuses is not None and incident.get('status') not in self.statuses:
+            return False
+        if self.created_after is not None and incident['inserted_at'] < self.created_after:
+            return False
+        if self.created_before is not None and incident['inserted_at'] >= self.created_before:
+            return False
+        if self.updated_since is not None and incident['updated_at'] < self.updated_since:
+            return False
+        if self.shard is not None and self.shard_of(incident['slug'], self.shard[1]) != self.shard[0]:
+            return False
+        return True
+
+class ArchiveSink:
+    """Writes an export straight into a single (uncompressed) tar or zip archive, rather than into a
+    directory of many small files. Members are written one at a time. An index of every member (for
+    tar, including where its data starts) and of which members belong to each incident is added to
+    the end of the archive, and next to it as `<archive>.index.json`, so that single incidents can be
+    read without unpacking the whole archive (see `extract_incident`).
+    
+    Downloaded files are still staged on disk (in `<archive>.work`) before they're added, rather than
+    streamed in as they arrive: a tar member's size has to be written before its data, and the API's
+    sizes can't be relied on; a zip file can only have one member written at a time, which would
+    serialize every download; and a member can't be taken back out, so a download has to be complete
+    (after retries and resumed requests) and checksummed first. Each file is removed from the work
+    directory as soon as it has been added, so only the downloads in progress take up space there.
+    
+    JSON members can optionally be compressed with zstd (they're then named `<name>.json.zst`)."""
+    INDEX_NAME = 'index.json'
+    
+    # Members of unknown size are buffered (for tar, which needs sizes up front) in memory up to this
+    # size, and in a temporary file beyond it
+    SPOOL_SIZE = 64 * 1024 * 1024
+    
+    def __init__(self, path: Path, compress_json: bool = False):
+        if compress_json and zstandard is None:
+            raise RuntimeError("Compressing JSON requires the zstandard package (pip install zstandard)")
+        self.path = Path(path)
+        self.format = 'zip' if self.path.suffix == '.zip' else 'tar'
+        self.compressor = zstandard.ZstdCompressor() if compress_json else None
+        self.lock = threading.Lock()
+        self.members: Dict[str, Dict] = {}
+        
+        if self.format == 'zip':
+            self.archive = zipfile.ZipFile(self.path, 'w', allowZip64=True)
+        else:
+            self.archive = tarfile.open(self.path, 'w', format=tarfile.PAX_FORMAT)
+            
+    @staticmethod
+    def index_path(path: Path) -> Path:
+        return Path(str(path) + '.index.json')
+        
+    @contextlib.contextmanager
+    def _compressing(self, name: str, stream):
+        if not name.endswith('.zst'):
+            yield stream
+            return
+        writer = self.compressor.stream_writer(stream, closefd=False)
+        yield writer
+        writer.close()
+        
+    @contextlib.contextmanager
+    def open_member(self, name: str, compress: bool = True):
+        """A binary stream to write a new member to"""
+        if compress and self.compressor is not None and name.endswith('.json'):
+            name += '.zst'
+            
+        if self.format == 'zip':
+            # Only one member of a zip file can be written at a time
+            with self.lock:
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                with self.archive.open(info, 'w', force_zip64=True) as member:
+                    with self._compressing(name, member) as stream:
+                        yield stream
+                self.members[name] = {'size': self.archive.getinfo(name).file_size}
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE) as buffer:
+                with self._compressing(name, buffer) as stream:
+                    yield stream
+                size = buffer.tell()
+                buffer.seek(0)
+                self._add_to_tar(name, buffer, size)
+                
+    def add_file(self, name: str, path: Path):
+        """Add a file from disk as a member"""
+        if self.format == 'zip':
+            with self.lock:
+                self.archive.write(path, name)
+                self.members[name] = {'size': self.archive.getinfo(name).file_size}
+        else:
+            with open(path, 'rb') as f:
+                self._add_to_tar(name, f, os.fstat(f.fileno()).st_size)
+                
+    def _add_to_tar(self, name: str, fileobj, size: int):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        with self.lock:
+            self.archive.addfile(info, fileobj)
+            # The data ends where the archive is now, less the padding to a whole block
+            padded_size = -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self.members[name] = {'offset': self.archive.offset - padded_size, 'size': size}
+            
+    def abort(self):
+        """Give up on the archive, and remove it (without an index, it couldn't be read anyway)"""
+        self.archive.close()
+        with contextlib.suppress(FileNotFoundError):
+            self.path.unlink()
+            
+    def close(self):
+        """Write the index, and finish the archive"""
+        incidents: Dict[str, List[str]] = {}
+        for name in self.members:
+            parts = name.split('/')
+            if len(parts) > 2 and parts[0] == 'incidents':
+                incidents.setdefault(parts[1], []).append(name)
+        index = {'format': self.format, 'members': self.members, 'incidents': incidents}
+        
+        # Never compressed, so that it's always easy to find
+        with self.open_member(self.INDEX_NAME, compress=False) as f:
+            f.write(json.dumps(index).encode('utf-8'))
+        self.archive.close()
+        
+        with open(self.index_path(self.path), 'w') as f:
+            json.dump(index, f)
+
+def extract_incident(archive_path: Path, slug: str, destination: Path):
+    """Extract one incident's folder from an export archive, reading only that incident's members"""
+    archive_path = Path(archive_path)
+    if ArchiveSink.index_path(archive_path).exists():
+        with open(ArchiveSink.index_path(archive_path)) as f:
+            index = json.load(f)
+    else:
+        # Zip files can find the index themselves; tar files need the index next to them
+        with zipfile.ZipFile(archive_path) as archive:
+            index = json.loads(archive.read(ArchiveSink.INDEX_NAME))
+            
+    names = index['incidents'].get(slug)
+    if not names:
+        raise KeyError(f"Incident {slug} isn't in {archive_path}")
+        
+    zip_archive = zipfile.ZipFile(archive_path) if index['format'] == 'zip' else None
+    with open(archive_path, 'rb') as f:
+        for name in names:
+            if zip_archive is not None:
+                data = zip_archive.read(name)
+            else:
+                member = index['members'][name]
+                f.seek(member['offset'])
+                data = f.read(member['size'])
+                
+            if name.endswith('.zst'):
+                if zstandard is None:
+                    raise RuntimeError("Extracting compressed JSON requires the zstandard package")
+                data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+                name = name[:-len('.zst')]
+                
+            target = Path(destination) / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+    if zip_archive is not None:
+        zip_archive.close()
+    print(f"Extracted {len(names)} files for incident {slug} to {destination}")
+
+class PlannedDownload(NamedTuple):
+    """A file to download into the export, along with the metadata to save next to it"""
+    url: str
+    filepath: Path
+    sha256: Optional[str]
+    metadata_file: Path
+    metadata: Dict
+
+class CollectionSpool:
+    """One collection of API objects (e.g., all incidents), spooled to a newline-delimited JSON file
+    as it is fetched, so that the export never has to hold a whole collection in memory. Only the
+    position of each item in the file (and its ID) is kept, so items can be read back individually."""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'w+b')
+        self.positions: List[tuple] = []  # (offset, length) of each item
+        self.ids = set()
+        
+    def append(self, item: Dict):
+        line = json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n'
+        self.positions.append((self.file.tell(), len(line)))
+        self.ids.add(item.get('id'))
+        self.file.write(line)
+        
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+            
+    def finish(self):
+        """Flush everything written so far, so that it can be read back"""
+        self.file.flush()
+        
+    def __len__(self) -> int:
+        return len(self.positions)
+        
+    def __getitem__(self, index: int) -> Dict:
+        offset, length = self.positions[index]
+        # pread doesn't move the file position, so this is safe to call from many threads at once
+        return json.loads(os.pread(self.file.fileno(), length, offset))
+        
+    def __iter__(self) -> Iterator[Dict]:
+        return iter_ndjson(self.path)
+        
+    def filtered(self, keep: Callable[[Dict], bool]) -> 'CollectionSpool':
+        """A new spool with only the items for which `keep` returns true. This spool is discarded."""
+        self.finish()
+        filtered = CollectionSpool(self.path.with_name(self.path.name + '.filtered'))
+        filtered.extend(item for item in self if keep(item))
+        filtered.finish()
+        self.close()
+        self.path.unlink()
+        return filtered
+        
+    def sorted_by(self, key: Callable[[Dict], Any], reverse: bool = False) -> 'CollectionSpool':
+        """A new spool with the same items, ordered by `key` (only the keys are held in memory). Items
+        with equal keys keep their order. This spool is discarded."""
+        self.finish()
+        keys = [key(item) for item in self]
+        order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        result = CollectionSpool(self.path.with_name(self.path.name + '.sorted'))
+        result.extend(self[index] for index in order)
+        result.finish()
+        self.close()
+        self.path.unlink()
+        return result
+        
+    def close(self):
+        self.file.close()
+
+def iter_ndjson(path: Path) -> Iterator[Dict]:
+    with open(path, 'rb') as f:
+        for line in f:
+            yield json.loads(line)
+
+def dumps_indented(value: Any, level: int) -> str:
+    """Serialize a value exactly as `json.dump(..., indent=2)` would when it's nested `level` deep"""
+    return json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n' + '  ' * level)
+
+@contextlib.contextmanager
+def atomic_open(path: Path):
+    """Open a file for writing (as text) via a temporary file, so that it's never left half-written"""
+    temp_path = path.with_name(path.name + '.part')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        yield f
+    os.replace(temp_path, path)
+
+def write_export_data(f, export_info: Dict, collections: Dict[str, CollectionSpool], summary: Dict):
+    """Write `export_data.json` one item at a time, straight from the spooled collections. The output
+    is identical to `json.dump`ing the whole export with `indent=2`."""
+    f.write('{\n  "export_info": ' + dumps_indented(export_info, 1) + ',\n')
+    for name, spool in collections.items():
+        f.write(f'  "{name}": ')
+        if not len(spool):
+            f.write('[],\n')
+            continue
+        f.write('[\n')
+        for i, item in enumerate(spool):
+            if i:
+                f.write(',\n')
+            f.write('    ' + dumps_indented(item, 2))
+        f.write('\n  ],\n')
+    f.write('  "summary": ' + dumps_indented(summary, 1) + '\n}')
+
+# Fields that change on every fetch (e.g., signed download URLs) without the underlying data changing
+VOLATILE_FIELDS = {'access_url', 'attachment_urls'}
+
+def read_export_info(path: Path) -> Dict:
+    """Read just the export info from the top of an `export_data.json`, without parsing the rest"""
+    lines = []
+    with open(path, encoding='utf-8') as f:
+        f.readline()  # The opening brace
+        for line in f:
+            # Stop at the next top-level key (nested keys are indented further)
+            if line.startswith('  "') and lines:
+                break
+            lines.append(line)
+    return json.loads('{' + ''.join(lines).rstrip().rstrip(',') + '}')['export_info']
+
+def iter_export_collection(path: Path, name: str) -> Iterator[Dict]:
+    """Yield the items of one collection in an `export_data.json`, one at a time, without loading the
+    rest. Relies on the layout that `write_export_data` (and `json.dump` with `indent=2`) produces:
+    the collection's items are objects that open and close on lines of their own, indented four
+    spaces (anything nested is indented further, and strings can't span lines)."""
+    header = f'  "{name}": '
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(header):
+                break
+        else:
+            # Not laid out the way we write it, so there's nothing for it but to parse the whole thing
+            f.seek(0)
+            yield from json.load(f)[name]
+            return
+        if line.rstrip().rstrip(',') == header + '[]':
+            return
+        
+        lines = []
+        for line in f:
+            if line.startswith('  ]'):
+                return
+            lines.append(line)
+            if line.rstrip().rstrip(',') == '    }':
+                yield json.loads(''.join(lines).rstrip().rstrip(','))
+                lines = []
+
+def link_or_copy(source: str, destination: str):
+    """Hardlink a file, or copy it where that isn't possible"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def digest_of(data: Any) -> str:
+    """Stable checksum of JSON-serializable API data, ignoring volatile fields"""
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+    return hashlib.sha256(json.dumps(strip(data), sort_keys=True).encode()).hexdigest()
+
 class AtlosExporter:
-    def __init__(self, api_key: str, base_url: str = "https://platform.atlos.org"):
+    def __init__(self, api_key: str, base_url: str = "https://platform.atlos.org",
+                 rate_limit: float = 10.0, max_retries: int = 5, timeout: float = 60.0,
+                 download_concurrency: int = 16, dedupe: bool = False,
+                 incident_filter: Optional[IncidentFilter] = None, archive: Optional[Path] = None,
+                 compress_json: bool = False):
         self.api_key = api_key
         self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.download_concurrency = download_concurrency
+        self.dedupe = dedupe
+        self.incident_filter = incident_filter
+        self.archive = archive
+        self.compress_json = compress_json
+        self.sink: Optional[ArchiveSink] = None
+        self.blobs: Optional[BlobStore] = None
+        self.output_dir: Optional[Path] = None
+        self.manifest: Optional[ExportManifest] = None
+        self.downloads: Optional[DownloadScheduler] = None
+        self.stats = ExportStats()
         self.session = requests.Session()
         self.session.headers.update({
             'Authorization': f'Bearer {api_key}',
             'User-Agent': f'Atlos-Export-Script/{SCRIPT_VERSION}'
         })
+        # Keep connections alive across requests, with enough for every concurrent fetch
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
     def _make_request(self, endpoint: str, params: Optional[Dict] = None) -> Dict:
-        """Make authenticated API request"""
+        """Make authenticated API request, retrying with backoff on rate limits and server errors"""
         url = f"{self.base_url}/api/v2/{endpoint}"
-        response = self.session.get(url, params=params or {})
-        response.raise_for_status()
-        return response.json()
+        
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            requested = time.monotonic()
+            try:
+                response = self.session.get(url, params=params or {}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                reason = type(e).__name__
+                delay = backoff_delay(attempt)
+            else:
+                self.stats.record_latency('api', time.monotonic() - requested)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+                reason = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+                
+            print(f"Request to {endpoint} failed ({reason}), retrying in {delay:.1f}s...")
+            self.stats.record_retry('api')
+            time.sleep(delay)
+            
+    @contextlib.contextmanager
+    def _open_output(self, path: Path):
+        """Open an output file (in the output directory) for writing as text. When exporting to an
+        archive, this writes the archive member instead."""
+        if self.sink is None:
+            with atomic_open(path) as f:
+                yield f
+            return
+            
+        with self.sink.open_member(path.relative_to(self.output_dir).as_posix()) as member:
+            f = io.TextIOWrapper(member, encoding='utf-8')
+            try:
+                yield f
+            finally:
+                f.flush()
+                f.detach()
+                
+    def _output_file_written(self, path: Path):
+        """Called once a file has been downloaded to its place in the output directory. When exporting
+        to an archive, this moves the file into the archive."""
+        if self.sink is not None:
+            self.sink.add_file(path.relative_to(self.output_dir).as_posix(), path)
+            path.unlink()
             
-    def _download_file(self, url: str, filepath: Path) -> bool:
-        """Download a file from URL to local filepath"""
-        # Use a fresh session without auth headers for S3 downloads
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+    def _download_file(self, url: str, filepath: Path, sha256: Optional[str] = None) -> bool:
+        """Download a file from URL to local filepath, unless a previous export already did. Returns
+        whether the file was downloaded."""
+        relative_path = filepath.relative_to(self.output_dir).as_posix()
+        if self.manifest.file_is_current(relative_path, filepath, sha256):
+            print(f"    Already downloaded: {filepath.name}")
+            self.stats.record_skipped_file()
+            return False
+            
+        if self.blobs is not None:
+            return self._download_blob(url, filepath, sha256, relative_path)
+            
+        size, checksum = self.downloads.fetch(url, filepath)
+        self._output_file_written(filepath)
+        self.manifest.record_file(relative_path, size, checksum)
+        self.stats.record_file()
+        print(f"    Downloaded: {filepath.name} ({size} bytes)")
+        return True
         
-        filepath.parent.mkdir(parents=True, exist_ok=True)
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+    def _download_blob(self, url: str, filepath: Path, sha256: Optional[str], relative_path: str) -> bool:
+        """Download a file into the blob store and link it into place, unless the store already has
+        a file with the checksum the API reported"""
+        if sha256 is None:
+            return self._fetch_blob(url, filepath, relative_path)
+        with self.blobs.lock_for(sha256):
+            if self._link_existing_blob(sha256, filepath, relative_path):
+                return False
+            return self._fetch_blob(url, filepath, relative_path)
+            
+    def _fetch_blob(self, url: str, filepath: Path, relative_path: str) -> bool:
+        temp_path = self.blobs.temp_path(relative_path)
+        size, checksum = self.downloads.fetch(url, temp_path)
+        self._store_blob(temp_path, filepath, relative_path, size, checksum)
         return True
+        
+    def _link_existing_blob(self, sha256: str, filepath: Path, relative_path: str) -> bool:
+        """If the blob store already has the file, link it into place instead of downloading it"""
+        size = self.blobs.size(sha256)
+        if size is None:
+            return False
+        self.blobs.link(sha256, filepath)
+        self.manifest.record_file(relative_path, size, sha256)
+        self.stats.record_deduplicated_file(size)
+        print(f"    Deduplicated: {filepath.name}")
+        return True
+        
+    def _store_blob(self, temp_path: Path, filepath: Path, relative_path: str, size: int, checksum: str):
+        """Move a downloaded file into the blob store, and link it into place"""
+        duplicate = self.blobs.add(temp_path, checksum)
+        self.blobs.link(checksum, filepath)
+        self.manifest.record_file(relative_path, size, checksum)
+        if duplicate:
+            # We couldn't tell it was a duplicate until we had downloaded it (its bytes still count
+            # as downloaded), but it's stored only once, so it counts as a deduplicated file
+            self.stats.record_deduplicated_file(size)
+            print(f"    Deduplicated after downloading: {filepath.name}")
+        else:
+            self.stats.record_file()
+            print(f"    Downloaded: {filepath.name} ({size} bytes)")
+        
+    def _schedule_download(self, url: str, filepath: Path, sha256: Optional[str] = None) -> Future:
+        """Queue a file to be downloaded (see `_download_file`)"""
+        return self.downloads.submit(self._download_file, url, filepath, sha256,
+                                     description=filepath.relative_to(self.output_dir).as_posix())
             
-    def _paginate_all(self, endpoint: str, params: Optional[Dict] = None) -> List[Dict]:
-        """Fetch all results from a paginated endpoint"""
-        all_results = []
+    def _iter_paginated(self, endpoint: str, params: Optional[Dict] = None,
+                        stop: Optional[Callable[[Dict], bool]] = None) -> Iterator[Dict]:
+        """Yield all results from a paginated endpoint, a page at a time. If `stop` is given, stop after
+        the first page with a result for which it returns true."""
+        fetched = 0
         cursor = None
         
         while True:
@@ -64,25 +1123,60 @@ class AtlosExporter:
                 
             data = self._make_request(endpoint, request_params)
             results = data.get('results', [])
-            all_results.extend(results)
+            yield from results
+            fetched += len(results)
             
             cursor = data.get('next')
             if not cursor:
                 break
+            if stop and any(stop(result) for result in results):
+                break
                 
-            print(f"Fetched {len(all_results)} items from {endpoint}...")
+            print(f"Fetched {fetched} items from {endpoint}...")
             
-        return all_results
+    def _paginate_all(self, endpoint: str, params: Optional[Dict] = None,
+                      stop: Optional[Callable[[Dict], bool]] = None) -> List[Dict]:
+        """Fetch all results from a paginated endpoint (see `_iter_paginated`)"""
+        return list(self._iter_paginated(endpoint, params, stop))
         
-    def fetch_incidents(self) -> List[Dict]:
-        """Fetch all incidents in the project"""
+    def _collection_query(self, name: str, since: Optional[str] = None) -> tuple:
+        """How to fetch a collection: the endpoint and params to paginate, plus (if only fetching what
+        changed at or after `since`) when to stop paginating and which items to keep"""
+        if since is None or name == 'source_material':
+            # Source material isn't listed in modification order, so we always fetch all of it
+            return name, None, None, None
+        if name == 'incidents':
+            # Most recently modified first, so that we can stop once we reach older incidents
+            return ('incidents', {'sort': 'modified_desc'},
+                    lambda incident: incident['updated_at'] < since,
+                    lambda incident: incident['updated_at'] >= since)
+        # Updates are listed newest first
+        return ('updates', None,
+                lambda update: update['inserted_at'] < since,
+                lambda update: update['inserted_at'] >= since)
+        
+    def _iter_collection(self, name: str, since: Optional[str] = None) -> Iterator[Dict]:
+        endpoint, params, stop, keep = self._collection_query(name, since)
+        items = self._iter_paginated(endpoint, params, stop)
+        yield from (item for item in items if keep is None or keep(item))
+        
+    def iter_incidents(self, since: Optional[str] = None) -> Iterator[Dict]:
+        """Yield all incidents in the project, or only those updated at or after `since`"""
         print("Fetching incidents...")
-        return self._paginate_all('incidents')
+        yield from self._iter_collection('incidents', since)
+        
+    def fetch_incidents(self, since: Optional[str] = None) -> List[Dict]:
+        """Fetch all incidents in the project, or only those updated at or after `since`"""
+        return list(self.iter_incidents(since))
+        
+    def iter_source_material(self) -> Iterator[Dict]:
+        """Yield all source material in the project"""
+        print("Fetching source material...")
+        yield from self._iter_collection('source_material')
         
     def fetch_source_material(self) -> List[Dict]:
         """Fetch all source material in the project"""
-        print("Fetching source material...")
-        return self._paginate_all('source_material')
+        return list(self.iter_source_material())
         
     def fetch_updates(self, incident_slug: Optional[str] = None) -> List[Dict]:
         """Fetch updates/comments, optionally filtered by incident"""
@@ -90,144 +1184,423 @@ class AtlosExporter:
         params = {'slug': incident_slug} if incident_slug else None
         return self._paginate_all(endpoint, params)
         
-    def fetch_all_updates(self) -> List[Dict]:
-        """Fetch all updates/comments in the project"""
+    def iter_all_updates(self, since: Optional[str] = None) -> Iterator[Dict]:
+        """Yield all updates/comments in the project, or only those posted at or after `since`"""
         print("Fetching all updates and comments...")
-        return self._paginate_all('updates')
+        yield from self._iter_collection('updates', since)
+        
+    def fetch_all_updates(self, since: Optional[str] = None) -> List[Dict]:
+        """Fetch all updates/comments in the project, or only those posted at or after `since`"""
+        return list(self.iter_all_updates(since))
+        
+    def export_project(self, output_dir: Path, incremental: bool = False, ndjson: bool = False):
+        """Export entire project to structured directory. If `incremental`, only fetch and write what
+        changed since the last export to the same directory. If `ndjson`, also write each collection
+        as newline-delimited JSON to `ndjson/`."""
+        try:
+            self._export_project(output_dir, incremental, ndjson)
+        except BaseException:
+            self._abandon_export()
+            raise
+            
+        # Let it fail loud, but only after everything else has been exported
+        self.stats.raise_failures()
+        
+        print(f"\n=== Export Complete ===")
+        print(f"Export saved to: {self.output_dir.absolute()}")
         
-    def export_project(self, output_dir: Path):
-        """Export entire project to structured directory"""
+    def _export_project(self, output_dir: Path, incremental: bool, ndjson: bool):
+        watermarks = self._begin_export(output_dir, incremental)
+        self.downloads = DownloadScheduler(self.stats, self.download_concurrency)
+        
+        # Fetch all data (the collections are independent, so fetch them concurrently)
+        print("\n=== Fetching Data ===")
+        async def fetch_all():
+            async def fetch(name, items):
+                await trio.to_thread.run_sync(self.spools[name].extend, items)
+                
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(fetch, 'incidents',
+                                   self.iter_incidents(since=watermarks.get('incidents')))
+                nursery.start_soon(fetch, 'source_material', self.iter_source_material())
+                nursery.start_soon(fetch, 'updates',
+                                   self.iter_all_updates(since=watermarks.get('updates')))
+                
+        with self.stats.phase('fetch'):
+            trio.run(fetch_all)
+        with self.stats.phase('organize'):
+            self._organize_export()
+        
+        print("\n=== Processing Incidents ===")
+        
+        def process_incident(index):
+            started = time.monotonic()
+            prepared = self._prepare_incident(index)
+            if prepared is None:
+                return
+            incident_slug, incident_dir, incident_data, digest = prepared
+            
+            print(f"Processing incident {incident_slug}")
+            
+            # Save incident JSON
+            with self._open_output(incident_dir / 'incident_data.json') as f:
+                json.dump(incident_data, f, indent=2, ensure_ascii=False)
+                
+            # Create human-readable summary
+            self._create_incident_summary(incident_dir / 'README.md', incident_data)
+            
+            # Queue downloads of artifacts from source material and comment attachments
+            downloads = []
+            for planned in self._plan_incident_downloads(incident_dir, incident_data):
+                downloads.append(self._schedule_download(planned.url, planned.filepath, planned.sha256))
+                with self._open_output(planned.metadata_file) as f:
+                    json.dump(planned.metadata, f, indent=2)
+                    
+            # The incident is only done once all of its files are
+            self.downloads.when_all_done(
+                downloads, lambda: self.manifest.record_incident(incident_slug, digest))
+            self.stats.record_incident()
+            self.stats.record_latency('incident', time.monotonic() - started)
+        
+        async def process_incidents():
+            async with trio.open_nursery() as nursery:
+                limiter = trio.CapacityLimiter(20)  # max 20 incidents at a time
+                async def process_incident_async_wrapper(index):
+                    async with limiter:
+                        await trio.to_thread.run_sync(process_incident, index)
+                
+                for index in range(len(self.spools['incidents'])):
+                    nursery.start_soon(process_incident_async_wrapper, index)
+        
+        with self.stats.phase('incidents'):
+            trio.run(process_incidents)
+        
+        print("\n=== Waiting for Downloads ===")
+        with self.stats.phase('downloads'):
+            self.downloads.shutdown()
+        print(self.stats.summary())
+        
+        self._finish_export(ndjson)
+        
+    def _begin_export(self, output_dir: Path, incremental: bool) -> Dict[str, str]:
+        """Set up the output directory, manifest and spools for an export. Returns the watermarks to
+        fetch changes since (empty, unless this is an incremental export)."""
+        if self.archive is not None:
+            # The output directory only holds work in progress (e.g., spools and partial downloads)
+            output_dir = Path(str(self.archive) + '.work')
+            self.sink = ArchiveSink(self.archive, compress_json=self.compress_json)
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        self.manifest = ExportManifest(output_dir, resume=incremental)
+        self.stats = ExportStats()
+        self.stats.start_progress()
+        self.blobs = BlobStore(output_dir) if self.dedupe else None
         
         print(f"Starting export to {output_dir}")
         
+        # An incremental export builds on the previous export's data
+        self.has_previous_export = (incremental and bool(self.manifest.watermarks)
+                                    and (output_dir / 'export_data.json').exists())
+        if self.has_previous_export:
+            print(f"Incremental export: fetching changes since {self.manifest.watermarks}")
+        elif incremental:
+            print("No previous export found, doing a full export")
+            
+        # Items are spooled to disk as pages arrive, rather than collected in memory
+        self.spools = {name: CollectionSpool(output_dir / '.spool' / f'{name}.ndjson')
+                       for name in ('incidents', 'source_material', 'updates')}
+        
         # Create export metadata
-        export_info = {
+        self.export_info = {
             'export_timestamp': datetime.now().isoformat(),
             'base_url': self.base_url,
             'script_version': SCRIPT_VERSION
         }
         
-        # Fetch all data
-        print("\n=== Fetching Data ===")
-        incidents = self.fetch_incidents()
-        source_material = self.fetch_source_material()
-        all_updates = self.fetch_all_updates()
+        watermarks = dict(self.manifest.watermarks) if self.has_previous_export else {}
+        
+        # No need to fetch incidents that the filter would drop anyway
+        updated_since = self.incident_filter.updated_since if self.incident_filter else None
+        if updated_since is not None:
+            watermarks['incidents'] = max(watermarks.get('incidents') or updated_since, updated_since)
+        return watermarks
+        
+    def _iter_previous(self, name: str) -> Iterator[Dict]:
+        """The items of a collection as of the previous export"""
+        path = self.output_dir / 'ndjson' / f'{name}.ndjson'
+        if path.exists():
+            yield from iter_ndjson(path)
+        else:
+            yield from iter_export_collection(self.output_dir / 'export_data.json', name)
+                
+    def _organize_export(self):
+        """Once everything has been fetched: group source material and updates by incident, and write
+        `export_data.json`"""
+        spools = self.spools
+        if self.has_previous_export:
+            print(f"Fetched {len(spools['incidents'])} changed incidents and "
+                  f"{len(spools['updates'])} new updates/comments")
+            # Keep the previous version of everything that wasn't fetched again
+            for name in ('incidents', 'updates'):
+                spool = spools[name]
+                fetched_ids = set(spool.ids)
+                spool.extend(item for item in self._iter_previous(name) if item['id'] not in fetched_ids)
+                
+        for spool in spools.values():
+            spool.finish()
+            
+        if self.incident_filter is not None and self.incident_filter.is_active():
+            spools['incidents'] = spools['incidents'].filtered(self.incident_filter)
+            selected = spools['incidents'].ids
+            spools['source_material'] = spools['source_material'].filtered(
+                lambda sm: sm.get('incident_id') in selected)
+            spools['updates'] = spools['updates'].filtered(
+                lambda update: update.get('media_id') in selected)
+            
+        incidents = spools['incidents']
+        source_material = spools['source_material']
+        all_updates = spools['updates']
         
+        self.stats.incidents_total = len(incidents)
         print(f"Found {len(incidents)} incidents")
         print(f"Found {len(source_material)} source material items")
         print(f"Found {len(all_updates)} updates/comments")
         
-        # Create data structures
+        # Create data structures (of positions in the spools, rather than the items themselves)
         print("\n=== Organizing Data ===")
         
         # Group source material (media versions) by incident (media)
-        source_by_incident = {}
-        for sm in source_material:
+        self.source_by_incident = {}
+        for index, sm in enumerate(source_material):
             media_id = sm.get('incident_id')
-            if media_id not in source_by_incident:
-                source_by_incident[media_id] = []    
-            source_by_incident[media_id].append(sm)
+            if media_id not in self.source_by_incident:
+                self.source_by_incident[media_id] = []    
+            self.source_by_incident[media_id].append(index)
                 
         # Group updates (comments) by incident (media)  
         # media_id in updates directly refers to the incident ID
-        updates_by_incident = {}
-        for update in all_updates:
+        self.updates_by_incident = {}
+        updates_watermark = None
+        for index, update in enumerate(all_updates):
             media_id = update.get('media_id')  # This is the incident ID
-            if media_id not in updates_by_incident:
-                updates_by_incident[media_id] = []
-            updates_by_incident[media_id].append(update)
-        
-        # Create main export structure
-        export_data = {
-            'export_info': export_info,
-            'incidents': incidents,
-            'source_material': source_material,
-            'updates': all_updates,
-            'summary': {
-                'total_incidents': len(incidents),
-                'total_source_material': len(source_material),
-                'total_updates': len(all_updates)
-            }
+            if media_id not in self.updates_by_incident:
+                self.updates_by_incident[media_id] = []
+            self.updates_by_incident[media_id].append(index)
+            updates_watermark = max(updates_watermark or update['inserted_at'], update['inserted_at'])
+            
+        self.summary = {
+            'total_incidents': len(incidents),
+            'total_source_material': len(source_material),
+            'total_updates': len(all_updates)
         }
         
         # Save main export JSON
-        with open(output_dir / 'export_data.json', 'w') as f:
-            json.dump(export_data, f, indent=2, ensure_ascii=False)
+        with self._open_output(self.output_dir / 'export_data.json') as f:
+            write_export_data(f, self.export_info, spools, self.summary)
             
+        # Everything up to these points in time is now in export_data.json
+        self.manifest.record_watermarks({
+            'incidents': max((i['updated_at'] for i in incidents), default=None),
+            'updates': updates_watermark,
+        })
+        
         # Create incidents directory
-        incidents_dir = output_dir / 'incidents'
-        incidents_dir.mkdir(exist_ok=True)
+        (self.output_dir / 'incidents').mkdir(exist_ok=True)
         
-        print("\n=== Processing Incidents ===")
+    def _prepare_incident(self, index: int) -> Optional[tuple]:
+        """Gather everything for the incident at the given position. Returns its slug, directory, data
+        and digest, or None if a previous export already wrote it and it hasn't changed since."""
+        incident = self.spools['incidents'][index]
+        incident_slug = incident['slug']
+        incident_id = incident['id']
         
-        def process_incident(incident):
-            incident_slug = incident['slug']
-            incident_id = incident['id']
-            
-            print(f"Processing incident {incident_slug}")
-            
-            # Create incident directory
-            incident_dir = incidents_dir / incident_slug
-            incident_dir.mkdir(exist_ok=True)
-            
-            # Get related data  
-            incident_source_material = source_by_incident.get(incident_id)  # media versions for this media (incident)
-            incident_comments = updates_by_incident.get(incident_id)  # comments for this media (incident)
-            
-            # Create comprehensive incident data
-            incident_data = {
-                'incident': incident,
-                'source_material': incident_source_material,  # media versions
-                'comments': incident_comments,  # updates = comments
-                'summary': {
-                    'source_material_count': len(incident_source_material),
-                    'comments_count': len(incident_comments),
-                    'artifacts_count': sum(len(sm.get('artifacts', [])) for sm in incident_source_material)
-                }
+        # Create incident directory
+        incident_dir = self.output_dir / 'incidents' / incident_slug
+        incident_dir.mkdir(exist_ok=True)
+        
+        # Get related data  
+        source_material = self.spools['source_material']
+        all_updates = self.spools['updates']
+        incident_source_material = [source_material[i] for i in self.source_by_incident.get(incident_id, [])]  # media versions for this media (incident)
+        incident_comments = [all_updates[i] for i in self.updates_by_incident.get(incident_id, [])]  # comments for this media (incident)
+        
+        # Create comprehensive incident data
+        incident_data = {
+            'incident': incident,
+            'source_material': incident_source_material,  # media versions
+            'comments': incident_comments,  # updates = comments
+            'summary': {
+                'source_material_count': len(incident_source_material),
+                'comments_count': len(incident_comments),
+                'artifacts_count': sum(len(sm.get('artifacts', [])) for sm in incident_source_material)
             }
+        }
+        
+        # Skip incidents that were completely exported by a previous run and haven't changed since
+        digest = digest_of(incident_data)
+        if self.manifest.incident_is_current(incident_slug, digest):
+            self.stats.record_incident(skipped=True)
+            return None
+        return incident_slug, incident_dir, incident_data, digest
+        
+    def _finish_export(self, ndjson: bool):
+        """Clean up the spools (keeping them as NDJSON if asked to), and write the project summary and
+        stats"""
+        # Later incremental exports also read the NDJSON files
+        ndjson_dir = self.output_dir / 'ndjson'
+        for name, spool in self.spools.items():
+            spool.close()
+            if ndjson:
+                ndjson_dir.mkdir(exist_ok=True)
+                os.replace(spool.path, ndjson_dir / f'{name}.ndjson')
+                self._output_file_written(ndjson_dir / f'{name}.ndjson')
+        if not ndjson and ndjson_dir.exists():
+            # Left over from an earlier export, and now out of date
+            shutil.rmtree(ndjson_dir)
+        shutil.rmtree(self.output_dir / '.spool')
+        
+        # Create overall project summary
+        self._create_project_summary(self.output_dir / 'README.md',
+                                     {'export_info': self.export_info, 'summary': self.summary})
+        
+        self.manifest.compact()
+        self.manifest.close()
+        
+        self.stats.stop_progress()
+        with self._open_output(self.output_dir / ExportStats.FILENAME) as f:
+            json.dump(self.stats.to_dict(), f, indent=2)
             
-            # Save incident JSON
-            with open(incident_dir / 'incident_data.json', 'w') as f:
-                json.dump(incident_data, f, indent=2, ensure_ascii=False)
-                
-            # Create human-readable summary
-            self._create_incident_summary(incident_dir / 'README.md', incident_data)
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+            shutil.rmtree(self.output_dir)
+            self.output_dir = self.archive
+        
+    def _abandon_export(self):
+        """Clean up after an export that failed partway. A directory export is left as it is, for an
+        incremental export to pick up where it left off; but an archive can't be added to later, so
+        the unfinished archive and its work directory are removed."""
+        self.stats.stop_progress()
+        if self.downloads is not None:
+            self.downloads.cancel()
+        if self.sink is None:
+            return
+        self.sink.abort()
+        self.sink = None
+        for spool in getattr(self, 'spools', {}).values():
+            spool.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        if self.output_dir is not None:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+        
+    def merge_exports(self, shard_dirs: List[Path], output_dir: Path):
+        """Combine several exports of the same project (e.g., the shards of a `--shard i/N` export)
+        into one, with a single `export_data.json` and `README.md`. Files are hardlinked rather than
+        copied where possible, so the shards should be on the same filesystem as the output."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        
+        print(f"Merging {len(shard_dirs)} exports into {output_dir}")
+        
+        self.spools = {name: CollectionSpool(output_dir / '.spool' / f'{name}.ndjson')
+                       for name in ('incidents', 'source_material', 'updates')}
+        shard_infos = []
+        shard_stats = []
+        has_blobs = False
+        
+        for shard_dir in map(Path, shard_dirs):
+            print(f"Merging {shard_dir}")
             
-            # Download artifacts from source material
-            if incident_source_material:
-                artifacts_dir = incident_dir / 'source_material_files'
-                self._download_artifacts(incident_source_material, artifacts_dir)
+            # Prefer the NDJSON collections, so that we don't have to load the whole export at once
+            if all((shard_dir / 'ndjson' / f'{name}.ndjson').exists() for name in self.spools):
+                collections = {name: iter_ndjson(shard_dir / 'ndjson' / f'{name}.ndjson')
+                               for name in self.spools}
+                shard_infos.append(read_export_info(shard_dir / 'export_data.json'))
+            else:
+                with open(shard_dir / 'export_data.json') as f:
+                    export_data = json.load(f)
+                collections = {name: export_data[name] for name in self.spools}
+                shard_infos.append(export_data['export_info'])
                 
-            # Download comment attachments
-            if incident_comments:
-                comments_with_attachments = [c for c in incident_comments if c.get('attachment_urls')]
-                if comments_with_attachments:
-                    attachments_dir = incident_dir / 'comment_attachments'
-                    self._download_comment_attachments(comments_with_attachments, attachments_dir)
+            # Each incident (and so its source material and updates) should be in exactly one shard
+            for name, items in collections.items():
+                spool = self.spools[name]
+                for item in items:
+                    if item['id'] in spool.ids:
+                        print(f"  Skipping duplicate {name} item {item['id']}")
+                        continue
+                    spool.append(item)
+                    
+            for directory in ('incidents', BlobStore.DIRECTORY):
+                if (shard_dir / directory).exists():
+                    shutil.copytree(shard_dir / directory, output_dir / directory, symlinks=True,
+                                    copy_function=link_or_copy, dirs_exist_ok=True)
+            has_blobs = has_blobs or (shard_dir / BlobStore.DIRECTORY).exists()
+            if (shard_dir / ExportStats.FILENAME).exists():
+                with open(shard_dir / ExportStats.FILENAME) as f:
+                    shard_stats.append(json.load(f))
+            
+        for spool in self.spools.values():
+            spool.finish()
+            
+        # List incidents and updates in the order the API does (like an unsharded export would), rather
+        # than shard by shard: newest first, by when they were created (and then by ID, for ties)
+        for name in ('incidents', 'updates'):
+            self.spools[name] = self.spools[name].sorted_by(
+                lambda item: (item['inserted_at'], item['id']), reverse=True)
+            
+        self.export_info = {
+            'export_timestamp': datetime.now().isoformat(),
+            'base_url': shard_infos[0]['base_url'] if shard_infos else self.base_url,
+            'script_version': SCRIPT_VERSION,
+            'merged_from': shard_infos,
+        }
+        self.summary = {
+            'total_incidents': len(self.spools['incidents']),
+            'total_source_material': len(self.spools['source_material']),
+            'total_updates': len(self.spools['updates'])
+        }
+        with atomic_open(output_dir / 'export_data.json') as f:
+            write_export_data(f, self.export_info, self.spools, self.summary)
         
-        async def process_incidents():
-            async with trio.open_nursery() as nursery:
-                limiter = trio.CapacityLimiter(20)  # max 20 incidents at a time
-                async def process_incident_async_wrapper(incident):
-                    async with limiter:
-                        await trio.to_thread.run_sync(process_incident, incident)
-                
-                for incident in incidents:
-                    nursery.start_soon(process_incident_async_wrapper, incident)
+        for spool in self.spools.values():
+            spool.close()
+        shutil.rmtree(output_dir / '.spool')
         
-        trio.run(process_incidents)
-
-        # Create overall project summary
-        self._create_project_summary(output_dir / 'README.md', export_data)
+        with open(output_dir / ExportStats.FILENAME, 'w') as f:
+            json.dump({'shards': shard_stats}, f, indent=2)
+            
+        if has_blobs:
+            self.blobs = BlobStore(output_dir)
+        self._create_project_summary(output_dir / 'README.md',
+                                     {'export_info': self.export_info, 'summary': self.summary})
         
-        print(f"\n=== Export Complete ===")
-        print(f"Export saved to: {output_dir.absolute()}")
+        print(f"\n=== Merge Complete ===")
+        print(f"Merged {self.summary['total_incidents']} incidents into: {output_dir.absolute()}")
         
-    def _download_artifacts(self, source_material: List[Dict], artifacts_dir: Path):
-        """Download all artifacts for source material"""
+    def _plan_incident_downloads(self, incident_dir: Path, incident_data: Dict) -> List[PlannedDownload]:
+        """Every file to download for an incident: artifacts from source material, and comment
+        attachments"""
+        planned = []
+        if incident_data['source_material']:
+            artifacts_dir = incident_dir / 'source_material_files'
+            planned += self._plan_artifact_downloads(incident_data['source_material'], artifacts_dir)
+            
+        comments_with_attachments = [c for c in incident_data['comments'] if c.get('attachment_urls')]
+        if comments_with_attachments:
+            attachments_dir = incident_dir / 'comment_attachments'
+            planned += self._plan_comment_attachment_downloads(comments_with_attachments, attachments_dir)
+            
+        self.stats.record_planned_files(len(planned))
+        return planned
+        
+    def _plan_artifact_downloads(self, source_material: List[Dict], artifacts_dir: Path) -> List[PlannedDownload]:
+        """Plan downloads of all artifacts for source material"""
         artifacts_dir.mkdir(exist_ok=True)
+        downloads = []
         
         for sm in source_material:
             sm_id = sm['id']
@@ -264,10 +1637,7 @@ class AtlosExporter:
                 filename = "_".join(filename_parts) + ext
                 filepath = sm_dir / filename
                 
-                print(f"    Downloading: {filename} ({artifact['file_size']} bytes)")
-                self._download_file(file_url, filepath)
-                
-                # Save artifact metadata
+                # Artifact metadata, saved alongside the file
                 metadata = {
                     'artifact_info': artifact,
                     'local_filename': filename,
@@ -276,12 +1646,15 @@ class AtlosExporter:
                 }
                     
                 metadata_file = sm_dir / f"{filename}.metadata.json"
-                with open(metadata_file, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                downloads.append(PlannedDownload(file_url, filepath, artifact.get('file_hash_sha256'),
+                                                 metadata_file, metadata))
                     
-    def _download_comment_attachments(self, updates: List[Dict], attachments_dir: Path):
-        """Download all files attached to comments/updates"""
+        return downloads
+                    
+    def _plan_comment_attachment_downloads(self, updates: List[Dict], attachments_dir: Path) -> List[PlannedDownload]:
+        """Plan downloads of all files attached to comments/updates"""
         attachments_dir.mkdir(exist_ok=True)
+        downloads = []
         
         for update in updates:
             if not update['attachment_urls']:
@@ -311,10 +1684,7 @@ class AtlosExporter:
                 filename = "".join(c for c in original_name if c.isalnum() or c in (' ', '-', '_', '.')).strip()
                 filepath = update_dir / filename
                 
-                print(f"    Downloading: {filename}")
-                self._download_file(url, filepath)
-                
-                # Save attachment metadata
+                # Attachment metadata, saved alongside the file
                 metadata = {
                     'comment_info': {  # update = comment
                         'id': update['id'],
@@ -328,8 +1698,9 @@ class AtlosExporter:
                 }
                     
                 metadata_file = update_dir / f"{filename}.metadata.json"
-                with open(metadata_file, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                downloads.append(PlannedDownload(url, filepath, None, metadata_file, metadata))
+                    
+        return downloads
                     
     def _create_incident_summary(self, filepath: Path, incident_data: Dict):
         """Create human-readable incident summary"""
@@ -337,7 +1708,7 @@ class AtlosExporter:
         source_material = incident_data['source_material']  # media versions
         comments = incident_data['comments']  # updates = comments
         
-        with open(filepath, 'w') as f:
+        with self._open_output(filepath) as f:
             f.write(f"# Incident {incident['slug']}\n\n")
             
             # Basic info
@@ -415,7 +1786,7 @@ class AtlosExporter:
         """Create human-readable project summary"""
         summary = export_data['summary']
         
-        with open(filepath, 'w') as f:
+        with self._open_output(filepath) as f:
             f.write("# Atlos Project Export\n\n")
             f.write(f"Export completed: {export_data['export_info']['export_timestamp']}\n\n")
             
@@ -429,6 +1800,11 @@ class AtlosExporter:
             f.write("export/\n")
             f.write("├── README.md                 # This file\n")
             f.write("├── export_data.json          # Complete export in JSON format\n")
+            f.write("├── export_stats.json         # Timings and throughput of this export\n")
+            if self.sink is not None:
+                f.write(f"├── {ArchiveSink.INDEX_NAME}                # Where each member of this archive is\n")
+            if self.blobs is not None:
+                f.write("├── blobs/sha256/             # One copy of each file, linked from incident folders\n")
             f.write("└── incidents/                # Individual incident folders\n")
             f.write("    └── [INCIDENT_SLUG]/      # One folder per incident\n")
             f.write("        ├── README.md         # Human-readable incident summary\n")
@@ -439,15 +1815,347 @@ class AtlosExporter:
             f.write("            └── [DATE]_[USER]_[ID]/ # Grouped by comment\n")
             f.write("```\n\n")
 
+class AsyncAtlosExporter(AtlosExporter):
+    """An exporter that does all of its network I/O asynchronously on a single trio thread, using
+    httpx instead of requests. API calls, file downloads and disk writes each have their own limit,
+    so thousands of downloads can be in flight without a thread for each."""
+    CHUNK_SIZE = DownloadScheduler.CHUNK_SIZE
+    
+    # Incidents processed at a time, like the threaded exporter. Each one holds its data and planned
+    # downloads in memory until its files are done.
+    INCIDENT_CONCURRENCY = 20
+    
+    def __init__(self, api_key: str, base_url: str = "https://platform.atlos.org",
+                 rate_limit: float = 10.0, max_retries: int = 5, timeout: float = 60.0,
+                 download_concurrency: int = 64, api_concurrency: int = 8, disk_concurrency: int = 16,
+                 dedupe: bool = False, incident_filter: Optional[IncidentFilter] = None,
+                 archive: Optional[Path] = None, compress_json: bool = False):
+        super().__init__(api_key, base_url, rate_limit=rate_limit, max_retries=max_retries,
+                         timeout=timeout, download_concurrency=download_concurrency, dedupe=dedupe,
+                         incident_filter=incident_filter, archive=archive, compress_json=compress_json)
+        self.api_concurrency = api_concurrency
+        self.disk_concurrency = disk_concurrency
+        
+    def export_project(self, output_dir: Path, incremental: bool = False, ndjson: bool = False):
+        trio.run(self.export_project_async, output_dir, incremental, ndjson)
+        
+    async def _run_disk_io(self, function: Callable, *args):
+        """Run blocking disk I/O in a worker thread, within the disk I/O limit"""
+        return await trio.to_thread.run_sync(function, *args, limiter=self.disk_limiter)
+        
+    async def _make_request_async(self, endpoint: str, params: Optional[Dict] = None) -> Dict:
+        """Make authenticated API request, retrying with backoff on rate limits and server errors"""
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            try:
+                async with self.api_limiter:
+                    requested = time.monotonic()
+                    response = await self.api_client.get(f"api/v2/{endpoint}", params=params or {})
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                reason = type(e).__name__
+                delay = backoff_delay(attempt)
+            else:
+                self.stats.record_latency('api', time.monotonic() - requested)
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+                reason = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else backoff_delay(attempt)
+                
+            print(f"Request to {endpoint} failed ({reason}), retrying in {delay:.1f}s...")
+            self.stats.record_retry('api')
+            await trio.sleep(delay)
+            
+    async def _fetch_collection(self, name: str, since: Optional[str] = None):
+        """Fetch a collection into its spool (see `_collection_query`)"""
+        endpoint, params, stop, keep = self._collection_query(name, since)
+        spool = self.spools[name]
+        fetched = 0
+        cursor = None
+        
+        while True:
+            request_params = params.copy() if params else {}
+            if cursor:
+                request_params['cursor'] = cursor
+                
+            data = await self._make_request_async(endpoint, request_params)
+            results = data.get('results', [])
+            await self._run_disk_io(spool.extend,
+                                    [result for result in results if keep is None or keep(result)])
+            fetched += len(results)
+            
+            cursor = data.get('next')
+            if not cursor:
+                break
+            if stop and any(stop(result) for result in results):
+                break
+                
+            print(f"Fetched {fetched} items from {endpoint}...")
+            
+    async def _fetch_file(self, url: str, filepath: Path) -> tuple:
+        """Download a URL to a local filepath, resuming from (and retrying into) a `.part` file like
+        `DownloadScheduler.fetch`. Returns the file's size and SHA-256 checksum."""
+        temp_path = filepath.with_name(filepath.name + '.part')
+        
+        for attempt in range(self.max_retries + 1):
+            offset, headers = await self._run_disk_io(resume_request, temp_path)
+            try:
+                requested = time.monotonic()
+                async with self.download_client.stream('GET', url, headers=headers) as response:
+                    self.stats.record_latency('download', time.monotonic() - requested)
+                    if response.status_code == 416:
+                        # Our partial file doesn't line up with the remote file, so start over
+                        await self._run_disk_io(discard_partial_download, temp_path)
+                        raise RetryableDownloadError("HTTP 416")
+                    if response.status_code in RETRY_STATUSES:
+                        raise RetryableDownloadError(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+                    
+                    if await self._run_disk_io(start_partial_download, temp_path, offset,
+                                               response.status_code, response.headers):
+                        # Resuming: the checksum has to cover what we already have
+                        checksum = await self._run_disk_io(sha256_of_file, temp_path)
+                    else:
+                        checksum = hashlib.sha256()
+                    f = await self._run_disk_io(open, temp_path, 'ab')
+                        
+                    try:
+                        async for chunk in response.aiter_bytes(self.CHUNK_SIZE):
+                            await self._run_disk_io(f.write, chunk)
+                            checksum.update(chunk)
+                            self.stats.record_bytes(len(chunk))
+                    finally:
+                        await self._run_disk_io(f.close)
+                break
+            except (httpx.TransportError, RetryableDownloadError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"    Download of {filepath.name} failed ({e}), retrying in {delay:.1f}s...")
+                self.stats.record_retry('download')
+                await trio.sleep(delay)
+                
+        size = await self._run_disk_io(finish_partial_download, temp_path, filepath)
+        return size, checksum.hexdigest()
+        
+    async def _download_file_async(self, planned: PlannedDownload) -> bool:
+        """Download a planned file, unless a previous export already did. Returns whether it succeeded
+        (failures are recorded, rather than raised, so that they don't cancel other downloads)."""
+        filepath = planned.filepath
+        relative_path = filepath.relative_to(self.output_dir).as_posix()
+        try:
+            if await self._run_disk_io(self.manifest.file_is_current, relative_path, filepath,
+                                       planned.sha256):
+                print(f"    Already downloaded: {filepath.name}")
+                self.stats.record_skipped_file()
+                return True
+                
+            if self.blobs is not None:
+                if planned.sha256 is None:
+                    return await self._fetch_blob_async(planned.url, filepath, relative_path)
+                async with self.blobs.lock_for(planned.sha256, trio.Lock):
+                    if await self._run_disk_io(self._link_existing_blob, planned.sha256, filepath, relative_path):
+                        return True
+                    return await self._fetch_blob_async(planned.url, filepath, relative_path)
+                    
+            async with self.download_limiter:
+                size, checksum = await self._fetch_file(planned.url, filepath)
+            await self._run_disk_io(self._output_file_written, filepath)
+            await self._run_disk_io(self.manifest.record_file, relative_path, size, checksum)
+            self.stats.record_file()
+            print(f"    Downloaded: {filepath.name} ({size} bytes)")
+            return True
+        except (httpx.HTTPError, RetryableDownloadError, OSError) as e:
+            self.stats.record_failure(relative_path, e)
+            return False
+            
+    async def _fetch_blob_async(self, url: str, filepath: Path, relative_path: str) -> bool:
+        temp_path = self.blobs.temp_path(relative_path)
+        async with self.download_limiter:
+            size, checksum = await self._fetch_file(url, temp_path)
+        await self._run_disk_io(self._store_blob, temp_path, filepath, relative_path, size, checksum)
+        return True
+            
+    async def _process_incident_async(self, index: int):
+        started = time.monotonic()
+        prepared = await self._run_disk_io(self._prepare_incident, index)
+        if prepared is None:
+            return
+        incident_slug, incident_dir, incident_data, digest = prepared
+        
+        print(f"Processing incident {incident_slug}")
+        
+        def write_incident():
+            # Save incident JSON
+            with self._open_output(incident_dir / 'incident_data.json') as f:
+                json.dump(incident_data, f, indent=2, ensure_ascii=False)
+                
+            # Create human-readable summary
+            self._create_incident_summary(incident_dir / 'README.md', incident_data)
+            
+        def write_metadata(planned: PlannedDownload):
+            with self._open_output(planned.metadata_file) as f:
+                json.dump(planned.metadata, f, indent=2)
+                
+        await self._run_disk_io(write_incident)
+        self.stats.record_incident()
+        self.stats.record_latency('incident', time.monotonic() - started)
+        
+        results = []
+        async def download(planned: PlannedDownload):
+            await self._run_disk_io(write_metadata, planned)
+            results.append(await self._download_file_async(planned))
+            
+        planned_downloads = await self._run_disk_io(self._plan_incident_downloads, incident_dir,
+                                                    incident_data)
+        async with trio.open_nursery() as nursery:
+            for planned in planned_downloads:
+                nursery.start_soon(download, planned)
+                
+        # The incident is only done once all of its files are
+        if all(results):
+            await self._run_disk_io(self.manifest.record_incident, incident_slug, digest)
+            
+    async def export_project_async(self, output_dir: Path, incremental: bool = False, ndjson: bool = False):
+        """Export entire project to structured directory (see `AtlosExporter.export_project`)"""
+        self.api_limiter = trio.CapacityLimiter(self.api_concurrency)
+        self.download_limiter = trio.CapacityLimiter(self.download_concurrency)
+        self.disk_limiter = trio.CapacityLimiter(self.disk_concurrency)
+        try:
+            await self._export_project_async(output_dir, incremental, ndjson)
+        except BaseException:
+            # Shielded, since we may be here because we were cancelled
+            with trio.CancelScope(shield=True):
+                await trio.to_thread.run_sync(self._abandon_export)
+            raise
+            
+        # Let it fail loud, but only after everything else has been exported
+        self.stats.raise_failures()
+        
+        print(f"\n=== Export Complete ===")
+        print(f"Export saved to: {self.output_dir.absolute()}")
+        
+    async def _export_project_async(self, output_dir: Path, incremental: bool, ndjson: bool):
+        watermarks = await self._run_disk_io(self._begin_export, output_dir, incremental)
+        
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'User-Agent': f'Atlos-Export-Script/{SCRIPT_VERSION}'
+        }
+        # No auth headers for downloads, since these are (signed) storage URLs
+        async with httpx.AsyncClient(base_url=self.base_url + '/', headers=headers, timeout=self.timeout,
+                                     limits=httpx.Limits(max_connections=self.api_concurrency)) as api_client, \
+                   httpx.AsyncClient(timeout=self.timeout, follow_redirects=True,
+                                     limits=httpx.Limits(max_connections=self.download_concurrency)) as download_client:
+            self.api_client = api_client
+            self.download_client = download_client
+            
+            # Fetch all data (the collections are independent, so fetch them concurrently)
+            print("\n=== Fetching Data ===")
+            with self.stats.phase('fetch'):
+                async with trio.open_nursery() as nursery:
+                    print("Fetching incidents...")
+                    nursery.start_soon(self._fetch_collection, 'incidents', watermarks.get('incidents'))
+                    print("Fetching source material...")
+                    nursery.start_soon(self._fetch_collection, 'source_material')
+                    print("Fetching all updates and comments...")
+                    nursery.start_soon(self._fetch_collection, 'updates', watermarks.get('updates'))
+                    
+            with self.stats.phase('organize'):
+                await self._run_disk_io(self._organize_export)
+            
+            # Downloads happen as part of processing each incident
+            print("\n=== Processing Incidents ===")
+            with self.stats.phase('incidents'):
+                # Wait for a slot before starting each incident's task, so that there are never
+                # more tasks than incidents being processed
+                incident_limiter = trio.CapacityLimiter(self.INCIDENT_CONCURRENCY)
+                
+                async def process_incident(index: int):
+                    try:
+                        await self._process_incident_async(index)
+                    finally:
+                        incident_limiter.release_on_behalf_of(index)
+                        
+                async with trio.open_nursery() as nursery:
+                    for index in range(len(self.spools['incidents'])):
+                        await incident_limiter.acquire_on_behalf_of(index)
+                        nursery.start_soon(process_incident, index)
+                    
+        print(self.stats.summary())
+        
+        await self._run_disk_io(self._finish_export, ndjson)
+
 def main():
     parser = argparse.ArgumentParser(description='Export Atlos project data')
     parser.add_argument('--output', '-o', default='./export', 
                        help='Output directory (default: ./export)')
     parser.add_argument('--base-url', default='https://gap.atlos.org',
                        help='Atlos instance URL (default: gap.atlos.org)')
+    parser.add_argument('--rate-limit', type=float, default=10.0,
+                       help='Maximum API requests per second (default: 10)')
+    parser.add_argument('--max-retries', type=int, default=5,
+                       help='Retries for rate-limited or failed API requests (default: 5)')
+    parser.add_argument('--download-concurrency', type=int,
+                       help='Maximum number of files to download at once (default: 16, or 64 with --async)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                       help='Do all network I/O asynchronously on a single thread (suits very high '
+                            'download concurrency)')
+    parser.add_argument('--api-concurrency', type=int, default=8,
+                       help='With --async, maximum number of API requests in flight (default: 8)')
+    parser.add_argument('--disk-concurrency', type=int, default=16,
+                       help='With --async, maximum number of disk writes at once (default: 16)')
+    parser.add_argument('--ndjson', action='store_true',
+                       help='Also write each collection as newline-delimited JSON to ndjson/')
+    parser.add_argument('--dedupe', action='store_true',
+                       help='Store each distinct file once (in blobs/), hardlinked into incident folders')
+    parser.add_argument('--incident', dest='incidents', action='append', metavar='SLUG',
+                       help='Only export this incident (can be given more than once)')
+    parser.add_argument('--status', dest='statuses', action='append',
+                       help='Only export incidents with this status (can be given more than once)')
+    parser.add_argument('--created-after', metavar='DATE',
+                       help='Only export incidents created on or after this ISO 8601 date/time')
+    parser.add_argument('--created-before', metavar='DATE',
+                       help='Only export incidents created before this ISO 8601 date/time')
+    parser.add_argument('--updated-since', metavar='DATE',
+                       help='Only export incidents updated on or after this ISO 8601 date/time')
+    parser.add_argument('--shard', type=IncidentFilter.parse_shard, metavar='I/N',
+                       help='Only export shard I of N (zero-indexed) of the incidents, e.g. to split an '
+                            'export across several machines; combine the shards with --merge')
+    parser.add_argument('--merge', nargs='+', metavar='DIR',
+                       help='Instead of exporting, merge these exports (e.g. shards) into the output '
+                            'directory')
+    parser.add_argument('--archive', type=Path, metavar='FILE',
+                       help='Write the export straight into this .tar or .zip archive (with an index '
+                            'next to it) instead of a directory')
+    parser.add_argument('--compress-json', action='store_true',
+                       help='With --archive, compress JSON members with zstd')
+    parser.add_argument('--extract', metavar='SLUG',
+                       help='Instead of exporting, extract this incident from --archive into the output '
+                            'directory')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Only fetch and download what changed since the last export to the output '
+                            'directory (also resumes an interrupted export)')
     
     args = parser.parse_args()
+    if args.archive and (args.incremental or args.dedupe):
+        parser.error('--archive cannot be combined with --incremental or --dedupe')
+    if args.archive and args.archive.suffix not in ('.tar', '.zip'):
+        parser.error('--archive must be a .tar or .zip file')
+    if args.extract:
+        if not args.archive:
+            parser.error('--extract requires --archive')
+        extract_incident(args.archive, args.extract, Path(args.output))
+        return
     
+    if args.merge:
+        # Merging doesn't talk to Atlos, so it doesn't need an API key
+        AtlosExporter('', args.base_url).merge_exports(args.merge, Path(args.output))
+        return
+        
     # Load environment variables
     load_dotenv()
     api_key = os.getenv('API_KEY')
@@ -459,10 +2167,27 @@ def main():
     print(f"Using API key: {api_key[:10]}...")
     print(f"Connecting to: {args.base_url}")
     
-    exporter = AtlosExporter(api_key, args.base_url)
+    incident_filter = IncidentFilter(slugs=args.incidents, statuses=args.statuses,
+                                     created_after=args.created_after, created_before=args.created_before,
+                                     updated_since=args.updated_since, shard=args.shard)
+    
+    if args.use_async:
+        exporter = AsyncAtlosExporter(api_key, args.base_url,
+                                      rate_limit=args.rate_limit, max_retries=args.max_retries,
+                                      download_concurrency=args.download_concurrency or 64,
+                                      api_concurrency=args.api_concurrency,
+                                      disk_concurrency=args.disk_concurrency,
+                                      dedupe=args.dedupe, incident_filter=incident_filter,
+                                      archive=args.archive, compress_json=args.compress_json)
+    else:
+        exporter = AtlosExporter(api_key, args.base_url,
+                                 rate_limit=args.rate_limit, max_retries=args.max_retries,
+                                 download_concurrency=args.download_concurrency or 16,
+                                 dedupe=args.dedupe, incident_filter=incident_filter,
+                                 archive=args.archive, compress_json=args.compress_json)
     
     # Let it fail loud - no exception handling
-    exporter.export_project(Path(args.output))
+    exporter.export_project(Path(args.output), incremental=args.incremental, ndjson=args.ndjson)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
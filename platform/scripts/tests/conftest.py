@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The export script isn't a package, so make it importable by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
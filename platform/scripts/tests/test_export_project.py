@@ -0,0 +1,731 @@
+import argparse
+import hashlib
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+import trio
+
+import export_project
+from export_project import (
+    AsyncAtlosExporter,
+    ArchiveSink,
+    AtlosExporter,
+    BlobStore,
+    CollectionSpool,
+    DownloadScheduler,
+    ExportManifest,
+    ExportStats,
+    IncidentFilter,
+    RateLimiter,
+    RetryableDownloadError,
+    backoff_delay,
+    extract_incident,
+    start_partial_download,
+    validator_path,
+    write_export_data,
+)
+
+FILE_CONTENTS = b'0123456789' * 1000
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves FILE_CONTENTS, honoring Range requests if their If-Range matches the current ETag"""
+    protocol_version = 'HTTP/1.1'
+    etag = '"v2"'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.headers.get('Range'), self.headers.get('If-Range')))
+        body, headers = FILE_CONTENTS, {}
+        if self.headers.get('Range') and self.headers.get('If-Range') == self.etag:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            body = FILE_CONTENTS[start:]
+            headers['Content-Range'] = f'bytes {start}-{len(FILE_CONTENTS) - 1}/{len(FILE_CONTENTS)}'
+        self.send_response(206 if 'Content-Range' in headers else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def range_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_sync(url, filepath):
+    return DownloadScheduler(ExportStats(), concurrency=1, max_retries=0).fetch(url, filepath)
+
+
+def fetch_async(url, filepath):
+    exporter = AsyncAtlosExporter('x', max_retries=0)
+
+    async def fetch():
+        exporter.disk_limiter = trio.CapacityLimiter(1)
+        async with httpx.AsyncClient() as client:
+            exporter.download_client = client
+            return await exporter._fetch_file(url, filepath)
+
+    return trio.run(fetch)
+
+
+@pytest.mark.parametrize('fetch', [fetch_sync, fetch_async])
+@pytest.mark.parametrize('partial,validator', [
+    (FILE_CONTENTS[:700], '"v2"'),
+    # The file has changed since the partial download was started
+    (b'X' * 500, '"v1"'),
+    # Without a validator, we can't tell whether the file has changed
+    (b'Y' * 300, None),
+])
+def test_downloads_resume_only_from_matching_partial_files(range_server, tmp_path, fetch,
+                                                           partial, validator):
+    filepath = tmp_path / 'file.bin'
+    temp_path = tmp_path / 'file.bin.part'
+    temp_path.write_bytes(partial)
+    if validator:
+        validator_path(temp_path).write_text(validator)
+
+    url = f'http://127.0.0.1:{range_server.server_address[1]}/file.bin'
+    size, checksum = fetch(url, filepath)
+
+    assert (size, checksum) == (len(FILE_CONTENTS), hashlib.sha256(FILE_CONTENTS).hexdigest())
+    assert filepath.read_bytes() == FILE_CONTENTS
+    assert not temp_path.exists() and not validator_path(temp_path).exists()
+    if validator:
+        assert range_server.requests == [(f'bytes={len(partial)}-', validator)]
+    else:
+        assert range_server.requests == [(None, None)]
+
+
+def test_partial_responses_must_continue_the_partial_file(tmp_path):
+    temp_path = tmp_path / 'file.bin.part'
+    temp_path.write_bytes(b'abc')
+    validator_path(temp_path).write_text('"v1"')
+
+    assert start_partial_download(temp_path, 3, 206, {'Content-Range': 'bytes 3-9/10'})
+    with pytest.raises(RetryableDownloadError):
+        start_partial_download(temp_path, 3, 206, {'Content-Range': 'bytes 0-9/10'})
+    assert not temp_path.exists() and not validator_path(temp_path).exists()
+
+
+def test_full_responses_restart_the_partial_file(tmp_path):
+    temp_path = tmp_path / 'file.bin.part'
+    temp_path.write_bytes(b'abc')
+
+    assert not start_partial_download(temp_path, 3, 200, {'ETag': '"v2"'})
+    assert temp_path.read_bytes() == b''
+    assert validator_path(temp_path).read_text() == '"v2"'
+
+    # Weak ETags can't be used with If-Range
+    start_partial_download(temp_path, 0, 200, {'ETag': 'W/"v3"', 'Last-Modified': 'yesterday'})
+    assert validator_path(temp_path).read_text() == 'yesterday'
+    start_partial_download(temp_path, 0, 200, {'ETag': 'W/"v3"'})
+    assert not validator_path(temp_path).exists()
+
+
+def test_manifest_survives_restarts_and_partial_lines(tmp_path):
+    manifest = ExportManifest(tmp_path)
+    manifest.record_watermarks({'incidents': '2024-01-01T00:00:00'})
+    manifest.record_incident('ABC-1', 'digest-1')
+    manifest.record_incident('ABC-1', 'digest-2')
+    manifest.record_file('incidents/ABC-1/a.png', 3, 'sha-a')
+    manifest.close()
+
+    # As if we crashed partway through writing an entry
+    with open(tmp_path / ExportManifest.FILENAME, 'a') as f:
+        f.write('{"kind": "incident", "slu')
+
+    manifest = ExportManifest(tmp_path)
+    assert manifest.watermarks == {'incidents': '2024-01-01T00:00:00'}
+    assert manifest.incident_is_current('ABC-1', 'digest-2')
+    assert not manifest.incident_is_current('ABC-1', 'digest-1')
+    assert manifest.files == {'incidents/ABC-1/a.png': {'size': 3, 'sha256': 'sha-a'}}
+    manifest.close()
+
+
+def test_manifest_checks_files_on_disk(tmp_path):
+    manifest = ExportManifest(tmp_path)
+    path = tmp_path / 'a.png'
+    manifest.record_file('a.png', 3, 'sha-a')
+
+    # Recorded, but not on disk
+    assert not manifest.file_is_current('a.png', path)
+
+    path.write_bytes(b'abc')
+    assert manifest.file_is_current('a.png', path)
+    assert manifest.file_is_current('a.png', path, 'sha-a')
+    assert not manifest.file_is_current('a.png', path, 'sha-b')
+
+    # Truncated
+    path.write_bytes(b'ab')
+    assert not manifest.file_is_current('a.png', path)
+    assert not manifest.file_is_current('b.png', path)
+    manifest.close()
+
+
+def test_manifest_compacts_to_current_state(tmp_path):
+    manifest = ExportManifest(tmp_path)
+    for i in range(5):
+        manifest.record_incident('ABC-1', f'digest-{i}')
+    manifest.record_file('a.png', 3, 'sha-a')
+    manifest.compact()
+    manifest.record_incident('ABC-2', 'digest')
+    manifest.close()
+
+    with open(tmp_path / ExportManifest.FILENAME) as f:
+        entries = [json.loads(line) for line in f]
+    assert entries == [
+        {'kind': 'watermarks', 'watermarks': {}},
+        {'kind': 'incident', 'slug': 'ABC-1', 'digest': 'digest-4'},
+        {'kind': 'file', 'path': 'a.png', 'size': 3, 'sha256': 'sha-a'},
+        {'kind': 'incident', 'slug': 'ABC-2', 'digest': 'digest'},
+    ]
+
+
+def test_manifest_starts_over_without_resume(tmp_path):
+    manifest = ExportManifest(tmp_path)
+    manifest.record_incident('ABC-1', 'digest')
+    manifest.close()
+
+    manifest = ExportManifest(tmp_path, resume=False)
+    assert not manifest.incident_is_current('ABC-1', 'digest')
+    manifest.close()
+    assert (tmp_path / ExportManifest.FILENAME).read_text() == ''
+
+
+def test_blob_store_keeps_one_copy_of_each_file(tmp_path):
+    blobs = BlobStore(tmp_path)
+    sha256 = hashlib.sha256(b'abc').hexdigest()
+    assert blobs.size(sha256) is None
+    assert blobs.temp_path('incidents/ABC-1/a.png') == blobs.temp_path('incidents/ABC-1/a.png')
+    assert blobs.temp_path('incidents/ABC-1/a.png') != blobs.temp_path('incidents/ABC-1/b.png')
+
+    for name in ['a.png', 'b.png']:
+        temp_path = blobs.temp_path(name)
+        temp_path.write_bytes(b'abc')
+        assert blobs.add(temp_path, sha256) == (name == 'b.png')
+        assert not temp_path.exists()
+        blobs.link(sha256, tmp_path / 'incident' / name)
+
+    assert blobs.size(sha256) == 3
+    assert blobs.path(sha256).read_bytes() == b'abc'
+    assert (tmp_path / 'incident' / 'a.png').read_bytes() == b'abc'
+    assert (tmp_path / 'incident' / 'b.png').read_bytes() == b'abc'
+
+    # Relinking replaces whatever was there
+    (tmp_path / 'incident' / 'a.png').unlink()
+    (tmp_path / 'incident' / 'a.png').write_bytes(b'old')
+    blobs.link(sha256, tmp_path / 'incident' / 'a.png')
+    assert (tmp_path / 'incident' / 'a.png').read_bytes() == b'abc'
+
+
+def test_deduplicated_downloads_are_counted_once(range_server, tmp_path):
+    exporter = AtlosExporter('x', dedupe=True)
+    exporter.output_dir = tmp_path
+    exporter.blobs = BlobStore(tmp_path)
+    exporter.manifest = ExportManifest(tmp_path)
+    exporter.downloads = DownloadScheduler(exporter.stats, concurrency=1, max_retries=0)
+
+    url = f'http://127.0.0.1:{range_server.server_address[1]}/file.bin'
+    sha256 = hashlib.sha256(FILE_CONTENTS).hexdigest()
+    # Without checksums from the API, duplicates are only found after downloading them
+    assert exporter._download_file(url, tmp_path / 'ABC-1' / 'a.bin')
+    assert exporter._download_file(url, tmp_path / 'ABC-2' / 'a.bin')
+    # With one, they aren't downloaded at all
+    assert not exporter._download_file(url, tmp_path / 'ABC-3' / 'a.bin', sha256)
+    # And files from previous runs are skipped
+    assert not exporter._download_file(url, tmp_path / 'ABC-1' / 'a.bin')
+    exporter.manifest.close()
+
+    assert len(range_server.requests) == 2
+    assert exporter.stats.files_downloaded == 1
+    assert exporter.stats.files_deduplicated == 2
+    assert exporter.stats.bytes_deduplicated == 2 * len(FILE_CONTENTS)
+    assert exporter.stats.files_skipped == 1
+    for slug in ['ABC-1', 'ABC-2', 'ABC-3']:
+        assert (tmp_path / slug / 'a.bin').read_bytes() == FILE_CONTENTS
+        assert exporter.manifest.files[f'{slug}/a.bin'] == {'size': len(FILE_CONTENTS), 'sha256': sha256}
+
+
+INCIDENTS = [
+    {'slug': f'ABC-{i}', 'status': ['Unclaimed', 'Completed'][i % 2],
+     'inserted_at': f'2024-01-{i + 1:02}T12:00:00', 'updated_at': f'2024-03-{i + 1:02}T12:00:00'}
+    for i in range(20)
+]
+
+
+def slugs_kept_by(incident_filter):
+    return [incident['slug'] for incident in INCIDENTS if incident_filter(incident)]
+
+
+def test_incident_filters():
+    assert not IncidentFilter().is_active()
+    assert len(slugs_kept_by(IncidentFilter())) == len(INCIDENTS)
+
+    assert slugs_kept_by(IncidentFilter(slugs=['ABC-3', 'XYZ-1'])) == ['ABC-3']
+    assert slugs_kept_by(IncidentFilter(statuses=['Completed'])) == [f'ABC-{i}' for i in range(1, 20, 2)]
+    # Bare dates compare against full timestamps; created_after is inclusive, created_before isn't
+    assert slugs_kept_by(IncidentFilter(created_after='2024-01-03', created_before='2024-01-05')) == \
+        ['ABC-2', 'ABC-3']
+    assert slugs_kept_by(IncidentFilter(updated_since='2024-03-19')) == ['ABC-18', 'ABC-19']
+    assert slugs_kept_by(IncidentFilter(statuses=['Completed'], updated_since='2024-03-17')) == \
+        ['ABC-17', 'ABC-19']
+
+
+def test_shards_split_incidents_between_them():
+    shards = [slugs_kept_by(IncidentFilter(shard=(index, 3))) for index in range(3)]
+    assert sorted(sum(shards, [])) == sorted(incident['slug'] for incident in INCIDENTS)
+    assert all(shards)
+    assert IncidentFilter.shard_of('ABC-1', 3) == IncidentFilter.shard_of('ABC-1', 3)
+
+
+@pytest.mark.parametrize('value', ['3', '1/x', '3/3', '-1/3', '0/0'])
+def test_invalid_shards_are_rejected(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        IncidentFilter.parse_shard(value)
+
+
+def test_spools_filter_and_sort_without_losing_items(tmp_path):
+    spool = CollectionSpool(tmp_path / 'incidents.ndjson')
+    spool.extend(INCIDENTS)
+    spool = spool.filtered(IncidentFilter(statuses=['Completed']))
+    assert [incident['slug'] for incident in spool] == [f'ABC-{i}' for i in range(1, 20, 2)]
+
+    # Ties keep their order, even when sorting in reverse
+    spool = spool.sorted_by(lambda incident: incident['updated_at'] >= '2024-03-10', reverse=True)
+    assert [incident['slug'] for incident in spool] == \
+        [f'ABC-{i}' for i in range(9, 20, 2)] + [f'ABC-{i}' for i in range(1, 9, 2)]
+    assert spool[0] == INCIDENTS[9]
+    spool.close()
+    assert [path.name for path in tmp_path.iterdir()] == ['incidents.ndjson.filtered.sorted']
+
+
+def write_archive(path, compress_json=False):
+    sink = ArchiveSink(path, compress_json=compress_json)
+    with sink.open_member('export.json') as f:
+        f.write(b'{"incidents": []}')
+    with sink.open_member('incidents/ABC-1/metadata.json') as f:
+        f.write(json.dumps({'slug': 'ABC-1'}).encode())
+    media = path.parent / 'media.bin'
+    media.write_bytes(FILE_CONTENTS)
+    sink.add_file('incidents/ABC-1/media/a.bin', media)
+    with sink.open_member('incidents/ABC-2/metadata.json') as f:
+        f.write(json.dumps({'slug': 'ABC-2'}).encode())
+    sink.close()
+    return sink
+
+
+@pytest.mark.parametrize('name', ['export.tar', 'export.zip'])
+def test_archives_can_be_extracted_an_incident_at_a_time(tmp_path, name):
+    path = tmp_path / name
+    write_archive(path)
+
+    with open(ArchiveSink.index_path(path)) as f:
+        index = json.load(f)
+    assert index['incidents'] == {
+        'ABC-1': ['incidents/ABC-1/metadata.json', 'incidents/ABC-1/media/a.bin'],
+        'ABC-2': ['incidents/ABC-2/metadata.json'],
+    }
+    if name.endswith('.tar'):
+        # The offsets in the index point straight at each member's data
+        with open(path, 'rb') as f:
+            member = index['members']['incidents/ABC-1/media/a.bin']
+            f.seek(member['offset'])
+            assert f.read(member['size']) == FILE_CONTENTS
+    else:
+        # Zip files carry their own index
+        ArchiveSink.index_path(path).unlink()
+
+    extract_incident(path, 'ABC-1', tmp_path / 'out')
+    assert json.loads((tmp_path / 'out' / 'incidents' / 'ABC-1' / 'metadata.json').read_text()) == \
+        {'slug': 'ABC-1'}
+    assert (tmp_path / 'out' / 'incidents' / 'ABC-1' / 'media' / 'a.bin').read_bytes() == FILE_CONTENTS
+    assert not (tmp_path / 'out' / 'incidents' / 'ABC-2').exists()
+
+    with pytest.raises(KeyError):
+        extract_incident(path, 'ABC-3', tmp_path / 'out')
+
+
+@pytest.mark.parametrize('name', ['export.tar', 'export.zip'])
+def test_archives_can_compress_json(tmp_path, name):
+    pytest.importorskip('zstandard')
+    path = tmp_path / name
+    sink = write_archive(path, compress_json=True)
+    assert set(sink.members) == {
+        'export.json.zst', 'incidents/ABC-1/metadata.json.zst', 'incidents/ABC-1/media/a.bin',
+        'incidents/ABC-2/metadata.json.zst', ArchiveSink.INDEX_NAME,
+    }
+
+    extract_incident(path, 'ABC-1', tmp_path / 'out')
+    assert json.loads((tmp_path / 'out' / 'incidents' / 'ABC-1' / 'metadata.json').read_text()) == \
+        {'slug': 'ABC-1'}
+    assert (tmp_path / 'out' / 'incidents' / 'ABC-1' / 'media' / 'a.bin').read_bytes() == FILE_CONTENTS
+
+
+def write_shard(shard_dir, incidents, updates):
+    shard_dir.mkdir()
+    export_data = {
+        'export_info': {'base_url': 'https://platform.atlos.org'},
+        'incidents': incidents,
+        'source_material': [],
+        'updates': updates,
+    }
+    with open(shard_dir / 'export_data.json', 'w') as f:
+        json.dump(export_data, f)
+
+
+def test_merged_exports_list_items_in_api_order(tmp_path):
+    # Newest first by creation (then ID), which differs from the order they were last updated in
+    incidents = [
+        {'id': f'id-{i}', 'slug': f'ABC-{i}', 'inserted_at': f'2024-01-{i // 2 + 1:02}T00:00:00',
+         'updated_at': f'2024-03-{30 - i:02}T00:00:00'}
+        for i in range(10)
+    ]
+    updates = [
+        {'id': f'update-{i}', 'media_id': f'id-{i}', 'inserted_at': f'2024-02-{i // 3 + 1:02}T00:00:00'}
+        for i in range(10)
+    ]
+    shards = [[], []]
+    for incident, update in zip(incidents, updates):
+        shards[IncidentFilter.shard_of(incident['slug'], 2)].append((incident, update))
+    for index, shard in enumerate(shards):
+        write_shard(tmp_path / f'shard-{index}', [incident for incident, _ in shard],
+                    [update for _, update in shard])
+
+    AtlosExporter('x').merge_exports([tmp_path / 'shard-0', tmp_path / 'shard-1'], tmp_path / 'merged')
+
+    with open(tmp_path / 'merged' / 'export_data.json') as f:
+        merged = json.load(f)
+    assert [incident['id'] for incident in merged['incidents']] == \
+        [incident['id'] for incident in reversed(incidents)]
+    assert [update['id'] for update in merged['updates']] == [update['id'] for update in reversed(updates)]
+
+
+def test_streamed_export_data_matches_json_dump(tmp_path):
+    export_info = {'export_timestamp': '2024-01-01T00:00:00', 'filters': {}, 'shards': []}
+    collections = {
+        'incidents': [
+            {'id': 'a', 'slug': 'ABC-1', 'description': 'Frappé in Київ 🚀 "quoted" \\ \n',
+             'attr_tags': [], 'attr_geolocation': None, 'nested': {'list': [1, 2.5, {'deep': [[]]}],
+                                                                  'empty': {}, 'flag': True}},
+            {'id': 'b', 'slug': 'ABC-2', 'description': '', 'attr_tags': ['x', 'y'], 'nested': {}},
+        ],
+        'source_material': [],
+        'updates': [{'id': 'c', 'explanation': '\u2028 line separators and \t tabs'}],
+    }
+    summary = {'total_incidents': 2, 'total_source_material': 0, 'total_updates': 1}
+
+    spools = {}
+    for name, items in collections.items():
+        spools[name] = CollectionSpool(tmp_path / f'{name}.ndjson')
+        spools[name].extend(items)
+        spools[name].finish()
+
+    streamed = io.StringIO()
+    write_export_data(streamed, export_info, spools, summary)
+    for spool in spools.values():
+        spool.close()
+
+    expected = io.StringIO()
+    json.dump({'export_info': export_info, **collections, 'summary': summary}, expected, indent=2,
+              ensure_ascii=False)
+    assert streamed.getvalue() == expected.getvalue()
+
+
+def test_previous_collections_are_read_one_item_at_a_time(tmp_path, monkeypatch):
+    collections = {
+        'incidents': [
+            {'id': 'a', 'description': 'Line\nbreaks, "    }," and \u2028 in strings',
+             'nested': {'list': [{'deep': {}}, []], 'empty': {}}},
+            {'id': 'b', 'attr_tags': ['x']},
+        ],
+        'source_material': [],
+        'updates': [{'id': 'c'}],
+    }
+    data = {'export_info': {'filters': {}}, **collections, 'summary': {'total_incidents': 2}}
+    with open(tmp_path / 'export_data.json', 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    (tmp_path / 'compact.json').write_text(json.dumps(data))
+
+    def no_json_load(f):
+        raise AssertionError('loaded the whole export')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(export_project.json, 'load', no_json_load)
+        for name, items in collections.items():
+            assert list(export_project.iter_export_collection(tmp_path / 'export_data.json', name)) == items
+    # Files laid out some other way are parsed in full
+    for name, items in collections.items():
+        assert list(export_project.iter_export_collection(tmp_path / 'compact.json', name)) == items
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter_allows_a_burst_then_spaces_requests_out():
+    clock = FakeClock()
+    limiter = RateLimiter(4, burst=2, clock=clock, sleep=clock.sleep)
+
+    requested = []
+    for _ in range(6):
+        limiter.acquire()
+        requested.append(clock.now)
+    assert requested == pytest.approx([100, 100, 100.25, 100.5, 100.75, 101])
+
+    # Idle time refills the bucket, but only up to the burst size
+    clock.now += 10
+    for _ in range(3):
+        limiter.acquire()
+        requested.append(clock.now)
+    assert requested[-3:] == pytest.approx([111, 111, 111.25])
+
+
+def test_backoff_grows_exponentially_up_to_the_cap():
+    for attempt in range(10):
+        expected = min(60, 2 ** attempt)
+        for _ in range(20):
+            assert expected * 0.5 <= backoff_delay(attempt) <= expected * 1.5
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'HTTP {self.status_code}')
+
+    def json(self):
+        return {'results': [], 'next': None}
+
+
+class FakeSession:
+    """Responds to every request with the next of the given responses (or exceptions)"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, *args, **kwargs):
+        self.requests += 1
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(export_project, 'backoff_delay', lambda attempt: 0)
+
+
+def test_api_requests_retry_up_to_the_limit(no_backoff):
+    exporter = AtlosExporter('x', rate_limit=1000, max_retries=3)
+    exporter.session = FakeSession([FakeResponse(503, {'Retry-After': '0'})])
+    with pytest.raises(requests.HTTPError):
+        exporter._make_request('incidents')
+    assert exporter.session.requests == 4
+    assert exporter.stats.retries['api'] == 3
+
+    exporter.session = FakeSession([requests.ConnectionError('reset'), FakeResponse(429),
+                                    FakeResponse(200)])
+    assert exporter._make_request('incidents') == {'results': [], 'next': None}
+    assert exporter.session.requests == 3
+    assert exporter.stats.retries['api'] == 5
+
+    # Other errors aren't retried
+    exporter.session = FakeSession([FakeResponse(404), FakeResponse(200)])
+    with pytest.raises(requests.HTTPError):
+        exporter._make_request('incidents')
+    assert exporter.session.requests == 1
+
+
+def test_downloads_retry_up_to_the_limit(no_backoff, tmp_path):
+    stats = ExportStats()
+    scheduler = DownloadScheduler(stats, concurrency=1, max_retries=2)
+    scheduler.session = FakeSession([FakeResponse(503)])
+    with pytest.raises(RetryableDownloadError):
+        scheduler.fetch('https://storage.example.com/a.png', tmp_path / 'a.png')
+    assert scheduler.session.requests == 3
+    assert stats.retries['download'] == 2
+    assert not (tmp_path / 'a.png').exists()
+    scheduler.shutdown()
+
+
+class FakeAtlosHandler(BaseHTTPRequestHandler):
+    """A tiny Atlos API: cursor-paginated collections, and the files they link to. The first request
+    to each collection, and for each file in `server.flaky_files`, fails with a 503."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path, _, query = self.path.partition('?')
+        params = dict(param.split('=', 1) for param in query.split('&') if param)
+        with server.lock:
+            first_request = path not in server.requested
+            server.requested.add(path)
+        if first_request and (path.startswith('/api/') or path in server.flaky_files):
+            return self.send(503, b'{}', [('Retry-After', '0')])
+
+        if path.startswith('/files/'):
+            return self.send(200, server.files[path])
+        items = server.collections[path.removeprefix('/api/v2/')]
+        if 'slug' in params:
+            incident_id = next(i['id'] for i in server.collections['incidents'] if i['slug'] == params['slug'])
+            items = [item for item in items if item['media_id'] == incident_id]
+        cursor = int(params.get('cursor', 0))
+        page = {'results': items[cursor:cursor + 2],
+                'next': str(cursor + 2) if cursor + 2 < len(items) else None}
+        self.send(200, json.dumps(page).encode(), [('Content-Type', 'application/json')])
+
+
+@pytest.fixture
+def atlos_server():
+    """Three incidents, each with two artifacts (one of them the same file for every incident) and a
+    comment with an attachment"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAtlosHandler)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.lock = threading.Lock()
+    server.requested = set()
+    server.files = {'/files/shared': b'shared' * 100}
+    server.flaky_files = {'/files/shared'}
+    incidents, source_material, updates = [], [], []
+    for i in range(3):
+        incident_id = f'{i:08}-incident'
+        incidents.append({'id': incident_id, 'slug': f'ABC-{i}', 'description': f'Incident {i}',
+                          'status': 'Completed', 'inserted_at': f'2024-01-0{3 - i}T00:00:00',
+                          'updated_at': f'2024-02-0{3 - i}T00:00:00'})
+        server.files[f'/files/unique{i}'] = b'unique%d' % i * (i + 1)
+        server.files[f'/files/attachment{i}'] = b'attachment%d' % i
+        source_material.append({'id': f'{i:08}-source', 'incident_id': incident_id,
+                                'source_url': 'https://example.com', 'artifacts': [
+            {'id': f'{i:08}-{name}', 'type': 'media', 'mime_type': 'image/png', 'title': name,
+             'file_size': len(server.files[f'/files/{name}']),
+             'file_hash_sha256': hashlib.sha256(server.files[f'/files/{name}']).hexdigest(),
+             'access_url': f'{base_url}/files/{name}'}
+            for name in [f'unique{i}', 'shared']
+        ]})
+        updates.append({'id': f'{i:08}-update', 'media_id': incident_id, 'type': 'comment',
+                        'user': {'username': 'alice'}, 'inserted_at': f'2024-03-0{3 - i}T00:00:00',
+                        'explanation': 'See attached', 'attachments': [f'attachment{i}.txt'],
+                        'attachment_urls': [f'{base_url}/files/attachment{i}']})
+    server.collections = {'incidents': incidents, 'source_material': source_material, 'updates': updates}
+    server.base_url = base_url
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('exporter_class', [AtlosExporter, AsyncAtlosExporter])
+@pytest.mark.parametrize('dedupe', [False, True])
+def test_stats_count_what_the_export_did(atlos_server, tmp_path, no_backoff, exporter_class, dedupe):
+    exporter = exporter_class('x', base_url=atlos_server.base_url, rate_limit=1000, dedupe=dedupe)
+    exporter.export_project(tmp_path)
+
+    stats = exporter.stats
+    shared = len(atlos_server.files['/files/shared'])
+    downloaded = [data for path, data in atlos_server.files.items() if path != '/files/shared']
+    downloaded += [atlos_server.files['/files/shared']] * (1 if dedupe else 3)
+    assert stats.incidents_total == stats.incidents_processed == 3
+    assert stats.incidents_skipped == 0
+    assert stats.files_planned == 9
+    assert stats.files_downloaded == len(downloaded)
+    assert stats.bytes_downloaded == sum(map(len, downloaded))
+    assert stats.files_deduplicated == (2 if dedupe else 0)
+    assert stats.bytes_deduplicated == (2 * shared if dedupe else 0)
+    assert stats.files_skipped == 0
+    assert stats.failures == []
+    # One retry for each collection, and one for the shared file
+    assert stats.retries == {'api': 3, 'download': 1}
+    assert {'fetch', 'organize'} <= set(stats.phases)
+    with open(tmp_path / ExportStats.FILENAME) as f:
+        saved = json.load(f)
+    assert saved['incidents'] == {'total': 3, 'processed': 3, 'unchanged': 0}
+    assert saved['downloads'] | {'bytes_per_second': None} == {
+        'planned': 9, 'downloaded': len(downloaded), 'already_downloaded': 0,
+        'deduplicated': stats.files_deduplicated, 'bytes_deduplicated': stats.bytes_deduplicated,
+        'failed': 0, 'bytes': stats.bytes_downloaded, 'bytes_per_second': None}
+    assert saved['retries'] == stats.retries
+    assert saved['latency']['download']['count'] == len(downloaded) + 1
+    assert saved['latency']['incident']['count'] == 3
+
+    # Nothing changed, so an incremental export downloads nothing more
+    rerun = exporter_class('x', base_url=atlos_server.base_url, rate_limit=1000, dedupe=dedupe)
+    rerun.export_project(tmp_path, incremental=True)
+    assert rerun.stats.files_downloaded == rerun.stats.bytes_downloaded == 0
+    assert rerun.stats.failures == []
+
+
+@pytest.mark.parametrize('exporter_class', [AtlosExporter, AsyncAtlosExporter])
+def test_archive_exports_clean_up_their_work_directory(atlos_server, tmp_path, no_backoff,
+                                                       exporter_class):
+    archive = tmp_path / 'export.tar'
+    work = tmp_path / 'export.tar.work'
+    exporter = exporter_class('x', base_url=atlos_server.base_url, rate_limit=1000, archive=archive)
+    exporter.export_project(tmp_path / 'unused')
+    assert not work.exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['export.tar', 'export.tar.index.json']
+    extract_incident(archive, 'ABC-1', tmp_path / 'extracted')
+    assert (tmp_path / 'extracted' / 'incidents' / 'ABC-1' / 'incident_data.json').exists()
+
+
+@pytest.mark.parametrize('exporter_class', [AtlosExporter, AsyncAtlosExporter])
+def test_failed_archive_exports_leave_nothing_behind(atlos_server, tmp_path, no_backoff, monkeypatch,
+                                                     exporter_class):
+    summarize = exporter_class._create_incident_summary
+
+    def fail_partway(self, filepath, incident_data):
+        if incident_data['incident']['slug'] == 'ABC-1':
+            raise OSError('No space left on device')
+        summarize(self, filepath, incident_data)
+
+    monkeypatch.setattr(exporter_class, '_create_incident_summary', fail_partway)
+    archive = tmp_path / 'export.tar'
+    exporter = exporter_class('x', base_url=atlos_server.base_url, rate_limit=1000, archive=archive)
+    # Raised from within trio, so it comes wrapped in an exception group
+    with pytest.raises(ExceptionGroup) as raised:
+        exporter.export_project(tmp_path / 'unused')
+    assert raised.group_contains(OSError, match='No space left', depth=None)
+    assert list(tmp_path.iterdir()) == []
@@ -5,236 +5,749 @@
 
 import json
 from timeout import timeout
+from driver_pool import DriverPool
+from phash_cache import PerceptualHashCache
+from png_writer import StreamingPngWriter
+from auto_archiver_process import PersistentAutoArchiver, archive_in_process
 import mimetypes
 import os
 import re
 import base64
-import shutil
 import subprocess
 import sys
-from time import sleep
-from typing import Optional
+import threading
+from time import sleep, monotonic
+from typing import Callable, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2
+import numpy as np
 import psutil
 from loguru import logger
 import unicodecsv as csv
 from perception import hashers
 import click
 import tempfile
+import functools
+import multiprocessing
 import requests
+import contextlib
 import hashlib
+import itertools
+import shutil
 from selenium import webdriver
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.chrome.service import Service as ChromiumService
 from selenium.webdriver.common.print_page_options import PrintOptions
+from selenium.common.exceptions import WebDriverException
 
 # From https://github.com/bellingcat/auto-archiver/blob/dockerize/src/auto_archiver/utils/url.py#L3
 is_telegram_private = re.compile(r"https:\/\/t\.me(\/c)\/(.+)\/(\d+)")
 is_instagram = re.compile(r"https:\/\/www\.instagram\.com")
 authwall_regexes = [is_telegram_private, is_instagram]
 
+# How long (in seconds) each archival stage may take. The stages run concurrently, and
+# these all fit within the overall job timeout so that we always have time to write out
+# whatever did succeed.
+STAGE_TIMEOUTS = dict(
+    direct_download=60,
+    selenium=120,
+    auto_archiver=150,
+)
+
+# Where perceptual hashes are cached by default, and how large (in MB) the cache can
+# grow to
+DEFAULT_PERCEPTUAL_HASH_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "atlos", "perceptual_hashes"
+)
+DEFAULT_PERCEPTUAL_HASH_CACHE_SIZE = 256
+
+# How much of a file to read at once when hashing and copying artifacts
+CHUNK_SIZE = 1024 * 1024
+
+# The largest file (in MB) we'll download directly from a URL
+DEFAULT_MAX_DIRECT_DOWNLOAD_SIZE = 1024
+
+# How the auto-archiver can be run (see `archive_using_auto_archiver`)
+AUTO_ARCHIVER_MODES = ("persistent", "in_process", "subprocess")
+
+# The auto archiver's metadata for threads and channels can run to many megabytes, far
+# more than the csv module allows in a single field by default
+CSV_FIELD_SIZE_LIMIT = 2**31 - 1
+
+# The longest (in seconds) we'll wait for a page to settle after loading it, and after
+# interacting with it (e.g., dismissing a popup). Most pages settle well before this.
+MAX_PAGE_SETTLE_TIME = 10
+MAX_INTERACTION_SETTLE_TIME = 2
+
+# Full-page screenshots are taken by scrolling through the page a viewport at a time,
+# waiting up to this long (in seconds) for each viewport's lazily-loaded content, and
+# stop at this many (CSS) pixels down
+MAX_TILE_SETTLE_TIME = 1
+TILE_QUIET_PERIOD = 0.2
+DEFAULT_MAX_SCREENSHOT_HEIGHT = 30000
+
+# Reports whether the page is still loading or changing. We track DOM mutations with a
+# MutationObserver (installed on first run, and again if the page navigates), and
+# completed network requests with the resource timing API. All times are in milliseconds
+# since the page started loading.
+PAGE_ACTIVITY_SCRIPT = """
+if (!window.__atlosActivity) {
+    window.__atlosActivity = { lastMutation: performance.now() };
+    performance.setResourceTimingBufferSize(10000);
+    new MutationObserver(() => {
+        window.__atlosActivity.lastMutation = performance.now();
+    }).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+}
+const lastResponse = performance
+    .getEntriesByType("resource")
+    .reduce((latest, entry) => Math.max(latest, entry.responseEnd), 0);
+return {
+    readyState: document.readyState,
+    now: performance.now(),
+    lastMutation: window.__atlosActivity.lastMutation,
+    lastResponse: lastResponse,
+};
+"""
+
 
 def is_likely_authwalled(url: str) -> bool:
     """Returns whether the given URL is likely to be behind an authentication wall."""
     return any(regex.match(url) for regex in authwall_regexes)
 
 
-def compute_checksum(path: str) -> str:
-    """Computes the SHA256 checksum of the file at the given path."""
-    with open(path, "rb") as infile:
-        return hashlib.sha256(infile.read()).hexdigest()
+class Workspace:
+    """A job's scratch directory. Every stage writes its files into its job's workspace
+    by absolute path, rather than into the working directory, so that many jobs can run
+    in the same process at once."""
 
+    def __init__(self):
+        # A stage that timed out may still be writing here when the job finishes
+        self._directory = tempfile.TemporaryDirectory(
+            prefix="archive-", ignore_cleanup_errors=True
+        )
+        self.root = os.path.abspath(self._directory.name)
 
-def maybe_download_file(url: str) -> Optional[str]:
-    """Downloads the file at the given URL to a tempfile."""
+    def path(self, *parts: str) -> str:
+        """Returns the absolute path of the given file or directory in the workspace."""
+        return os.path.join(self.root, *parts)
 
-    resp = requests.get(url, allow_redirects=True, timeout=10)
-    if resp.status_code != 200:
-        return None
+    def close(self):
+        self._directory.cleanup()
 
-    content_type = resp.headers.get("content-type")
+    def __enter__(self) -> "Workspace":
+        return self
 
-    if content_type is None or content_type.startswith("text/html"):
-        return None
+    def __exit__(self, *exc):
+        self.close()
 
-    suffix = mimetypes.guess_extension(content_type) or ".bin"
 
-    output = f"file{suffix}"
-    with open(output, "wb") as outfile:
-        outfile.write(resp.content)
-        return output
+def compute_checksum(path: str) -> str:
+    """Computes the SHA256 checksum of the file at the given path, reading it in chunks
+    so that large media doesn't have to fit in memory."""
+    checksum = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
 
 
-def find_json_objects(s):
-    """Finds all JSON objects in a string. Returns a list of JSON objects. We use this instead of json.loads() because
-    the Bellingcat auto-archiver doesn't strictly adhere to providing JSON output."""
+def copy_with_checksum(source: str, destination: str) -> str:
+    """Copies the file at `source` to `destination`, computing the SHA256 checksum of
+    its contents along the way (so that we only read the file once). Returns the
+    checksum. If the copy fails, no partial copy is left at `destination`."""
+    checksum = hashlib.sha256()
+    with open(source, "rb") as infile:
+        try:
+            with open(destination, "wb") as outfile:
+                for chunk in iter(lambda: infile.read(CHUNK_SIZE), b""):
+                    checksum.update(chunk)
+                    outfile.write(chunk)
+        except BaseException:
+            # E.g., the disk filled up, or the job timed out
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(destination)
+            raise
+    return checksum.hexdigest()
+
+
+def looks_like_html(data: bytes) -> bool:
+    """Returns whether the given start of a response body looks like an HTML page,
+    whatever its content type claims."""
+    start = data[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    return start.startswith((b"<!doctype html", b"<html", b"<head", b"<body"))
+
+
+def maybe_download_file(
+    url: str,
+    workspace: Workspace,
+    max_size: int = DEFAULT_MAX_DIRECT_DOWNLOAD_SIZE * 1024 * 1024,
+    timeout: int = STAGE_TIMEOUTS["direct_download"],
+    cancellation: Optional["StageCancellation"] = None,
+) -> Optional[dict]:
+    """Downloads the file at the given URL into the workspace, unless it's an HTML page
+    (which the other stages take care of) or larger than `max_size` bytes. The response
+    is streamed to disk and hashed as it arrives, and we stop as soon as we can tell it
+    isn't worth keeping. Returns the file's path and SHA256 checksum."""
+
+    cancellation = cancellation or StageCancellation()
+
+    deadline = monotonic() + timeout
+    with requests.get(
+        url, allow_redirects=True, timeout=10, stream=True
+    ) as resp, cancellation.on_cancel(resp.close):
+        if resp.status_code != 200:
+            return None
+
+        content_type = resp.headers.get("content-type")
+
+        if content_type is None or content_type.startswith("text/html"):
+            return None
+
+        content_length = resp.headers.get("content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > max_size:
+                logger.info(f"Not downloading {content_length} byte file (too large)")
+                return None
+
+        chunks = resp.iter_content(CHUNK_SIZE)
+        first_chunk = next(chunks, b"")
+        if looks_like_html(first_chunk):
+            return None
+
+        suffix = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ".bin"
+
+        output = workspace.path(f"file{suffix}")
+        checksum = hashlib.sha256()
+        size = 0
+        try:
+            with open(output, "wb") as outfile:
+                for chunk in itertools.chain([first_chunk], chunks):
+                    size += len(chunk)
+                    if size > max_size or monotonic() > deadline:
+                        break
+                    checksum.update(chunk)
+                    outfile.write(chunk)
+                else:
+                    return dict(file=output, sha256=checksum.hexdigest())
+        except BaseException:
+            # E.g., the connection dropped, or the stage was cancelled; don't leave half
+            # a file behind
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(output)
+            raise
+
+    # The server didn't say how large the file was (or lied), or it was too slow
+    logger.info(
+        "Not keeping direct download "
+        + ("(too large)" if size > max_size else "(took too long)")
+    )
+    os.remove(output)
+    return None
 
-    json_objects = []
-    json_start_positions = [m.start() for m in re.finditer(r"\{", s)]
 
-    for start_pos in json_start_positions:
+def iter_json_objects(s):
+    """Yields the top-level JSON objects in a string, in order. Objects nested inside
+    another object (or braces inside its strings) are part of that object, so we skip
+    straight past each one we decode; this keeps the work linear in the string's length.
+    """
+
+    decoder = json.JSONDecoder()
+    position = s.find("{")
+    while position != -1:
         try:
-            json_obj, end_pos = json.JSONDecoder().raw_decode(s, start_pos)
-            json_objects.append(json_obj)
+            json_obj, end_position = decoder.raw_decode(s, position)
         except json.JSONDecodeError:
+            # Not the start of a valid object, but there may be one further in
+            position = s.find("{", position + 1)
             continue
 
-    return json_objects
+        yield json_obj
+        position = s.find("{", end_position)
 
 
-def archive_page_using_selenium(url: str) -> dict:
-    """Archives the given URL using Selenium."""
+def find_json_objects(s):
+    """Finds all top-level JSON objects in a string. Returns a list of JSON objects. We
+    use this instead of json.loads() because the Bellingcat auto-archiver doesn't
+    strictly adhere to providing JSON output."""
+    return list(iter_json_objects(s))
+
+
+def wait_for_page_to_settle(
+    driver: webdriver.Chrome,
+    max_wait: float,
+    quiet_period: float = 0.5,
+    poll_interval: float = 0.1,
+) -> float:
+    """Waits until the page has finished loading and neither its DOM nor the network has
+    been active for `quiet_period` seconds, or until `max_wait` seconds have passed.
+    Returns how long we waited."""
+
+    start = monotonic()
+    while True:
+        waited = monotonic() - start
 
-    try:
-        # Setup driver
-        options = ChromeOptions()
-
-        # At a glance, disabling "sandboxing" sounds scary. But don't worry (too much). This is a
-        # requirement since we're running Chromium within a Docker container; to get Chromium
-        # sandboxing to work, we'd need to change the seccomp policy that the Docker container is
-        # running under. We have some protections in place to mitigate some of the fallout of an
-        # attacker finding a Chromium exploit and using it on us (e.g., cleaning the environment
-        # to remove sensitive variables), but this is — to an extent — an acceptable risk
-        # (given the complexity tradeoff).
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--headless")
-        options.binary_location = '/usr/bin/chromium'
-        
-        # Set up the Service object with the path to chromedriver
-        service = ChromiumService('/usr/bin/chromedriver')
-
-        # Initialize the Chrome WebDriver
-        driver = webdriver.Chrome(service=service, options=options)
-        driver.set_window_size(1600, 1200)
-
-        # Load the page
-        driver.get(url)
-        driver.implicitly_wait(5)
-
-        # Wait for a bit
-        sleep(5)
-
-        # If there is an element with `aria-label="Close"` and `role="button"`, click it
         try:
-            close_button = driver.find_element(
-                "xpath", '//*[@aria-label="Close" and @role="button"]'
-            )
-            close_button.click()
-            sleep(1)
-        except:
-            logger.debug("No close button found")
-
-        # Press the escape key, just in case
-        driver.find_element("tag name", "body").send_keys("\ue00c")
-        sleep(1)
-
-        # Save page data
-        title = driver.title
-        body_text = driver.find_element("tag name", "body").text
-
-        driver.get_screenshot_as_file("viewport.png")
-
-        # Get a full page screenshot
-        driver.execute_script("window.scrollTo(0, 0);")
-        total_width = driver.execute_script("return document.body.offsetWidth")
-        total_height = driver.execute_script(
-            "return document.body.parentNode.scrollHeight"
-        )
+            activity = driver.execute_script(PAGE_ACTIVITY_SCRIPT)
+            last_activity = max(activity["lastMutation"], activity["lastResponse"])
+            if (
+                activity["readyState"] == "complete"
+                and activity["now"] - last_activity >= quiet_period * 1000
+            ):
+                return waited
+        except WebDriverException as e:
+            # The page may be in the middle of navigating (e.g., a redirect)
+            logger.debug(f"Unable to check page activity: {e}")
+
+        if waited >= max_wait:
+            logger.debug(f"Page did not settle within {max_wait}s")
+            return waited
+
+        sleep(poll_interval)
+
+
+def archive_page_using_selenium(
+    url: str,
+    pool: DriverPool,
+    workspace: Workspace,
+    timeout: int = STAGE_TIMEOUTS["selenium"],
+    max_settle_time: float = MAX_PAGE_SETTLE_TIME,
+    tiled_screenshots: bool = True,
+    max_screenshot_height: int = DEFAULT_MAX_SCREENSHOT_HEIGHT,
+    cancellation: Optional["StageCancellation"] = None,
+) -> dict:
+    """Archives the given URL using Selenium, with a driver from the given pool. If the
+    stage is cancelled, the browser is quit (and so discarded)."""
 
-        driver.set_window_size(total_width, total_height)
-        driver.save_screenshot("fullpage.png")
-
-        # Get a PDF
-        print_options = PrintOptions()
-        print_options.page_height = total_height / 20
-        print_options.page_width = total_width / 50
-        pdf_base64 = driver.print_page(print_options=print_options)
-        with open("page.pdf", "wb") as outfile:
-            outfile.write(base64.b64decode(pdf_base64))
-
-        return dict(
-            success=True,
-            data=dict(title=title, text=body_text),
-            screenshots=[
-                dict(file="viewport.png", kind="viewport"),
-                dict(file="fullpage.png", kind="fullpage"),
-            ],
-            pdf="page.pdf",
-        )
+    cancellation = cancellation or StageCancellation()
+
+    try:
+        with pool.driver() as driver, cancellation.on_cancel(driver.quit):
+            # Keep page loads and scripts from running past the stage's deadline
+            driver.set_page_load_timeout(timeout)
+            driver.set_script_timeout(timeout)
+            return capture_page(
+                driver,
+                url,
+                workspace,
+                max_settle_time=max_settle_time,
+                tiled_screenshots=tiled_screenshots,
+                max_screenshot_height=max_screenshot_height,
+            )
     except TimeoutError as e:
         raise e
     except Exception as e:
         logger.exception(f"Failed to archive page: {e}")
         return dict(success=False)
-    finally:
-        driver.quit()
 
 
-def archive_using_auto_archiver(
-    url: str, config: str = "auto_archiver_config.yaml"
+def capture_page(
+    driver: webdriver.Chrome,
+    url: str,
+    workspace: Workspace,
+    max_settle_time: float = MAX_PAGE_SETTLE_TIME,
+    tiled_screenshots: bool = True,
+    max_screenshot_height: int = DEFAULT_MAX_SCREENSHOT_HEIGHT,
 ) -> dict:
-    """Archives the given URL using the Bellingcat auto-archiver."""
+    """Captures the page data, screenshots, and PDF of the given URL using the given
+    driver, into the given workspace. The full-page screenshot covers at most
+    `max_screenshot_height` pixels of the page; it is stitched together from
+    viewport-sized tiles if `tiled_screenshots` is set, or else taken in one go by
+    resizing the window to fit the page."""
 
-    if os.path.exists("auto_archiver"):
-        raise RuntimeError("auto_archiver folder already exists")
+    # Load the page
+    driver.get(url)
 
-    if not os.path.exists(config):
-        raise RuntimeError("auto archiver config not found")
+    # We wait for the page to settle ourselves, so lookups for elements that don't
+    # exist (like the close button below) should fail immediately rather than wait
+    driver.implicitly_wait(0)
 
-    if os.path.exists("db.csv"):
-        os.remove("db.csv")
+    # Wait for the page to finish loading and stop changing
+    settle_time = wait_for_page_to_settle(driver, max_settle_time)
+    logger.debug(f"Page settled after {settle_time:.2f}s")
 
-    os.mkdir("auto_archiver")
+    # If there is an element with `aria-label="Close"` and `role="button"`, click it
+    try:
+        close_button = driver.find_element(
+            "xpath", '//*[@aria-label="Close" and @role="button"]'
+        )
+        close_button.click()
+        settle_time += wait_for_page_to_settle(driver, MAX_INTERACTION_SETTLE_TIME)
+    except:
+        logger.debug("No close button found")
+
+    # Press the escape key, just in case
+    driver.find_element("tag name", "body").send_keys("\ue00c")
+    settle_time += wait_for_page_to_settle(driver, MAX_INTERACTION_SETTLE_TIME)
+
+    # Save page data
+    title = driver.title
+    body_text = driver.find_element("tag name", "body").text
+
+    viewport = workspace.path("viewport.png")
+    driver.get_screenshot_as_file(viewport)
+
+    # Get a full page screenshot
+    driver.execute_script("window.scrollTo(0, 0);")
+    total_width = driver.execute_script("return document.body.offsetWidth")
+    total_height = driver.execute_script("return document.body.parentNode.scrollHeight")
+
+    fullpage = workspace.path("fullpage.png")
+    screenshot_height = min(total_height, max_screenshot_height)
+    if tiled_screenshots:
+        fullpage_screenshot = capture_tiled_screenshot(
+            driver, fullpage, screenshot_height
+        )
+    else:
+        start = monotonic()
+        driver.set_window_size(total_width, screenshot_height)
+        driver.save_screenshot(fullpage)
+        fullpage_screenshot = dict(mode="resize", tiles=1, duration=monotonic() - start)
+    fullpage_screenshot["truncated"] = total_height > max_screenshot_height
+
+    # Get a PDF
+    print_options = PrintOptions()
+    print_options.page_height = total_height / 20
+    print_options.page_width = total_width / 50
+    pdf_base64 = driver.print_page(print_options=print_options)
+    pdf = workspace.path("page.pdf")
+    with open(pdf, "wb") as outfile:
+        outfile.write(base64.b64decode(pdf_base64))
+
+    return dict(
+        success=True,
+        data=dict(title=title, text=body_text),
+        screenshots=[
+            dict(file=viewport, kind="viewport"),
+            dict(file=fullpage, kind="fullpage"),
+        ],
+        pdf=pdf,
+        settle_time=settle_time,
+        fullpage_screenshot=fullpage_screenshot,
+    )
 
+
+def capture_tiled_screenshot(driver: webdriver.Chrome, path: str, height: int) -> dict:
+    """Captures the top `height` pixels of the page into a PNG at `path`, by scrolling
+    through the page a viewport at a time and stitching the screenshots together as we
+    go. Unlike resizing the window to fit the whole page, the browser never has to
+    render, and we never have to hold, more than a viewport's worth at once. Returns how
+    many tiles were taken and how long it took."""
+
+    start = monotonic()
+    viewport_height = driver.execute_script("return window.innerHeight")
+    height = max(height, 1)
+
+    writer = None
+    tiles = 0
+    position = 0  # How far down the page we've captured
     try:
-        # Run the command in a subprocess
-        result = subprocess.run(
-            [
-                "auto-archiver",
-                "--config",
-                config,
-                f"--cli_feeder.urls={url}",
-            ],
-            timeout=60 * 60,
-            capture_output=False,
-        )  # NOTE: URL is UNTRUSTED. Do NOT put it in a shell command.
+        while position < height:
+            driver.execute_script("window.scrollTo(0, arguments[0]);", position)
+            wait_for_page_to_settle(
+                driver, MAX_TILE_SETTLE_TIME, quiet_period=TILE_QUIET_PERIOD
+            )
+            scrolled_to = driver.execute_script("return window.scrollY")
+
+            png = driver.get_screenshot_as_png()
+            tile = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if tile is None:
+                raise RuntimeError("unable to decode screenshot tile")
+            tiles += 1
+
+            if writer is None:
+                writer = StreamingPngWriter(path, tile.shape[1])
+
+            # Screenshots are in device pixels, which needn't match the page's pixels.
+            # Near the bottom of the page, the browser can't scroll as far as we asked,
+            # so the tile overlaps the last one.
+            scale = tile.shape[0] / viewport_height
+            top = round((position - scrolled_to) * scale)
+            bottom = min(tile.shape[0], round((height - scrolled_to) * scale))
+            if bottom <= top:
+                # The page got shorter, or stopped scrolling
+                break
+
+            rows = tile[top:bottom, : writer.width, ::-1]
+            if rows.shape[1] < writer.width:
+                rows = np.pad(
+                    rows,
+                    ((0, 0), (0, writer.width - rows.shape[1]), (0, 0)),
+                    constant_values=255,
+                )
+            writer.write_rows(rows)
+            position = scrolled_to + bottom / scale
+    except:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    writer.close()
+    driver.execute_script("window.scrollTo(0, 0);")
+
+    return dict(mode="tiled", tiles=tiles, duration=monotonic() - start)
+
+
+def run_auto_archiver_subprocess(
+    url: str,
+    workspace: Workspace,
+    config: str,
+    timeout: int,
+    cancellation: "StageCancellation",
+) -> dict:
+    """Archives the given URL by running the `auto-archiver` CLI in the workspace, and
+    reads the archived item's metadata back from the `db.csv` it writes there."""
+
+    database = workspace.path("db.csv")
+    if os.path.exists(database):
+        os.remove(database)
+
+    process = subprocess.Popen(
+        [
+            "auto-archiver",
+            "--config",
+            config,
+            f"--cli_feeder.urls={url}",
+        ],
+        # The config's paths (e.g., for local storage and `db.csv`) are relative
+        cwd=workspace.root,
+    )  # NOTE: URL is UNTRUSTED. Do NOT put it in a shell command.
+    try:
+        with cancellation.on_cancel(process.kill):
+            process.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
         logger.warning("Auto archive timed out")
         return dict(success=False)
 
-    if result.returncode != 0:
-        logger.warning("Auto archive failed")
+    if process.returncode != 0:
         return dict(success=False)
 
-    # Read the database
-    with open("db.csv", "rb") as infile:
+    # We only need the first row
+    csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+    with open(database, "rb") as infile:
         reader = csv.DictReader(infile)
-        data = list(reader)[0].get("metadata")
+        data = next(reader).get("metadata")
 
     # Parse the JSON
-    objects = find_json_objects(data)
+    return dict(success=True, metadata=find_json_objects(data))
+
+
+def archive_using_auto_archiver(
+    url: str,
+    workspace: Workspace,
+    config: str = "auto_archiver_config.yaml",
+    timeout: int = STAGE_TIMEOUTS["auto_archiver"],
+    mode: str = "subprocess",
+    cancellation: Optional["StageCancellation"] = None,
+) -> dict:
+    """Archives the given URL using the Bellingcat auto-archiver. In the `persistent`
+    mode, the auto-archiver runs in a long-lived child process (see
+    `PersistentAutoArchiver`), and in the `in_process` mode, in this process (see
+    `archive_in_process`); both hand back the archived item's metadata directly. In the
+    `subprocess` mode (and if the auto-archiver can't be loaded, or the persistent one
+    is busy), it runs in a new subprocess, and the metadata is read back from its
+    `db.csv`."""
+
+    save_to = workspace.path("auto_archiver")
+
+    if os.path.exists(save_to):
+        raise RuntimeError("auto_archiver folder already exists")
+
+    if not os.path.exists(config):
+        raise RuntimeError("auto archiver config not found")
+
+    os.mkdir(save_to)
+
+    if mode not in AUTO_ARCHIVER_MODES:
+        raise ValueError(f"unknown auto archiver mode: {mode}")
+
+    cancellation = cancellation or StageCancellation()
+    auto_archiver = (
+        PersistentAutoArchiver.for_config(config) if mode == "persistent" else None
+    )
+    result = None
+
+    if mode == "in_process":
+        result = archive_in_process(config, url, workspace.root, save_to)
+
+    # If another job is using the persistent auto archiver, don't wait on it
+    if auto_archiver is not None and auto_archiver.lock.acquire(blocking=False):
+        try:
+            with cancellation.on_cancel(auto_archiver.kill):
+                result = auto_archiver.archive(
+                    url, workspace.root, save_to, timeout=timeout
+                )
+        finally:
+            auto_archiver.lock.release()
+    elif auto_archiver is not None:
+        logger.info("Persistent auto archiver is busy, using a subprocess instead")
+
+    if result is None:
+        result = run_auto_archiver_subprocess(
+            url, workspace, config, timeout, cancellation
+        )
+
+    if not result["success"]:
+        logger.warning("Auto archive failed")
+        return dict(success=False)
 
     # Find all the output files
-    files = [os.path.join("auto_archiver", p) for p in os.listdir("auto_archiver")]
+    files = [os.path.join(save_to, p) for p in os.listdir(save_to)]
+
+    return dict(success=True, metadata=result["metadata"], files=files)
+
+
+class StageCancellation:
+    """Lets `run_stages` stop a stage that has run past its timeout. While a stage is
+    doing something that can hang (loading a page, waiting on a subprocess, etc.), it
+    registers a callback with `on_cancel` that stops it (quitting the browser, killing
+    the subprocess, etc.)."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def on_cancel(self, callback: Callable):
+        """Calls the given callback if the stage is cancelled during the context (or
+        already was)."""
+        with self._lock:
+            if self.cancelled:
+                callback()
+            else:
+                self._callbacks.append(callback)
+        try:
+            yield
+        finally:
+            # Once this returns, the callback won't be called; e.g., a browser can
+            # safely go back to the pool without being quit out from under the next job
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for callback in self._callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning(f"Failed to cancel stage: {e}")
+            self._callbacks = []
+
+
+def run_stages(
+    stages: dict[str, Callable], timeouts: dict[str, int]
+) -> tuple[dict, dict]:
+    """Runs the given independent stages (a map of names to functions that take a
+    `StageCancellation`) concurrently.
+
+    Returns a map of each stage's result (`None` if it raised or didn't finish within
+    its timeout), and a map of each stage's outcome (whether it finished, whether it
+    timed out, and how long it took). A stage that times out is cancelled, and then
+    abandoned. Stages run on daemon threads, so one that doesn't stop when cancelled
+    can't hold up the job, or keep the process from exiting."""
+
+    started = monotonic()
+    runs = {}
+    for name, fn in stages.items():
+        run = dict(cancellation=StageCancellation(), done=threading.Event())
+
+        def target(fn=fn, run=run):
+            run["started"] = monotonic()
+            try:
+                run["result"] = fn(run["cancellation"])
+            except BaseException as e:
+                run["error"] = e
+            finally:
+                run["finished"] = monotonic()
+                run["done"].set()
+
+        threading.Thread(target=target, name=f"stage-{name}", daemon=True).start()
+        runs[name] = run
+
+    results = {}
+    outcomes = {}
+    for name, run in runs.items():
+        remaining = max(0, started + timeouts[name] - monotonic())
+        if not run["done"].wait(remaining):
+            logger.warning(f"Stage {name} timed out after {timeouts[name]}s")
+            run["cancellation"].cancel()
+            results[name] = None
+            outcomes[name] = dict(
+                completed=False,
+                timed_out=True,
+                duration=monotonic() - run.get("started", started),
+            )
+            continue
+
+        duration = run["finished"] - run["started"]
+        if "error" in run:
+            logger.opt(exception=run["error"]).error(
+                f"Stage {name} failed: {run['error']}"
+            )
+            results[name] = None
+            outcomes[name] = dict(completed=False, timed_out=False, duration=duration)
+        else:
+            results[name] = run["result"]
+            outcomes[name] = dict(completed=True, timed_out=False, duration=duration)
+
+    return results, outcomes
 
-    return dict(success=True, metadata=objects, files=files)
 
 def terminate_chrome_processes():
+    """Terminates any Chromium processes that this process started and that are still
+    running. This is a last resort for the one-off CLI; drivers from a `DriverPool`
+    clean up after themselves. We only look at our own children, since other archive
+    jobs on the same machine may have browsers open."""
     terminated_processes = []
-    for proc in psutil.process_iter(['name']):
+    for proc in psutil.Process().children(recursive=True):
         try:
             # Check if the process name contains any of the target names
-            if any(name in proc.name().lower() for name in ['chromium', 'chrome', 'chrome_crashpad']):
+            if any(
+                name in proc.name().lower()
+                for name in ["chromium", "chrome", "chrome_crashpad"]
+            ):
                 proc.terminate()
-                terminated_processes.append(proc.name())
+                terminated_processes.append(proc)
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
             pass
-    
+
     # Wait for the processes to actually terminate
-    psutil.wait_procs([proc for proc in psutil.process_iter() if proc.name() in terminated_processes], timeout=3)
-    
-    return terminated_processes
+    psutil.wait_procs(terminated_processes, timeout=3)
+
+    return [proc.pid for proc in terminated_processes]
+
+
+def available_cores() -> int:
+    """Returns the number of CPU cores this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_hasher(kind: str):
+    """Returns this process's instance of the given perceptual hasher, so that we don't
+    build a new one for every file."""
+    if kind == "phash":
+        return hashers.PHash()
+    elif kind == "tmkl1":
+        return hashers.TMKL1()
+    raise ValueError(f"unknown perceptual hash kind: {kind}")
+
+
+def create_hash_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Creates a process pool for perceptual hashing, sized to the available cores by
+    default. We use the forkserver start method because forking a process with running
+    threads (as ours has) is unsafe."""
+    return ProcessPoolExecutor(
+        max_workers=max_workers or available_cores(),
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
 
 
 def generate_perceptual_hashes(path: str) -> dict:
@@ -244,11 +757,11 @@ def generate_perceptual_hashes(path: str) -> dict:
         mime_type = mimetypes.guess_type(path)[0]
 
         if mime_type.startswith("image/") and not mime_type.startswith("image/svg"):
-            hasher = hashers.PHash()
+            hasher = get_hasher("phash")
             perceptual_hash = hasher.compute(path)
             return [dict(kind="phash", hash=perceptual_hash)]
         elif mime_type.startswith("video/"):
-            perceptual_hash_l1 = hashers.TMKL1().compute(path)
+            perceptual_hash_l1 = get_hasher("tmkl1").compute(path)
             return [
                 dict(kind="tmkl1", hash=perceptual_hash_l1),
             ]
@@ -257,65 +770,185 @@ def generate_perceptual_hashes(path: str) -> dict:
     return []
 
 
+def generate_all_perceptual_hashes(
+    paths: list[str], pool: Optional[ProcessPoolExecutor] = None
+) -> list:
+    """Generates perceptual hashes for each of the given files, returned in the same
+    order as `paths`. Hashing (especially of videos) is CPU-bound, so when there's more
+    than one file we spread them across a process pool. If no pool is given, one is
+    created just for these files."""
+
+    if len(paths) < 2:
+        return [generate_perceptual_hashes(path) for path in paths]
+
+    if pool is not None:
+        return list(pool.map(generate_perceptual_hashes, paths))
+
+    with create_hash_pool(min(len(paths), available_cores())) as pool:
+        return list(pool.map(generate_perceptual_hashes, paths))
+
+
+def perceptually_hash_artifacts(
+    artifacts: list[dict],
+    out: str,
+    pool: Optional[ProcessPoolExecutor] = None,
+    cache: Optional[PerceptualHashCache] = None,
+) -> dict:
+    """Fills in the perceptual hashes of the given artifacts (which must already be in
+    `out`). Files whose contents we've hashed before are looked up in the cache, and
+    each distinct file is only hashed once. Returns the cache's hits and misses."""
+
+    hits = 0
+    misses = {}
+    for artifact in artifacts:
+        cached = cache.get(artifact["sha256"]) if cache is not None else None
+        if cached is not None:
+            artifact["perceptual_hashes"] = cached
+            hits += 1
+        else:
+            misses.setdefault(artifact["sha256"], []).append(artifact)
+
+    hashes = generate_all_perceptual_hashes(
+        [os.path.join(out, same[0]["file"]) for same in misses.values()], pool=pool
+    )
+    for (sha256, same), perceptual_hashes in zip(misses.items(), hashes):
+        for artifact in same:
+            artifact["perceptual_hashes"] = perceptual_hashes
+
+        # We don't cache empty results, since they may be failures worth retrying
+        if cache is not None and perceptual_hashes:
+            cache.put(sha256, perceptual_hashes)
+
+    return dict(hits=hits, misses=sum(len(same) for same in misses.values()))
+
+
 def analyze_artifact(
-    path: str, perceptually_hash: bool = True, kind: str = "file"
+    path: str,
+    perceptually_hash: bool = True,
+    kind: str = "file",
+    sha256: Optional[str] = None,
 ) -> dict:
     return dict(
         kind=kind,
         file=os.path.basename(path),
-        sha256=compute_checksum(path),
+        sha256=sha256 or compute_checksum(path),
         perceptual_hashes=generate_perceptual_hashes(path) if perceptually_hash else [],
     )
 
 
+def finalize_artifact(
+    path: str, out: str, kind: str = "file", sha256: Optional[str] = None
+) -> dict:
+    """Copies the artifact at the given path into the output directory and analyzes it.
+    The checksum is computed during the copy, so we don't have to read the file twice.
+    If the checksum is already known, the file is moved instead. Perceptual hashes are
+    left empty; we compute those for all of a job's artifacts at once (in
+    `perceptually_hash_artifacts`, using `generate_all_perceptual_hashes`)."""
+    destination = os.path.join(out, os.path.basename(path))
+    if os.path.abspath(path) == destination:
+        sha256 = sha256 or compute_checksum(path)
+    elif sha256 is not None:
+        shutil.move(path, destination)
+    else:
+        sha256 = copy_with_checksum(path, destination)
+    return analyze_artifact(path, perceptually_hash=False, kind=kind, sha256=sha256)
+
+
 @timeout(60 * 3)
-@click.command()
-@click.option("--url", type=str)
-@click.option("--file", type=click.Path())
-@click.option("--out", type=click.Path())
-@click.option("--auto-archiver-config", type=click.Path())
-def run(url, file, out, auto_archiver_config):
-    """Archive the given URL."""
+def archive(
+    url: Optional[str],
+    file: Optional[str],
+    out: Optional[str],
+    auto_archiver_config: Optional[str],
+    pool: Optional[DriverPool] = None,
+    hash_pool: Optional[ProcessPoolExecutor] = None,
+    phash_cache: Optional[PerceptualHashCache] = None,
+    auto_archiver_mode: str = "in_process",
+    max_download_size: int = DEFAULT_MAX_DIRECT_DOWNLOAD_SIZE,
+    tiled_screenshots: bool = True,
+    max_screenshot_height: int = DEFAULT_MAX_SCREENSHOT_HEIGHT,
+) -> dict:
+    """Archives the given URL and/or file into `out`. Returns the metadata that is
+    written to `metadata.json`. If no driver pool is given, a single browser is started
+    just for this job; if no hash pool is given, one is created if the job has more than
+    one file to perceptually hash."""
 
     if out is None:
         out = os.path.join(os.getcwd(), "out")
         logger.info(f"Output directory not specified, using {out}")
 
-    # Make sure the paths are absolute, since we'll be changing directories
+    # The auto-archiver runs in the job's workspace, so make sure the paths are absolute
     if auto_archiver_config:
         auto_archiver_config = os.path.abspath(auto_archiver_config)
 
     out = os.path.abspath(out)
+    os.makedirs(out, exist_ok=True)
 
-    if not os.path.exists(out):
-        os.mkdir(out)
+    owns_pool = pool is None
+    if owns_pool:
+        pool = DriverPool(size=1)
 
     try:
-        with tempfile.TemporaryDirectory() as t:
-            os.chdir(t)
+        with Workspace() as workspace:
 
             artifacts = []
+            perceptually_hashable_artifacts = []
             selenium_archive = {}
             auto_archiver_archive = {}
+            stages = {}
 
             # try:
             # First, archive the file, if given
             if file is not None:
                 logger.info("Archiving the file...")
-                if os.path.join(out, os.path.basename(file)) != file:
-                    shutil.copyfile(
-                        file,
-                        os.path.join(out, os.path.basename(file)),
-                    )
-                artifacts.append(
-                    analyze_artifact(file, perceptually_hash=True, kind="file")
-                )
+                artifact = finalize_artifact(file, out, kind="file")
+                artifacts.append(artifact)
+                perceptually_hashable_artifacts.append(artifact)
 
             # Then, archive the URL, if given
             if url is not None:
-                # Archive the file directly, if possible/needed
-                logger.info("Archiving the data directly...")
-                direct_archive = maybe_download_file(url)
+                # Archive the file directly (if possible/needed), the page using
+                # Selenium, and the page using the Bellingcat auto-archiver. These are
+                # independent (and each write to their own files), so we run them all
+                # at once.
+                logger.info(
+                    "Archiving the page directly, using Selenium, and using "
+                    "auto-archiver..."
+                )
+                results, stages = run_stages(
+                    dict(
+                        direct_download=lambda cancellation: maybe_download_file(
+                            url,
+                            workspace,
+                            max_size=max_download_size * 1024 * 1024,
+                            timeout=STAGE_TIMEOUTS["direct_download"],
+                            cancellation=cancellation,
+                        ),
+                        selenium=lambda cancellation: archive_page_using_selenium(
+                            url,
+                            pool,
+                            workspace,
+                            timeout=STAGE_TIMEOUTS["selenium"],
+                            tiled_screenshots=tiled_screenshots,
+                            max_screenshot_height=max_screenshot_height,
+                            cancellation=cancellation,
+                        ),
+                        auto_archiver=lambda cancellation: archive_using_auto_archiver(
+                            url,
+                            workspace,
+                            config=auto_archiver_config,
+                            timeout=STAGE_TIMEOUTS["auto_archiver"],
+                            mode=auto_archiver_mode,
+                            cancellation=cancellation,
+                        ),
+                    ),
+                    STAGE_TIMEOUTS,
+                )
+
+                direct_archive = results["direct_download"]
+                selenium_archive = results["selenium"] or dict(success=False)
+                auto_archiver_archive = results["auto_archiver"] or dict(success=False)
+
                 if direct_archive is None:
                     logger.info("No direct archive available/necessary for this URL")
                 else:
@@ -323,14 +956,21 @@ def run(url, file, out, auto_archiver_config):
                         "Direct archive available/necessary for this URL (is not HTML)"
                     )
 
-                # Archive the page using Selenium
-                logger.info("Archiving the page using Selenium...")
-                selenium_archive = archive_page_using_selenium(url)
-
-                # Archive the page using the Bellingcat auto-archiver
-                logger.info("Archiving the page using the Bellingcat auto-archiver...")
-                auto_archiver_archive = archive_using_auto_archiver(
-                    url, config=auto_archiver_config
+                # A direct download that found nothing worth downloading (e.g., HTML)
+                # still succeeded
+                for name, success in [
+                    ("direct_download", stages["direct_download"]["completed"]),
+                    ("selenium", selenium_archive["success"]),
+                    ("auto_archiver", auto_archiver_archive["success"]),
+                ]:
+                    stages[name]["success"] = success
+
+                # How long the page took to settle (finish loading and stop changing)
+                stages["selenium"]["settle_time"] = selenium_archive.get("settle_time")
+
+                # How the full-page screenshot was taken, and how long it took
+                stages["selenium"]["fullpage_screenshot"] = selenium_archive.get(
+                    "fullpage_screenshot"
                 )
 
                 # Merge all the artifacts into a nice output folder
@@ -338,68 +978,316 @@ def run(url, file, out, auto_archiver_config):
 
                 if selenium_archive["success"]:
                     for screenshot in selenium_archive["screenshots"]:
-                        shutil.copyfile(
-                            screenshot["file"],
-                            os.path.join(out, os.path.basename(screenshot["file"])),
-                        )
                         artifacts.append(
-                            analyze_artifact(
-                                screenshot["file"],
-                                perceptually_hash=False,
-                                kind=screenshot["kind"],
+                            finalize_artifact(
+                                screenshot["file"], out, kind=screenshot["kind"]
                             )
                         )
 
-                    shutil.copyfile(
-                        selenium_archive["pdf"],
-                        os.path.join(out, "page.pdf"),
-                    )
                     artifacts.append(
-                        analyze_artifact(
-                            selenium_archive["pdf"], perceptually_hash=False, kind="pdf"
-                        )
+                        finalize_artifact(selenium_archive["pdf"], out, kind="pdf")
                     )
 
                 logger.info("Finalizing auto archiver files...")
 
                 if auto_archiver_archive["success"]:
                     for file in auto_archiver_archive["files"]:
-                        path = os.path.basename(file)
-                        shutil.copyfile(
-                            file,
-                            os.path.join(out, path),
-                        )
-                        artifacts.append(analyze_artifact(file, kind="media"))
+                        artifact = finalize_artifact(file, out, kind="media")
+                        artifacts.append(artifact)
+                        perceptually_hashable_artifacts.append(artifact)
 
                 logger.info("Finalizing direct archive (if applicable)...")
 
                 if direct_archive is not None:
-                    path = os.path.basename(direct_archive)
-                    shutil.copyfile(
-                        direct_archive,
-                        os.path.join(out, path),
+                    artifact = finalize_artifact(
+                        direct_archive["file"],
+                        out,
+                        kind="direct_file",
+                        sha256=direct_archive["sha256"],
                     )
-                    artifacts.append(analyze_artifact(direct_archive, kind="direct_file"))
+                    artifacts.append(artifact)
+                    perceptually_hashable_artifacts.append(artifact)
+
+            logger.info("Computing perceptual hashes...")
+
+            perceptual_hash_cache_stats = perceptually_hash_artifacts(
+                perceptually_hashable_artifacts,
+                out,
+                pool=hash_pool,
+                cache=phash_cache,
+            )
+
+            metadata = dict(
+                page_info=selenium_archive.get("data"),
+                artifacts=artifacts,
+                content_info=auto_archiver_archive.get("metadata"),
+                crawl_successful=selenium_archive.get("success"),
+                auto_archive_successful=auto_archiver_archive.get("success"),
+                is_likely_authwalled=(
+                    is_likely_authwalled(url) if url is not None else False
+                ),
+                stages=stages,
+                perceptual_hash_cache=perceptual_hash_cache_stats,
+            )
 
             # Write the metadata
             with open(os.path.join(out, "metadata.json"), "w") as outfile:
-                json.dump(
-                    dict(
-                        page_info=selenium_archive.get("data"),
-                        artifacts=artifacts,
-                        content_info=auto_archiver_archive.get("metadata"),
-                        crawl_successful=selenium_archive.get("success"),
-                        auto_archive_successful=auto_archiver_archive.get("success"),
-                        is_likely_authwalled=is_likely_authwalled(url)
-                        if url is not None
-                        else False,
-                    ),
-                    outfile,
-                )
+                json.dump(metadata, outfile)
 
             logger.success("Processing complete")
+            return metadata
     finally:
-        terminate_chrome_processes()        
+        if owns_pool:
+            pool.close()
+
+
+def serve(
+    auto_archiver_config: Optional[str],
+    pool: DriverPool,
+    hash_pool: ProcessPoolExecutor,
+    phash_cache: Optional[PerceptualHashCache],
+    auto_archiver_mode: str = "persistent",
+    concurrency: int = 1,
+    max_download_size: int = DEFAULT_MAX_DIRECT_DOWNLOAD_SIZE,
+    tiled_screenshots: bool = True,
+    max_screenshot_height: int = DEFAULT_MAX_SCREENSHOT_HEIGHT,
+):
+    """Runs as a long-lived worker, so that jobs don't each pay for Python startup and
+    its imports.
+
+    Jobs are read from stdin as JSON lines of the form
+    `{"id": ..., "url": ..., "file": ..., "out": ...}` (all keys but `id` mirror the CLI
+    options and are optional). For each job, one JSON line is written to stdout, either
+    `{"id": ..., "success": true, "metadata": {...}}`, where `metadata` is what was
+    written to `metadata.json`, or `{"id": ..., "success": false, "error": "..."}`. A
+    `{"ready": true}` line is written once the worker has started.
+
+    Up to `concurrency` jobs run at once, each in its own workspace; responses are
+    written as jobs finish, so they may come back in a different order than the jobs
+    were sent."""
+
+    # Anything else that writes to stdout (including subprocesses, like the
+    # auto-archiver) would corrupt the protocol, so we keep a private handle on stdout
+    # and point the real one at stderr.
+    sys.stdout.flush()
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    protocol_lock = threading.Lock()
+
+    def respond(message: dict):
+        with protocol_lock:
+            protocol.write(json.dumps(message) + "\n")
+            protocol.flush()
+
+    def run_job(job: dict):
+        job_id = job.get("id")
+        logger.info(f"Starting job {job_id}")
+
+        try:
+            metadata = archive(
+                job.get("url"),
+                job.get("file"),
+                job.get("out"),
+                job.get("auto_archiver_config", auto_archiver_config),
+                pool=pool,
+                hash_pool=hash_pool,
+                phash_cache=phash_cache,
+                auto_archiver_mode=auto_archiver_mode,
+                max_download_size=max_download_size,
+                tiled_screenshots=tiled_screenshots,
+                max_screenshot_height=max_screenshot_height,
+            )
+            respond(dict(id=job_id, success=True, metadata=metadata))
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed: {e}")
+            respond(dict(id=job_id, success=False, error=str(e)))
+
+    # Jobs beyond `concurrency` wait in stdin, rather than piling up in the executor
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run_job_in_slot(job: dict):
+        try:
+            run_job(job)
+        finally:
+            slots.release()
+
+    respond(dict(ready=True))
+    logger.info("Archive worker ready")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                respond(dict(id=None, success=False, error=f"Invalid job: {e}"))
+                continue
+            if not isinstance(job, dict):
+                respond(
+                    dict(
+                        id=None, success=False, error="Invalid job: expected an object"
+                    )
+                )
+                continue
+
+            # With one job at a time, we run it on the main thread so that the job
+            # timeout still applies
+            if concurrency == 1:
+                run_job(job)
+                continue
+
+            slots.acquire()
+            executor.submit(run_job_in_slot, job)
+
+    logger.info("Input closed, archive worker exiting")
+
+
+@click.command()
+@click.option("--url", type=str)
+@click.option("--file", type=click.Path())
+@click.option("--out", type=click.Path())
+@click.option("--auto-archiver-config", type=click.Path())
+@click.option(
+    "--auto-archiver-persistent/--auto-archiver-subprocess",
+    default=True,
+    help=(
+        "Run the auto-archiver's pipeline from Python, which hands back its metadata "
+        "directly (in a long-lived child process, for the worker), falling back to a "
+        "subprocess if it can't be loaded; or always run it in a subprocess."
+    ),
+)
+@click.option(
+    "--worker",
+    is_flag=True,
+    help="Run as a long-lived worker that reads JSON-lines jobs from stdin.",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=1,
+    help="Number of jobs to run at once; you'll want as many browsers (worker only).",
+)
+@click.option(
+    "--browsers",
+    type=int,
+    default=1,
+    help="Number of warm browsers to keep around (worker only).",
+)
+@click.option(
+    "--browser-max-uses",
+    type=int,
+    default=20,
+    help="Restart a browser after it has archived this many pages (worker only).",
+)
+@click.option(
+    "--browser-max-memory",
+    type=int,
+    default=1024,
+    help="Restart a browser once it uses more than this many MB (worker only).",
+)
+@click.option(
+    "--max-download-size",
+    type=int,
+    default=DEFAULT_MAX_DIRECT_DOWNLOAD_SIZE,
+    help="Largest file to download directly from the URL, in MB.",
+)
+@click.option(
+    "--tiled-screenshots/--no-tiled-screenshots",
+    default=True,
+    help=(
+        "Take full-page screenshots a viewport at a time, rather than by resizing the "
+        "window to fit the page."
+    ),
+)
+@click.option(
+    "--max-screenshot-height",
+    type=int,
+    default=DEFAULT_MAX_SCREENSHOT_HEIGHT,
+    help="How far down the page (in pixels) full-page screenshots may go.",
+)
+@click.option(
+    "--perceptual-hash-cache",
+    type=click.Path(),
+    default=DEFAULT_PERCEPTUAL_HASH_CACHE,
+    help="Directory in which to cache perceptual hashes.",
+)
+@click.option(
+    "--perceptual-hash-cache-size",
+    type=int,
+    default=DEFAULT_PERCEPTUAL_HASH_CACHE_SIZE,
+    help="Maximum size of the perceptual hash cache, in MB (0 disables the cache).",
+)
+def run(
+    url,
+    file,
+    out,
+    auto_archiver_config,
+    auto_archiver_persistent,
+    worker,
+    concurrency,
+    browsers,
+    browser_max_uses,
+    browser_max_memory,
+    max_download_size,
+    tiled_screenshots,
+    max_screenshot_height,
+    perceptual_hash_cache,
+    perceptual_hash_cache_size,
+):
+    """Archive the given URL."""
+
+    phash_cache = None
+    if perceptual_hash_cache_size > 0:
+        phash_cache = PerceptualHashCache(
+            perceptual_hash_cache, perceptual_hash_cache_size * 1024 * 1024
+        )
+
+    if worker:
+        pool = DriverPool(
+            size=browsers,
+            max_uses=browser_max_uses,
+            max_memory_mb=browser_max_memory,
+            prelaunch=True,
+        )
+        hash_pool = create_hash_pool()
+        try:
+            serve(
+                auto_archiver_config,
+                pool,
+                hash_pool,
+                phash_cache,
+                auto_archiver_mode=(
+                    "persistent" if auto_archiver_persistent else "subprocess"
+                ),
+                concurrency=concurrency,
+                max_download_size=max_download_size,
+                tiled_screenshots=tiled_screenshots,
+                max_screenshot_height=max_screenshot_height,
+            )
+        finally:
+            pool.close()
+            hash_pool.shutdown()
+            PersistentAutoArchiver.close_all()
+    else:
+        try:
+            archive(
+                url,
+                file,
+                out,
+                auto_archiver_config,
+                phash_cache=phash_cache,
+                auto_archiver_mode=(
+                    "in_process" if auto_archiver_persistent else "subprocess"
+                ),
+                max_download_size=max_download_size,
+                tiled_screenshots=tiled_screenshots,
+                max_screenshot_height=max_screenshot_height,
+            )
+        finally:
+            terminate_chrome_processes()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+# Runs the Bellingcat auto-archiver's pipeline from Python, rather than by starting the
+# `auto-archiver` CLI (and paying for Python startup and its imports) for every URL, and
+# hands back each archived item's metadata directly rather than by reparsing `db.csv`.
+# The archive worker keeps the auto-archiver loaded in a long-lived child process, so
+# that an archive that hangs can be killed outright (the next archive starts a new
+# child); a one-off archive just runs it in-process.
+
+import json
+import multiprocessing
+import os
+import threading
+from time import monotonic
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+def load_auto_archiver(config: str) -> Callable[[str, str, str], Optional[dict]]:
+    """Sets up the auto-archiver (its archivers, enrichers, storages, etc.) for the
+    given config, and returns a function `archive_url(url, directory, save_to)` that
+    archives a URL, saving its files to `save_to`, and returns the archived item's
+    metadata (or `None` if archiving failed). Each archive runs in `directory`, just
+    like `auto-archiver` run there would, so that everything the config writes relative
+    to the working directory (`db.csv`, temporary files, local storage) ends up there.
+    The auto-archiver keeps the state of the item being archived in globals, so only
+    archive one URL at a time."""
+
+    from auto_archiver import ArchivingOrchestrator, Config
+    from auto_archiver.core import Metadata
+
+    parsed = Config()
+    # The CLI feeder insists on having URLs, even though we hand the orchestrator its
+    # items ourselves
+    parsed.parse(
+        use_cli=False,
+        yaml_config_filename=config,
+        overwrite_configs=dict(
+            configurations=dict(cli_feeder=dict(urls=["https://atlos.org"]))
+        ),
+    )
+    orchestrator = ArchivingOrchestrator(parsed)
+
+    def archive_url(url: str, directory: str, save_to: str) -> Optional[dict]:
+        previous_directory = os.getcwd()
+        os.chdir(directory)
+        for storage in orchestrator.storages:
+            if hasattr(storage, "save_to"):
+                storage.save_to = save_to
+
+        try:
+            result = orchestrator.feed_item(Metadata().set_url(url))
+            if result is None:
+                return None
+            # Only plain JSON, which is what ends up in `metadata.json` anyway (and is
+            # all that can go back over a pipe); the metadata holds datetimes, among
+            # other things
+            return json.loads(json.dumps(result.metadata, default=str))
+        except Exception:
+            logger.exception("Auto archive failed")
+            return None
+        finally:
+            # Don't hold on to the directory, which is usually deleted after the job
+            os.chdir(previous_directory)
+
+    return archive_url
+
+
+def archive_in_process(
+    config: str, url: str, directory: str, save_to: str
+) -> Optional[dict]:
+    """Archives the given URL using the auto-archiver in this process (see
+    `load_auto_archiver`). Returns `dict(success=True, metadata=...)` if it succeeded,
+    `dict(success=False)` if it didn't, or `None` if the auto-archiver couldn't be
+    loaded. Unlike `PersistentAutoArchiver`, an archive that hangs can't be stopped, so
+    this is only for one-off archives."""
+    try:
+        archive_url = load_auto_archiver(config)
+    except Exception as e:
+        logger.warning(
+            f"Unable to load the auto archiver, will use a subprocess instead: {e}"
+        )
+        return None
+
+    metadata = archive_url(url, directory, save_to)
+    if metadata is None:
+        return dict(success=False)
+    return dict(success=True, metadata=metadata)
+
+
+def serve_auto_archiver(config: str, connection):
+    """Runs in the child: sets up the auto-archiver for the given config, then archives
+    the URLs it's sent, one at a time, sending back each archived item's metadata (or
+    `None` if archiving failed)."""
+
+    try:
+        archive_url = load_auto_archiver(config)
+    except Exception as e:
+        connection.send(f"{type(e).__name__}: {e}")
+        return
+    connection.send(None)
+
+    # Start from somewhere that won't be deleted out from under us
+    os.chdir("/")
+
+    while True:
+        try:
+            url, directory, save_to = connection.recv()
+        except EOFError:
+            return
+
+        connection.send(archive_url(url, directory, save_to))
+
+
+class PersistentAutoArchiver:
+    """A long-lived child process running the auto-archiver for one config (see
+    `serve_auto_archiver`). The auto-archiver keeps the state of the item being archived
+    in globals, so it can only archive one item at a time; hold `lock` while doing so.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_config(cls, config: str) -> Optional["PersistentAutoArchiver"]:
+        """Returns the (shared) persistent auto-archiver for the given config, or `None`
+        if the auto-archiver couldn't be loaded with it."""
+        with cls._instances_lock:
+            if config not in cls._instances:
+                cls._instances[config] = cls(config)
+            instance = cls._instances[config]
+        return instance if instance.available else None
+
+    @classmethod
+    def close_all(cls):
+        """Stops every persistent auto-archiver's child process."""
+        with cls._instances_lock:
+            instances = list(cls._instances.values())
+            cls._instances.clear()
+        for instance in instances:
+            with instance.lock:
+                if instance._process is not None:
+                    instance._stop()
+
+    def __init__(self, config: str):
+        self.config = config
+        self.available = True
+        self.lock = threading.Lock()
+        self._process = None
+        self._connection = None
+
+    def _start(self, timeout: float) -> bool:
+        """Starts the child, and waits for it to load the auto-archiver. Returns whether
+        it did."""
+        # A fresh interpreter, rather than a fork of this (multithreaded,
+        # browser-managing) process
+        context = multiprocessing.get_context("spawn")
+        connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=serve_auto_archiver,
+            args=(self.config, child_connection),
+            daemon=True,
+        )
+        self._process.start()
+        child_connection.close()
+        self._connection = connection
+
+        if not connection.poll(timeout):
+            logger.warning("Timed out waiting for the auto archiver to load")
+            self._stop()
+            return False
+
+        error = connection.recv()
+        if error is not None:
+            logger.warning(
+                "Unable to load the auto archiver, will use a subprocess instead: "
+                f"{error}"
+            )
+            self.available = False
+            self._stop()
+            return False
+
+        return True
+
+    def _stop(self):
+        self._process.kill()
+        self._process.join()
+        self._connection.close()
+        self._process = None
+        self._connection = None
+
+    def kill(self):
+        """Kills the child, if it's running, which makes the archive in progress (if
+        any) fail. Safe to call from any thread."""
+        process = self._process
+        if process is not None:
+            process.kill()
+
+    def archive(
+        self, url: str, directory: str, save_to: str, timeout: float
+    ) -> Optional[dict]:
+        """Archives the given URL from within `directory`, saving its files to
+        `save_to`. Returns `dict(success=True, metadata=...)` with the archived item's
+        metadata if it succeeded, `dict(success=False)` if it didn't, or `None` if the
+        auto-archiver couldn't be loaded. If it takes longer than `timeout` seconds
+        (including loading the auto-archiver, if need be), the child is killed. Must be
+        called with `lock` held."""
+
+        deadline = monotonic() + timeout
+
+        try:
+            if self._process is None or not self._process.is_alive():
+                if self._process is not None:
+                    self._stop()
+                if not self._start(timeout):
+                    return dict(success=False) if self.available else None
+
+            self._connection.send((url, directory, save_to))
+            if not self._connection.poll(max(0, deadline - monotonic())):
+                logger.warning("Auto archive timed out")
+                self._stop()
+                return dict(success=False)
+
+            metadata = self._connection.recv()
+            if metadata is None:
+                return dict(success=False)
+            return dict(success=True, metadata=metadata)
+        except (EOFError, OSError):
+            # The child died, or was killed (see `kill`)
+            logger.warning("Auto archiver process exited")
+            if self._process is not None:
+                self._stop()
+            return dict(success=False)
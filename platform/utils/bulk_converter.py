@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+
+# Converts partner datasets (CSV, XLSX or NDJSON) into CSVs that Atlos can bulk import,
+# driven by a mapping file rather than a one-off script per dataset. The mapping is
+# compiled once into small functions, and rows are streamed from the input to the output
+# one at a time, so memory use doesn't grow with the size of the import. See
+# `mappings/civharm.yaml` for a mapping that does what `civharm_converter.py` does.
+
+import csv
+import json
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+
+import click
+import yaml
+from dateutil.parser import parse as date_parse
+from loguru import logger
+
+# Takes the input row and the output values computed so far
+Getter = Callable[[dict, dict], str]
+
+TEMPLATE_PART = re.compile(r"\{\{|\}\}|\{([^{}]+)\}|[^{}]+")
+
+# Dates that look like this are read as ISO 8601, whatever the mapping's formats say
+# (unless it says `iso: false`). Date cells of XLSX files are always read as the dates
+# they are (see `DateText`), whatever the mapping says
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# Distinct date strings to remember per date field; imports tend to repeat the same few
+# dates a lot
+DATE_CACHE_SIZE = 65536
+
+# Some partner spreadsheets have very long narratives
+CSV_FIELD_SIZE_LIMIT = 2**31 - 1
+
+INPUT_FORMATS = {
+    ".csv": "csv",
+    ".xlsx": "xlsx",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+MAPPING_KEYS = {"include", "skip_message", "fields", "sources", "columns"}
+FIELD_KEYS = {
+    "value",
+    "column",
+    "default",
+    "choose",
+    "else",
+    "flags",
+    "separator",
+    "strip",
+    "remove",
+    "map",
+    "date",
+    "truncate",
+}
+CONDITION_KEYS = {
+    "column",
+    "default",
+    "strip",
+    "lower",
+    "equals",
+    "in",
+    "startswith",
+    "contains",
+    "min_length",
+    "empty",
+}
+
+
+class MappingError(ValueError):
+    pass
+
+
+class DateText(str):
+    """A date (or datetime) from a typed input, such as an XLSX date cell, as the text
+    a CSV export would have. It remembers the date itself, so that date fields don't
+    have to parse the text, which would be ambiguous (e.g., with `iso: false`)."""
+
+    def __new__(cls, value: date):
+        if isinstance(value, datetime) and value.time() != datetime.min.time():
+            text = value.isoformat(sep=" ")
+        elif isinstance(value, datetime):
+            text = value.date().isoformat()
+        else:
+            text = value.isoformat()
+        self = super().__new__(cls, text)
+        self.date = value
+        return self
+
+    def __reduce__(self):
+        return DateText, (self.date,)
+
+
+def constant(value: str) -> Getter:
+    return lambda row, values: value
+
+
+def check_keys(spec, allowed: set, where: str):
+    if not isinstance(spec, dict):
+        raise MappingError(f"{where} must be a mapping")
+    unknown = set(spec) - allowed
+    if unknown:
+        raise MappingError(f"unknown keys in {where}: {', '.join(sorted(unknown))}")
+
+
+def check_string(value, where: str) -> str:
+    # Unquoted YAML scalars like TRUE or 12 aren't strings, and wouldn't compare equal
+    # to the input
+    if not isinstance(value, str):
+        raise MappingError(f"{where} must be a string (try quoting it): {value!r}")
+    return value
+
+
+class RowTransformer:
+    """A mapping file, compiled into a function from input rows to Atlos rows.
+
+    Each output field is computed in the order it is listed, from a `value` template
+    (`{name}` refers to an earlier field if there is one by that name, or else to an
+    input column), a `column`, the first matching `choose` branch, or the `flags` whose
+    conditions hold. The result is then passed through `strip`, `remove`, `map`, `date`
+    and `truncate`, in that order, when they are given. Fields whose names start with
+    `_` are only used by later fields, and aren't written."""
+
+    def __init__(self, mapping: dict):
+        check_keys(mapping, MAPPING_KEYS, "the mapping")
+
+        # Input columns the mapping refers to, without a default
+        self.required_columns = set()
+        self._field_names = set()
+        self._fields = []
+
+        # Rows are included (or not) before any fields are computed, so these only see
+        # input columns
+        self._include = self._compile_conditions(mapping.get("include", []), "include")
+        self._skip_message = self._compile_template(
+            check_string(mapping.get("skip_message", "Skipping row"), "skip_message")
+        )
+
+        fields = mapping.get("fields") or {}
+        if not isinstance(fields, dict):
+            raise MappingError("fields must be a mapping")
+        for name, spec in fields.items():
+            self._fields.append((name, self._compile_field(name, spec)))
+            self._field_names.add(name)
+
+        self._source_prefix = None
+        self._source_names = []
+        self._source_columns = {}
+        sources = mapping.get("sources")
+        if sources is not None:
+            check_keys(sources, {"prefix", "slots", "name"}, "sources")
+            self._source_prefix = check_string(sources.get("prefix"), "sources.prefix")
+            name = check_string(sources.get("name", "source_{n}"), "sources.name")
+            self._source_names = [
+                name.format(n=n) for n in range(1, int(sources.get("slots", 0)) + 1)
+            ]
+
+        self.columns = list(
+            mapping.get("columns")
+            or [name for name, _ in self._fields if not name.startswith("_")]
+            + self._source_names
+        )
+
+    def _resolve(self, name: str, default: Optional[str] = None) -> Getter:
+        if name in self._field_names:
+            return lambda row, values: values[name]
+
+        if default is None:
+            self.required_columns.add(name)
+            return lambda row, values: row.get(name) or ""
+
+        def get(row, values):
+            value = row.get(name)
+            return default if value is None else value
+
+        return get
+
+    def _compile_template(self, template: str) -> Getter:
+        parts = []
+        position = 0
+        for match in TEMPLATE_PART.finditer(template):
+            if match.start() != position:
+                break
+            position = match.end()
+
+            if match.group(1) is not None:
+                parts.append(self._resolve(match.group(1)))
+                continue
+
+            text = match.group(0)
+            literal = {"{{": "{", "}}": "}"}.get(text, text)
+            if parts and isinstance(parts[-1], str):
+                parts[-1] += literal
+            else:
+                parts.append(literal)
+
+        if position != len(template):
+            raise MappingError(f"unbalanced braces in template: {template!r}")
+
+        getters = [part if callable(part) else constant(part) for part in parts]
+        if not getters:
+            return constant("")
+        if len(getters) == 1:
+            return getters[0]
+        return lambda row, values: "".join([get(row, values) for get in getters])
+
+    def _compile_condition(self, spec, where: str) -> Callable[[dict, dict], bool]:
+        if isinstance(spec, dict) and set(spec) == {"any"}:
+            options = [
+                self._compile_conditions(option, f"{where}.any")
+                for option in spec["any"]
+            ]
+            return lambda row, values: any(option(row, values) for option in options)
+
+        check_keys(spec, CONDITION_KEYS, where)
+        column = check_string(spec.get("column"), f"{where}.column")
+        default = spec.get("default")
+        get = self._resolve(
+            column,
+            None if default is None else check_string(default, f"{where}.default"),
+        )
+
+        if spec.get("strip"):
+            get = (lambda get: lambda row, values: get(row, values).strip())(get)
+        if spec.get("lower"):
+            get = (lambda get: lambda row, values: get(row, values).lower())(get)
+
+        tests = []
+        if "equals" in spec:
+            expected = check_string(spec["equals"], f"{where}.equals")
+            tests.append(lambda value: value == expected)
+        if "in" in spec:
+            options = frozenset(
+                check_string(option, f"{where}.in") for option in spec["in"]
+            )
+            tests.append(lambda value: value in options)
+        if "startswith" in spec:
+            prefix = check_string(spec["startswith"], f"{where}.startswith")
+            tests.append(lambda value: value.startswith(prefix))
+        if "contains" in spec:
+            needle = check_string(spec["contains"], f"{where}.contains")
+            tests.append(lambda value: needle in value)
+        if "min_length" in spec:
+            min_length = int(spec["min_length"])
+            tests.append(lambda value: len(value) >= min_length)
+        if "empty" in spec:
+            empty = bool(spec["empty"])
+            tests.append(lambda value: (len(value) == 0) == empty)
+
+        if not tests:
+            raise MappingError(f"{where} has nothing to test")
+        if len(tests) == 1:
+            test = tests[0]
+            return lambda row, values: test(get(row, values))
+
+        def test_all(row, values):
+            value = get(row, values)
+            return all(test(value) for test in tests)
+
+        return test_all
+
+    def _compile_conditions(self, spec, where: str) -> Callable[[dict, dict], bool]:
+        """Compiles a condition, or a list of conditions that must all hold."""
+        if isinstance(spec, list):
+            conditions = [
+                self._compile_condition(condition, f"{where}[{i}]")
+                for i, condition in enumerate(spec)
+            ]
+            if len(conditions) == 1:
+                return conditions[0]
+            return lambda row, values: all(
+                condition(row, values) for condition in conditions
+            )
+        return self._compile_condition(spec, where)
+
+    def _compile_source(self, name: str, spec: dict) -> Getter:
+        where = f"fields.{name}"
+
+        if "value" in spec:
+            return self._compile_template(check_string(spec["value"], f"{where}.value"))
+
+        if "column" in spec:
+            default = spec.get("default")
+            return self._resolve(
+                check_string(spec["column"], f"{where}.column"),
+                None if default is None else check_string(default, f"{where}.default"),
+            )
+
+        if "choose" in spec:
+            branches = []
+            for i, branch in enumerate(spec["choose"]):
+                check_keys(branch, {"when", "value"}, f"{where}.choose[{i}]")
+                branches.append(
+                    (
+                        self._compile_conditions(
+                            branch["when"], f"{where}.choose[{i}].when"
+                        ),
+                        self._compile_template(
+                            check_string(branch["value"], f"{where}.choose[{i}].value")
+                        ),
+                    )
+                )
+            otherwise = self._compile_template(
+                check_string(spec.get("else", ""), f"{where}.else")
+            )
+
+            def choose(row, values):
+                for when, value in branches:
+                    if when(row, values):
+                        return value(row, values)
+                return otherwise(row, values)
+
+            return choose
+
+        if "flags" in spec:
+            flags = []
+            for i, flag in enumerate(spec["flags"]):
+                check_keys(flag, {"when", "value"}, f"{where}.flags[{i}]")
+                flags.append(
+                    (
+                        self._compile_conditions(
+                            flag["when"], f"{where}.flags[{i}].when"
+                        ),
+                        check_string(flag["value"], f"{where}.flags[{i}].value"),
+                    )
+                )
+            separator = check_string(spec.get("separator", ", "), f"{where}.separator")
+            default = check_string(spec.get("default", ""), f"{where}.default")
+
+            def join_flags(row, values):
+                matched = [value for when, value in flags if when(row, values)]
+                return separator.join(matched) if matched else default
+
+            return join_flags
+
+        raise MappingError(f"{where} needs a value, column, choose or flags")
+
+    def _compile_field(self, name: str, spec) -> Getter:
+        where = f"fields.{name}"
+        if isinstance(spec, str):
+            spec = {"value": spec}
+        check_keys(spec, FIELD_KEYS, where)
+
+        get = self._compile_source(name, spec)
+        steps = []
+
+        if spec.get("strip"):
+            steps.append(str.strip)
+
+        if "remove" in spec:
+            pattern = re.compile(check_string(spec["remove"], f"{where}.remove"))
+            steps.append(lambda value: pattern.sub("", value))
+
+        if "map" in spec:
+            mapping = {
+                check_string(key, f"{where}.map"): check_string(value, f"{where}.map")
+                for key, value in spec["map"].items()
+            }
+            steps.append(lambda value: mapping.get(value, value))
+
+        if "date" in spec:
+            steps.append(self._compile_date(spec["date"], f"{where}.date"))
+
+        if "truncate" in spec:
+            truncate = spec["truncate"]
+            check_keys(truncate, {"length", "keep", "suffix"}, f"{where}.truncate")
+            suffix = check_string(
+                truncate.get("suffix", "…"), f"{where}.truncate.suffix"
+            )
+            length = int(truncate["length"])
+            keep = int(truncate.get("keep", length - len(suffix)))
+            steps.append(
+                lambda value: value[:keep] + suffix if len(value) > length else value
+            )
+
+        if not steps:
+            return get
+        if len(steps) == 1:
+            step = steps[0]
+            return lambda row, values: step(get(row, values))
+
+        def apply(row, values):
+            value = get(row, values)
+            for step in steps:
+                value = step(value)
+            return value
+
+        return apply
+
+    def _compile_date(self, spec, where: str) -> Callable[[str], str]:
+        check_keys(spec, {"formats", "dayfirst", "iso", "fallback", "output"}, where)
+        formats = [
+            check_string(format, f"{where}.formats")
+            for format in spec.get("formats", [])
+        ]
+        dayfirst = bool(spec.get("dayfirst", False))
+        iso = bool(spec.get("iso", True))
+        fallback = bool(spec.get("fallback", True))
+        output = check_string(spec.get("output", "%Y-%m-%d"), f"{where}.output")
+
+        @lru_cache(maxsize=DATE_CACHE_SIZE)
+        def parse_text(value: str) -> str:
+            """Returns the given date in the output format, or an empty string if it
+            can't be parsed."""
+            if iso and ISO_DATE.match(value):
+                try:
+                    return datetime.fromisoformat(value).strftime(output)
+                except ValueError:
+                    pass
+
+            for format in formats:
+                try:
+                    return datetime.strptime(value, format).strftime(output)
+                except ValueError:
+                    continue
+
+            if fallback:
+                try:
+                    return date_parse(value, dayfirst=dayfirst).strftime(output)
+                except (ValueError, OverflowError):
+                    pass
+            return ""
+
+        def parse(value: str) -> str:
+            # Typed dates are used as they are (and kept out of the cache, which would
+            # mistake them for text that looks the same)
+            if isinstance(value, DateText):
+                return value.date.strftime(output)
+            return parse_text(value)
+
+        return parse
+
+    def _sources(self, row: dict) -> list:
+        key = tuple(row)
+        columns = self._source_columns.get(key)
+        if columns is None:
+            columns = [
+                column
+                for column in key
+                if column is not None and column.startswith(self._source_prefix)
+            ]
+            self._source_columns[key] = columns
+        return [value for value in map(row.get, columns) if value]
+
+    def __call__(self, row: dict) -> tuple[Optional[list], Optional[str]]:
+        """Converts a single input row. Returns the output row (in `columns` order) and
+        `None`; or, if the row should be skipped, `None` and the reason."""
+        values = {}
+        if not self._include(row, values):
+            return None, self._skip_message(row, values)
+
+        for name, get in self._fields:
+            values[name] = get(row, values)
+
+        if self._source_prefix is not None:
+            sources = self._sources(row)
+            if len(sources) > len(self._source_names):
+                logger.warning(
+                    f"Dropping {len(sources) - len(self._source_names)} sources that "
+                    f"don't fit in {len(self._source_names)} slots"
+                )
+            values.update(zip(self._source_names, sources))
+
+        return [values.get(column, "") for column in self.columns], None
+
+
+def load_mapping(path: str) -> RowTransformer:
+    with open(path, "r") as infile:
+        mapping = yaml.safe_load(infile)
+    try:
+        return RowTransformer(mapping or {})
+    except MappingError as e:
+        raise click.ClickException(f"Invalid mapping {path}: {e}")
+
+
+def as_text(value) -> str:
+    """Converts a spreadsheet cell or JSON value to the string a CSV export has."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, date):
+        return DateText(value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def iter_csv(path: str, encoding: str) -> Iterator[dict]:
+    csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+    with open(path, "r", newline="", encoding=encoding) as infile:
+        yield from csv.DictReader(infile)
+
+
+def iter_xlsx(path: str, sheet: Optional[str] = None) -> Iterator[dict]:
+    try:
+        import openpyxl
+    except ImportError:
+        raise click.ClickException(
+            "Reading XLSX files requires openpyxl (pip install openpyxl)"
+        )
+
+    # In read-only mode, openpyxl streams rows from the file rather than loading the
+    # whole workbook
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        header = [as_text(cell) for cell in header]
+        for cells in rows:
+            # Sheets often have formatted, but otherwise empty, rows at the end
+            if all(cell is None for cell in cells):
+                continue
+            yield dict(zip(header, map(as_text, cells)))
+    finally:
+        workbook.close()
+
+
+def iter_ndjson(path: str, encoding: str) -> Iterator[dict]:
+    with open(path, "r", encoding=encoding) as infile:
+        for number, line in enumerate(infile, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not isinstance(entry, dict):
+                raise click.ClickException(f"{path}:{number}: expected a JSON object")
+            yield {key: as_text(value) for key, value in entry.items()}
+
+
+@click.command()
+@click.option(
+    "--mapping",
+    "mapping_path",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="YAML file describing how to convert each row.",
+)
+@click.option(
+    "--input", "input_path", type=click.Path(exists=True, dir_okay=False), required=True
+)
+@click.option("--outfile", type=click.Path(dir_okay=False), required=True)
+@click.option(
+    "--format",
+    "input_format",
+    type=click.Choice(sorted(set(INPUT_FORMATS.values()))),
+    help="Format of the input (default: based on its extension).",
+)
+@click.option(
+    "--sheet",
+    type=str,
+    help="Worksheet to read from XLSX files (default: the active one).",
+)
+@click.option(
+    "--encoding",
+    type=str,
+    default="utf-8-sig",
+    help="Encoding of CSV and NDJSON input.",
+)
+def run(mapping_path, input_path, outfile, input_format, sheet, encoding):
+    """Convert a partner dataset into a CSV that Atlos can bulk import."""
+
+    transformer = load_mapping(mapping_path)
+
+    if input_format is None:
+        extension = "." + input_path.rsplit(".", 1)[-1].lower()
+        input_format = INPUT_FORMATS.get(extension)
+        if input_format is None:
+            raise click.ClickException(
+                f"Can't tell the format of {input_path}; pass --format"
+            )
+
+    if input_format == "csv":
+        rows = iter_csv(input_path, encoding)
+    elif input_format == "xlsx":
+        rows = iter_xlsx(input_path, sheet)
+    else:
+        rows = iter_ndjson(input_path, encoding)
+
+    converted = 0
+    skipped = 0
+    with open(outfile, "w", newline="", encoding="utf-8") as output:
+        writer = csv.writer(output)
+        writer.writerow(transformer.columns)
+
+        for row in rows:
+            # Spreadsheets have a fixed header, so we can catch typos in the mapping
+            # up front
+            if converted + skipped == 0 and input_format != "ndjson":
+                for column in sorted(transformer.required_columns - set(row)):
+                    logger.warning(f"Input has no column named {column!r}")
+
+            values, skip_message = transformer(row)
+            if values is None:
+                click.echo(skip_message)
+                skipped += 1
+            else:
+                writer.writerow(values)
+                converted += 1
+
+    logger.info(f"Converted {converted} rows ({skipped} skipped)")
+
+
+if __name__ == "__main__":
+    run()
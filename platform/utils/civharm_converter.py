@@ -4,131 +4,198 @@ import click
 import unicodecsv as csv
 from dateutil.parser import parse as date_parse
 from collections import defaultdict
+from datetime import date as Date
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import Pool
 import re
 
+FIELDNAMES = [
+    "sensitive",
+    "description",
+    "latitude",
+    "longitude",
+    "more_info",
+    "type",
+    "impact",
+    "equipment",
+    "date",
+    "status",
+    "location",
+    "tags",
+] + ["source_" + str(i) for i in range(1, 23)]
+
+IMPACT_MAPPING = {
+    "Roads/Highways": ["Roads/Highways/Transport"],
+    "Undefined": [],
+    "": [],
+}
+
+EQUIPMENT_MAPPING = {"Undefined": [], "": []}
+
+NON_NUMERIC = re.compile(r"[^0-9\.]")
+
+# Almost every date in the spreadsheet looks like this, and parsing it directly is much
+# faster than asking dateutil to guess
+DAY_FIRST_DATE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+# Rows are sent to worker processes in chunks of this many
+CHUNK_SIZE = 1000
+
 
 def strip_to_float(string):
-    return re.sub("[^0-9\.]", "", string)
+    return NON_NUMERIC.sub("", string)
+
+
+@lru_cache(maxsize=None)
+def parse_date(value):
+    """Parses a (day first) reported date into YYYY-MM-DD, or returns an empty string if
+    it can't be parsed. Cached, since the same dates come up over and over."""
+
+    match = DAY_FIRST_DATE.match(value) if isinstance(value, str) else None
+    if match is not None:
+        day, month, year = (int(part) for part in match.groups())
+        try:
+            return Date(year, month, day).strftime("%Y-%m-%d")
+        except ValueError:
+            # e.g., a month-first date; dateutil knows what to do
+            pass
+
+    try:
+        return date_parse(value, dayfirst=True).strftime("%Y-%m-%d")
+    except:
+        return ""
+
+
+def convert_row(row):
+    """Converts a single CIVHARM row. Returns the values to write, and `None`; or, if
+    the row should be skipped, `None` and the reason."""
+
+    identifier = row["Incident no. "]
+    if not (identifier.startswith("CIV") and len(row["Narrative"]) > 7):
+        return None, f"Skipping {identifier}: {row['Narrative']}..."
+
+    comments = row["Comments"]
+    if len(comments) > 0:
+        comments = f"\n\n{comments}"
+
+    location = row["Location"].strip()
+    if len(location) == 0:
+        location = "No reported location."
+    else:
+        location = f"Reported near {location}."
+
+    more_info = f"Corresponds to **{identifier}**. {location}"
+
+    if len(more_info) >= 2750:
+        more_info = more_info[:2750] + "…"
+
+    sensitive = []
+    if row["Private Information Visible"] == "Yes":
+        sensitive.append("Personal Information Visible")
+    if "graphic" in row["Narrative"].lower() or row["Graphic"] == "TRUE":
+        sensitive.append("Graphic Violence")
+    if len(sensitive) == 0:
+        sensitive.append("Not Sensitive")
+
+    description = identifier + ": " + row["Narrative"]
+    if len(description) > 239:
+        description = description[:237] + "…"
+
+    impact = (
+        [row["Type of area affected"]]
+        if row["Type of area affected"] not in IMPACT_MAPPING
+        else IMPACT_MAPPING[row["Type of area affected"]]
+    )
+
+    equipment = (
+        [row["Weapon System"]]
+        if row["Weapon System"] not in EQUIPMENT_MAPPING
+        else EQUIPMENT_MAPPING[row["Weapon System"]]
+    )
+
+    type = ["Civilian Harm"]
+
+    status = (
+        "Completed" if row.get("BCAT\n (geolocated)", "TRUE") == "TRUE" else "To Do"
+    )
+
+    latitude = strip_to_float(row["Lat"])
+    longitude = strip_to_float(row["Lon"])
+
+    values = {
+        "more_info": more_info,
+        "sensitive": ", ".join(sensitive),
+        "description": description,
+        "type": ", ".join(type),
+        "equipment": ", ".join(equipment),
+        "impact": ", ".join(impact),
+        "date": parse_date(row["Reported Date"]),
+        "status": status,
+        "latitude": latitude,
+        "longitude": longitude,
+        "location": f"{latitude}, {longitude}" if len(longitude) > 0 else "",
+        "tags": "CIVHARM, Bulk Import",
+    }
+
+    source_number = 1
+    for k, v in row.items():
+        if k.startswith("Source") and v is not None and len(v) > 0:
+            values["source_" + str(source_number)] = v
+            source_number += 1
+
+    return values, None
+
+
+def convert_chunk(rows):
+    return [convert_row(row) for row in rows]
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
 
 @click.command()
 @click.option("--civharm", type=click.File("rb"))
 @click.option("--outfile", type=click.File("wb"))
-def run(civharm, outfile):
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes to convert rows with (the output is the same anyway).",
+)
+def run(civharm, outfile, workers):
     """Convert from a CIVHARM spreadsheet export (CSV) to something importable by Atlos."""
 
     reader = csv.DictReader(civharm)
-    writer = csv.DictWriter(
-        outfile,
-        [
-            "sensitive",
-            "description",
-            "latitude",
-            "longitude",
-            "more_info",
-            "type",
-            "impact",
-            "equipment",
-            "date",
-            "status",
-            "location",
-            "tags",
-        ]
-        + ["source_" + str(i) for i in range(1, 23)],
-    )
+    writer = csv.DictWriter(outfile, FIELDNAMES)
 
     writer.writeheader()
-    for row in reader:
-        identifier = row["Incident no. "]
-        if identifier.startswith("CIV") and len(row["Narrative"]) > 7:
-            comments = row["Comments"]
-            if len(comments) > 0:
-                comments = f"\n\n{comments}"
-
-            location = row["Location"].strip()
-            if len(location) == 0:
-                location = "No reported location."
+
+    if workers > 1:
+        pool = Pool(workers)
+        # `imap` keeps the chunks in order
+        results = (
+            result
+            for chunk in pool.imap(convert_chunk, chunks(reader, CHUNK_SIZE))
+            for result in chunk
+        )
+    else:
+        pool = None
+        results = map(convert_row, reader)
+
+    try:
+        for values, skipped in results:
+            if skipped is not None:
+                print(skipped)
             else:
-                location = f"Reported near {location}."
-
-            more_info = f"Corresponds to **{identifier}**. {location}"
-
-            if len(more_info) >= 2750:
-                more_info = more_info[:2750] + "…"
-
-            sensitive = []
-            if row["Private Information Visible"] == "Yes":
-                sensitive.append("Personal Information Visible")
-            if "graphic" in row["Narrative"].lower() or row["Graphic"] == "TRUE":
-                sensitive.append("Graphic Violence")
-            if len(sensitive) == 0:
-                sensitive.append("Not Sensitive")
-
-            description = identifier + ": " + row["Narrative"]
-            if len(description) > 239:
-                description = description[:237] + "…"
-
-            impact_mapping = {
-                "Roads/Highways": ["Roads/Highways/Transport"],
-                "Undefined": [],
-                "": [],
-            }
-
-            impact = (
-                [row["Type of area affected"]]
-                if row["Type of area affected"] not in impact_mapping
-                else impact_mapping[row["Type of area affected"]]
-            )
-
-            equipment_mapping = {"Undefined": [], "": []}
-
-            equipment = (
-                [row["Weapon System"]]
-                if row["Weapon System"] not in equipment_mapping
-                else equipment_mapping[row["Weapon System"]]
-            )
-
-            type = ["Civilian Harm"]
-
-            try:
-                date = date_parse(row["Reported Date"], dayfirst=True).strftime(
-                    "%Y-%m-%d"
-                )
-            except:
-                date = ""
-
-            status = (
-                "Completed"
-                if row.get("BCAT\n (geolocated)", "TRUE") == "TRUE"
-                else "To Do"
-            )
-
-            values = {
-                "more_info": more_info,
-                "sensitive": ", ".join(sensitive),
-                "description": description,
-                "type": ", ".join(type),
-                "equipment": ", ".join(equipment),
-                "impact": ", ".join(impact),
-                "date": date,
-                "status": status,
-                "latitude": strip_to_float(row["Lat"]),
-                "longitude": strip_to_float(row["Lon"]),
-                "location": f"{strip_to_float(row['Lat'])}, {strip_to_float(row['Lon'])}"
-                if len(strip_to_float(row["Lon"])) > 0
-                else "",
-                "tags": "CIVHARM, Bulk Import",
-            }
-
-            source_number = 1
-            for k, v in row.items():
-                if k.startswith("Source") and v is not None and len(v) > 0:
-                    values["source_" + str(source_number)] = v
-                    source_number += 1
-
-            writer.writerow(values)
-        else:
-            print(f"Skipping {identifier}: {row['Narrative']}...")
+                writer.writerow(values)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+# A bounded pool of warm, headless Chromium drivers. Starting Chromium is slow, so the
+# archive worker keeps a few browsers around and hands each job a driver that has been
+# reset to a clean state.
+
+import contextlib
+import json
+import queue
+import threading
+from urllib.parse import urlsplit
+
+import psutil
+from loguru import logger
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options as ChromeOptions
+from selenium.webdriver.chrome.service import Service as ChromiumService
+
+WINDOW_SIZE = (1600, 1200)
+
+
+def create_driver() -> webdriver.Chrome:
+    """Launches a new headless Chromium driver."""
+
+    options = ChromeOptions()
+
+    # At a glance, disabling "sandboxing" sounds scary. But don't worry (too much). This
+    # is a requirement since we're running Chromium within a Docker container; to get
+    # Chromium sandboxing to work, we'd need to change the seccomp policy that the
+    # Docker container is running under. We have some protections in place to mitigate
+    # some of the fallout of an attacker finding a Chromium exploit and using it on us
+    # (e.g., cleaning the environment to remove sensitive variables), but this is — to
+    # an extent — an acceptable risk (given the complexity tradeoff).
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--headless")
+    options.binary_location = "/usr/bin/chromium"
+
+    # Log the requests the browser makes, so that we know which origins' data to clear
+    # between jobs
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option(
+        "perfLoggingPrefs", {"enableNetwork": True, "enablePage": False}
+    )
+
+    # Set up the Service object with the path to chromedriver
+    service = ChromiumService("/usr/bin/chromedriver")
+
+    # Initialize the Chrome WebDriver
+    driver = webdriver.Chrome(service=service, options=options)
+    driver.set_window_size(*WINDOW_SIZE)
+    return driver
+
+
+def driver_processes(driver: webdriver.Chrome) -> list:
+    """Returns the chromedriver process for the given driver, along with all of the
+    browser processes it started."""
+    try:
+        service_process = psutil.Process(driver.service.process.pid)
+        return [service_process] + service_process.children(recursive=True)
+    except (AttributeError, psutil.NoSuchProcess):
+        return []
+
+
+def visited_origins(driver: webdriver.Chrome) -> set:
+    """Returns the origins of every request the browser has made since this was last
+    called, from its performance log: the pages it visited, but also their redirects,
+    iframes and subresources."""
+    origins = set()
+    for entry in driver.get_log("performance"):
+        try:
+            message = json.loads(entry["message"])["message"]
+            if message["method"] != "Network.requestWillBeSent":
+                continue
+            url = urlsplit(message["params"]["request"]["url"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if url.scheme in ("http", "https") and url.netloc:
+            origins.add(f"{url.scheme}://{url.netloc}")
+    return origins
+
+
+def driver_memory_usage(driver: webdriver.Chrome) -> int:
+    """Returns the total resident memory (in bytes) of the given driver and its
+    browser processes."""
+    total = 0
+    for proc in driver_processes(driver):
+        try:
+            total += proc.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            pass
+    return total
+
+
+class DriverPool:
+    """A bounded pool of headless Chromium drivers.
+
+    Use `with pool.driver() as driver:` to check out a driver. If the block raises, the
+    driver is discarded (since we don't know what state it's in); otherwise it's reset
+    and returned to the pool. Drivers are also recycled once they have been used
+    `max_uses` times or once the browser's memory usage exceeds `max_memory_mb`."""
+
+    def __init__(
+        self,
+        size: int = 1,
+        max_uses: int = 20,
+        max_memory_mb: int = 1024,
+        prelaunch: bool = False,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_memory_mb = max_memory_mb
+
+        # Limits the number of drivers checked out at once; idle drivers only exist in
+        # the slots that aren't checked out, so this also bounds the number of browsers.
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._uses = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if prelaunch:
+            for _ in range(size):
+                self._idle.put(self._launch())
+
+    def _launch(self) -> webdriver.Chrome:
+        logger.debug("Launching a new browser")
+        driver = create_driver()
+        with self._lock:
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _checkout(self) -> webdriver.Chrome:
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            driver = self._launch()
+
+        with self._lock:
+            self._uses[id(driver)] += 1
+        return driver
+
+    def _checkin(self, driver: webdriver.Chrome):
+        with self._lock:
+            uses = self._uses.get(id(driver), 0)
+
+        if self._closed:
+            self.discard(driver)
+            return
+
+        if uses >= self.max_uses:
+            logger.debug(f"Recycling browser after {uses} uses")
+            self.discard(driver)
+            return
+
+        memory_mb = driver_memory_usage(driver) / (1024 * 1024)
+        if memory_mb > self.max_memory_mb:
+            logger.debug(f"Recycling browser using {memory_mb:.0f}MB of memory")
+            self.discard(driver)
+            return
+
+        try:
+            self.reset(driver)
+        except Exception as e:
+            logger.warning(f"Failed to reset browser, discarding it: {e}")
+            self.discard(driver)
+            return
+
+        self._idle.put(driver)
+
+    def reset(self, driver: webdriver.Chrome):
+        """Returns the driver to a clean state, so that nothing from one job leaks into
+        the next."""
+
+        # Close any windows or tabs that the page opened
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        driver.get("about:blank")
+
+        # Clear local storage, IndexedDB, service workers, etc. for every origin the
+        # browser made a request to, not just the page we ended up on: redirects,
+        # iframes and earlier pages may have left data of their own behind. (Chromium
+        # can only clear this data one origin at a time.)
+        for origin in sorted(visited_origins(driver)):
+            driver.execute_cdp_cmd(
+                "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"}
+            )
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        driver.set_window_size(*WINDOW_SIZE)
+
+    def discard(self, driver: webdriver.Chrome):
+        """Quits the given driver, making sure that none of its browser processes are
+        left behind."""
+
+        processes = driver_processes(driver)
+
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit browser cleanly: {e}")
+
+        for proc in processes:
+            try:
+                proc.terminate()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        psutil.wait_procs(processes, timeout=3)
+
+        with self._lock:
+            self._uses.pop(id(driver), None)
+
+    @contextlib.contextmanager
+    def driver(self):
+        """Checks out a driver for the duration of the context."""
+
+        if self._closed:
+            raise RuntimeError("driver pool is closed")
+
+        self._slots.acquire()
+        try:
+            driver = self._checkout()
+            try:
+                yield driver
+            except BaseException:
+                self.discard(driver)
+                raise
+            else:
+                self._checkin(driver)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Quits all of the idle drivers. Drivers that are checked out are quit when
+        they're returned."""
+
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
@@ -0,0 +1,107 @@
+# An on-disk cache of perceptual hashes, keyed by the SHA256 of the file's contents. The
+# same media is often archived many times (re-archives, the same video posted across
+# incidents, etc.), and perceptual hashing — especially of videos — is expensive, so
+# identical bytes only need to be hashed once.
+
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+from loguru import logger
+
+is_sha256 = re.compile(r"^[0-9a-f]{64}$")
+
+# After evicting, the cache is brought down to this fraction of its maximum size, so
+# that we don't have to rescan the cache on every write once it's full.
+EVICTION_TARGET = 0.9
+
+
+class PerceptualHashCache:
+    """A size-bounded, least-recently-used cache of perceptual hashes. Entries are small
+    JSON files, and their modification times record when they were last used. Safe to
+    share between processes."""
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _path(self, sha256: str) -> str:
+        if not is_sha256.match(sha256):
+            raise ValueError(f"invalid SHA256 checksum: {sha256}")
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.json")
+
+    def _entries(self) -> list:
+        """Returns a list of `(path, last used, size)` for every entry in the cache."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Evicted by another process
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, sha256: str) -> Optional[list]:
+        """Returns the cached perceptual hashes for the file with the given checksum,
+        if any."""
+        path = self._path(sha256)
+        try:
+            with open(path, "r") as infile:
+                hashes = json.load(infile)
+            # Mark the entry as recently used
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return hashes
+
+    def put(self, sha256: str, hashes: list):
+        """Caches the perceptual hashes for the file with the given checksum."""
+        path = self._path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write atomically, so that other processes never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump(hashes, outfile)
+        size = os.path.getsize(temp_path)
+
+        # We may be replacing an existing entry, whose size we've already counted
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._size += size - replaced_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+
+        for path, _, size in entries:
+            if total <= self.max_size * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        logger.debug(f"Evicted {evicted} perceptual hash cache entries")
+        self._size = total
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Finds groups of (likely) duplicate media across many perceptual hashes at once, e.g.
+# when sweeping a whole project after a bulk import. Hashes are decoded once into a
+# packed bit matrix, and Hamming distances are computed a block at a time with NumPy,
+# rather than comparing hashes pair by pair.
+
+import base64
+import binascii
+import json
+import sys
+from collections import defaultdict
+from typing import Iterator, Optional
+
+import click
+import numpy as np
+from loguru import logger
+
+# Matches the threshold used by the platform's duplicate detector
+DEFAULT_MAX_DISTANCE = 15
+
+# Roughly how many 64-bit words of XORed hashes we materialize at once (32MB)
+DEFAULT_BLOCK_WORDS = 4 * 1024 * 1024
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        """Counts the set bits in each row (the last axis) of a uint64 array."""
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.uint32)
+
+else:
+    # NumPy < 2.0 has no popcount, so we look each byte up in a table instead
+    POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        """Counts the set bits in each row (the last axis) of a uint64 array."""
+        as_bytes = words.view(np.uint8).reshape(*words.shape[:-1], -1)
+        return POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint32)
+
+
+def decode_hashes(hashes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Decodes base64 perceptual hashes of the same length into a matrix with one row of
+    packed uint64 words per hash (zero-padded to a whole number of words). Hashes that
+    are invalid or that don't match the length of the first valid hash are skipped.
+    Returns the matrix and the indices (into `hashes`) of its rows."""
+
+    rows = []
+    indices = []
+    length = None
+
+    for i, perceptual_hash in enumerate(hashes):
+        try:
+            data = base64.b64decode(perceptual_hash, validate=True)
+        except (binascii.Error, TypeError):
+            logger.warning(f"Skipping invalid perceptual hash at index {i}")
+            continue
+
+        if length is None:
+            length = len(data)
+        elif len(data) != length:
+            logger.warning(
+                f"Skipping perceptual hash of unexpected length at index {i}"
+            )
+            continue
+
+        rows.append(data)
+        indices.append(i)
+
+    return pack_hashes(rows), np.array(indices, dtype=np.int64)
+
+
+def pack_hashes(rows: list[bytes]) -> np.ndarray:
+    """Packs decoded hashes of the same length into a matrix with one row of uint64
+    words per hash (zero-padded to a whole number of words)."""
+    if not rows:
+        return np.zeros((0, 0), dtype=np.uint64)
+
+    padded_length = -(-len(rows[0]) // 8) * 8
+    buffer = b"".join(row.ljust(padded_length, b"\0") for row in rows)
+    matrix = np.frombuffer(buffer, dtype=np.uint8).reshape(len(rows), padded_length)
+    return matrix.view(np.uint64)
+
+
+def block_size(words_per_hash: int, block_words: int = DEFAULT_BLOCK_WORDS) -> int:
+    """Returns how many hashes per side of a block keep it within `block_words`
+    XORed words."""
+    return max(1, int((block_words / max(1, words_per_hash)) ** 0.5))
+
+
+def hamming_distances(queries: np.ndarray, corpus: np.ndarray) -> np.ndarray:
+    """Returns the matrix of Hamming distances between each row of `queries` and each
+    row of `corpus` (both as returned by `decode_hashes`). This materializes every pair
+    at once, so keep them small."""
+    return popcount(queries[:, None, :] ^ corpus[None, :, :])
+
+
+def iter_close_pairs(
+    queries: np.ndarray,
+    corpus: Optional[np.ndarray] = None,
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    block_words: int = DEFAULT_BLOCK_WORDS,
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yields `(query rows, corpus rows, distances)` arrays for every pair within
+    `max_distance`, a block at a time. If no corpus is given, compares `queries` against
+    itself and yields each pair once (with the query row less than the corpus row)."""
+
+    all_pairs = corpus is None
+    if all_pairs:
+        corpus = queries
+
+    size = block_size(queries.shape[1], block_words)
+
+    for query_start in range(0, len(queries), size):
+        query_block = queries[query_start : query_start + size]
+
+        # When comparing against ourselves, blocks below the diagonal are covered
+        corpus_start_from = query_start if all_pairs else 0
+        for corpus_start in range(corpus_start_from, len(corpus), size):
+            corpus_block = corpus[corpus_start : corpus_start + size]
+            distances = hamming_distances(query_block, corpus_block)
+
+            close = distances <= max_distance
+            if all_pairs and corpus_start == query_start:
+                close = np.triu(close, k=1)
+
+            query_rows, corpus_rows = np.nonzero(close)
+            if len(query_rows):
+                yield (
+                    query_rows + query_start,
+                    corpus_rows + corpus_start,
+                    distances[query_rows, corpus_rows],
+                )
+
+
+def find_duplicate_groups(
+    hashes: list[str],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    block_words: int = DEFAULT_BLOCK_WORDS,
+) -> list[list[int]]:
+    """Clusters the given base64 perceptual hashes into groups of (likely) duplicates:
+    hashes that are within `max_distance` of each other, directly or through other
+    hashes in the group. Hashes of different lengths are never compared. Returns groups
+    of two or more indices into `hashes`."""
+
+    # Indices and decoded hashes, by length
+    by_length = defaultdict(lambda: ([], []))
+    for i, perceptual_hash in enumerate(hashes):
+        try:
+            data = base64.b64decode(perceptual_hash, validate=True)
+        except (binascii.Error, TypeError):
+            logger.warning(f"Skipping invalid perceptual hash at index {i}")
+            continue
+        same_length, rows = by_length[len(data)]
+        same_length.append(i)
+        rows.append(data)
+
+    # Union-find over the indices into `hashes`
+    parents = list(range(len(hashes)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for same_length, rows in by_length.values():
+        matrix = pack_hashes(rows)
+        indices = np.array(same_length, dtype=np.int64)
+
+        for query_rows, corpus_rows, _ in iter_close_pairs(
+            matrix, max_distance=max_distance, block_words=block_words
+        ):
+            for a, b in zip(
+                indices[query_rows].tolist(), indices[corpus_rows].tolist()
+            ):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = defaultdict(list)
+    for i in range(len(hashes)):
+        groups[find(i)].append(i)
+    return sorted(
+        (group for group in groups.values() if len(group) > 1),
+        key=lambda group: group[0],
+    )
+
+
+@click.command()
+@click.option(
+    "--input",
+    "infile",
+    type=click.File("r"),
+    default="-",
+    help='JSON lines of {"key": ..., "kind": ..., "hash": ...} (default: stdin).',
+)
+@click.option("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE)
+def run(infile, max_distance):
+    """Find groups of duplicate perceptual hashes, and print them as JSON lines."""
+
+    by_kind = defaultdict(list)
+    for line in infile:
+        if line.strip():
+            entry = json.loads(line)
+            by_kind[entry["kind"]].append(entry)
+
+    for kind, entries in by_kind.items():
+        logger.info(f"Finding duplicates among {len(entries)} {kind} hashes...")
+        groups = find_duplicate_groups(
+            [entry["hash"] for entry in entries], max_distance=max_distance
+        )
+        for group in groups:
+            sys.stdout.write(
+                json.dumps(dict(kind=kind, keys=[entries[i]["key"] for i in group]))
+                + "\n"
+            )
+        logger.info(f"Found {len(groups)} groups of duplicate {kind} hashes")
+
+
+if __name__ == "__main__":
+    run()
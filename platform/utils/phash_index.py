@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# A nearest-neighbour index over perceptual hashes, for finding (likely) duplicate media
+# without comparing a new hash against every hash in a project. Hashes are the base64
+# strings that `archive.py` emits, and are compared by Hamming distance, just like the
+# duplicate detector in the platform does.
+
+import base64
+import binascii
+import json
+import os
+import sys
+import threading
+from typing import Optional
+
+import click
+from loguru import logger
+
+# Matches the threshold used by the platform's duplicate detector
+DEFAULT_MAX_DISTANCE = 15
+
+
+def decode_hash(perceptual_hash: str) -> tuple[int, int]:
+    """Decodes a base64 perceptual hash into its bits (packed into an integer) and its
+    length in bytes."""
+    try:
+        data = base64.b64decode(perceptual_hash, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"invalid perceptual hash: {e}")
+    return int.from_bytes(data, "big"), len(data)
+
+
+class BKTree:
+    """A BK-tree over integers, using the Hamming distance between their bits. Each
+    node is a list of `[value, keys, children]`, where `children` maps distances to
+    child nodes."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, key: str):
+        if self.root is None:
+            self.root = [value, {key}, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].add(key)
+                return
+
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {key}, {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, set, int]]:
+        """Returns `(value, keys, distance)` for every value within `max_distance` of
+        the given value."""
+        if self.root is None:
+            return []
+
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= max_distance:
+                results.append((node[0], node[1], distance))
+
+            # By the triangle inequality, matches can only be under these children
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class PerceptualHashIndex:
+    """An index of perceptual hashes, each associated with a key (e.g., a media version
+    or artifact ID).
+
+    Hashes of different kinds (and lengths) are never compared to one another. If a path
+    is given, the index is loaded from it, and every insert is appended to it, so that
+    the index survives restarts."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._trees = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self.size = 0
+
+        if path is not None:
+            if os.path.exists(path):
+                self._load(path)
+            self._log = open(path, "a")
+
+    def _load(self, path: str):
+        with open(path, "r") as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                    self._insert(entry["key"], entry["kind"], entry["hash"])
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    # e.g., a partially-written final line after a crash
+                    logger.warning(f"Skipping invalid index entry: {line.strip()}")
+        logger.info(f"Loaded {self.size} perceptual hashes from {path}")
+
+    def _insert(self, key: str, kind: str, perceptual_hash: str):
+        value, length = decode_hash(perceptual_hash)
+        self._trees.setdefault((kind, length), BKTree()).add(value, key)
+        self.size += 1
+
+    def add(self, key: str, kind: str, perceptual_hash: str):
+        """Adds the given perceptual hash to the index."""
+        with self._lock:
+            self._insert(key, kind, perceptual_hash)
+            if self._log is not None:
+                self._log.write(
+                    json.dumps(dict(key=key, kind=kind, hash=perceptual_hash)) + "\n"
+                )
+                self._log.flush()
+
+    def add_metadata(self, key: str, metadata: dict) -> int:
+        """Adds every perceptual hash in the given archive metadata (as written to
+        `metadata.json`) to the index under the given key. Returns how many were
+        added."""
+        added = 0
+        for artifact in metadata.get("artifacts", []):
+            for perceptual_hash in artifact.get("perceptual_hashes", []):
+                self.add(key, perceptual_hash["kind"], perceptual_hash["hash"])
+                added += 1
+        return added
+
+    def query(
+        self, kind: str, perceptual_hash: str, max_distance: int = DEFAULT_MAX_DISTANCE
+    ) -> list[dict]:
+        """Returns every key with a hash of the same kind within `max_distance` of the
+        given hash, closest first."""
+        value, length = decode_hash(perceptual_hash)
+
+        with self._lock:
+            tree = self._trees.get((kind, length))
+            matches = tree.search(value, max_distance) if tree is not None else []
+
+        results = [
+            dict(
+                key=key,
+                hash=base64.b64encode(match.to_bytes(length, "big")).decode(),
+                distance=distance,
+            )
+            for match, keys, distance in matches
+            for key in keys
+        ]
+        return sorted(results, key=lambda result: (result["distance"], result["key"]))
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def handle(index: PerceptualHashIndex, request: dict) -> dict:
+    """Handles a single request to the index service."""
+    op = request.get("op")
+    if op == "add":
+        index.add(request["key"], request["kind"], request["hash"])
+        return dict(success=True)
+    elif op == "add_metadata":
+        added = index.add_metadata(request["key"], request["metadata"])
+        return dict(success=True, added=added)
+    elif op == "query":
+        matches = index.query(
+            request["kind"],
+            request["hash"],
+            request.get("max_distance", DEFAULT_MAX_DISTANCE),
+        )
+        return dict(success=True, matches=matches)
+    raise ValueError(f"unknown operation: {op}")
+
+
+@click.group()
+@click.option("--index", "index_path", type=click.Path(), required=True)
+@click.pass_context
+def cli(ctx, index_path):
+    """Maintain and query an index of perceptual hashes."""
+    ctx.obj = PerceptualHashIndex(index_path)
+    ctx.call_on_close(ctx.obj.close)
+
+
+@cli.command()
+@click.option("--key", type=str, required=True)
+@click.option("--kind", type=str, required=True)
+@click.option("--hash", "perceptual_hash", type=str, required=True)
+@click.pass_obj
+def add(index, key, kind, perceptual_hash):
+    """Add a perceptual hash to the index."""
+    index.add(key, kind, perceptual_hash)
+
+
+@cli.command()
+@click.option("--kind", type=str, required=True)
+@click.option("--hash", "perceptual_hash", type=str, required=True)
+@click.option("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE)
+@click.pass_obj
+def query(index, kind, perceptual_hash, max_distance):
+    """Print every indexed hash within the given distance of a perceptual hash."""
+    print(json.dumps(index.query(kind, perceptual_hash, max_distance)))
+
+
+@cli.command()
+@click.pass_obj
+def serve(index):
+    """Serve requests as JSON lines over stdin/stdout.
+
+    Requests look like `{"op": "add", "key": ..., "kind": ..., "hash": ...}`,
+    `{"op": "add_metadata", "key": ..., "metadata": {...}}`, or
+    `{"op": "query", "kind": ..., "hash": ..., "max_distance": 15}`. Each gets one
+    response line with `success` set, plus `matches` for queries or `error` on failure.
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        try:
+            response = handle(index, json.loads(line))
+        except Exception as e:
+            logger.warning(f"Failed to handle request: {e}")
+            response = dict(success=False, error=str(e))
+
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,84 @@
+# Writes PNGs a band of rows at a time, so that very tall images (like full-page
+# screenshots stitched together from many tiles) never have to be held in memory, or
+# encoded, all at once.
+
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# The "up" filter stores each row as its difference from the row above, which compresses
+# screenshots (mostly flat colors and repeated rows) far better than storing rows as
+# they are
+FILTER_UP = 2
+
+
+class StreamingPngWriter:
+    """Writes an 8-bit RGB PNG to the given path, in bands of rows added with
+    `write_rows`. The image's height doesn't have to be known up front; the header is
+    rewritten with the final height on `close`. Only the last row written is kept in
+    memory (to filter the next one against)."""
+
+    def __init__(self, path: str, width: int, compression_level: int = 6):
+        self.width = width
+        self.height = 0
+        self._file = open(path, "wb")
+        self._compressor = zlib.compressobj(compression_level)
+        self._previous_row = np.zeros((1, width, 3), dtype=np.uint8)
+
+        self._file.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", self._header())
+
+    def _header(self) -> bytes:
+        # Width, height, bit depth, color type (RGB), and the compression, filter, and
+        # interlace methods
+        return struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+
+    def _write_chunk(self, kind: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, rows: np.ndarray):
+        """Appends the given rows, as a `(height, width, 3)` array of 8-bit RGB."""
+        if rows.ndim != 3 or rows.shape[1:] != (self.width, 3):
+            raise ValueError(
+                f"expected rows of shape (n, {self.width}, 3), got {rows.shape}"
+            )
+        if len(rows) == 0:
+            return
+
+        rows = rows.astype(np.uint8, copy=False)
+        above = np.concatenate([self._previous_row, rows[:-1]])
+
+        # Each row is prefixed with the filter it uses; uint8 arithmetic wraps, as the
+        # filter expects
+        scanlines = np.empty((len(rows), self.width * 3 + 1), dtype=np.uint8)
+        scanlines[:, 0] = FILTER_UP
+        scanlines[:, 1:] = (rows - above).reshape(len(rows), -1)
+
+        compressed = self._compressor.compress(scanlines.tobytes())
+        if compressed:
+            self._write_chunk(b"IDAT", compressed)
+
+        self._previous_row = rows[-1:].copy()
+        self.height += len(rows)
+
+    def close(self):
+        """Finishes the image. At least one row must have been written."""
+        if self.height == 0:
+            raise ValueError("a PNG must have at least one row")
+
+        self._write_chunk(b"IDAT", self._compressor.flush())
+        self._write_chunk(b"IEND", b"")
+
+        self._file.seek(len(PNG_SIGNATURE))
+        self._write_chunk(b"IHDR", self._header())
+        self._file.close()
+
+    def abort(self):
+        """Closes the file without finishing the image."""
+        self._file.close()
@@ -0,0 +1,145 @@
+import csv
+import os
+import random
+import sys
+
+import pytest
+
+# The utilities are scripts rather than a package, and import one another by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+CIVHARM_COLUMNS = [
+    "Incident no. ",
+    "Narrative",
+    "Comments",
+    "Location",
+    "Private Information Visible",
+    "Graphic",
+    "Type of area affected",
+    "Weapon System",
+    "Reported Date",
+    "BCAT\n (geolocated)",
+    "Lat",
+    "Lon",
+] + [f"Source {i}" for i in range(1, 6)]
+
+# Day-first, month-first, impossible, ISO, free-form, empty and unparseable dates
+CIVHARM_DATES = [
+    "13/02/2024",
+    "1/2/2023",
+    "02/13/2024",
+    "31/02/2024",
+    "2022-04-01",
+    "March 3 2022",
+    "",
+    "garbage",
+    "5/6/2021 ",
+]
+
+
+@pytest.fixture
+def civharm_csv(tmp_path):
+    """A CSV export of a (made up) CIVHARM spreadsheet, with rows covering the
+    converter's edge cases."""
+    rng = random.Random(0)
+    path = tmp_path / "civharm.csv"
+    with open(path, "w", newline="", encoding="utf-8") as outfile:
+        writer = csv.DictWriter(outfile, CIVHARM_COLUMNS)
+        writer.writeheader()
+        for i in range(300):
+            writer.writerow(
+                {
+                    "Incident no. ": rng.choice([f"CIV{i:04d}", f"X{i}"]),
+                    "Narrative": rng.choice(
+                        ["short", "A long graphic narrative " * rng.randint(1, 20)]
+                    ),
+                    "Comments": rng.choice(["", "c"]),
+                    "Location": rng.choice(["", " Kyiv "]),
+                    "Private Information Visible": rng.choice(["Yes", "No"]),
+                    "Graphic": rng.choice(["TRUE", "FALSE"]),
+                    "Type of area affected": rng.choice(
+                        ["Roads/Highways", "Undefined", "", "Residential"]
+                    ),
+                    "Weapon System": rng.choice(["Undefined", "", "Missile"]),
+                    "Reported Date": rng.choice(CIVHARM_DATES),
+                    "BCAT\n (geolocated)": rng.choice(["TRUE", "FALSE"]),
+                    "Lat": rng.choice(["50.1N", "", "x49.5"]),
+                    "Lon": rng.choice(["30.2E", ""]),
+                    **{
+                        f"Source {j}": rng.choice(["", f"https://example.com/{i}/{j}"])
+                        for j in range(1, 6)
+                    },
+                }
+            )
+    return path
+
+
+FAKE_AUTO_ARCHIVER = """
+import datetime
+import os
+import time
+
+
+class Config:
+    def parse(self, use_cli, yaml_config_filename, overwrite_configs):
+        with open(yaml_config_filename) as infile:
+            if "invalid" in infile.read():
+                raise ValueError("invalid config")
+
+
+class LocalStorage:
+    save_to = "./auto_archiver"
+
+
+class ArchivingOrchestrator:
+    def __init__(self, config):
+        self.storages = [LocalStorage()]
+
+    def feed_item(self, item):
+        url = item.metadata["url"]
+        if url.endswith("/crash"):
+            os._exit(1)
+        if url.endswith("/hang"):
+            time.sleep(60)
+        if url.endswith("/fail"):
+            return None
+        with open(os.path.join(self.storages[0].save_to, "page.html"), "w") as outfile:
+            outfile.write(url)
+        # Like the real auto-archiver, which writes its database to the working
+        # directory
+        with open("db.csv", "w") as outfile:
+            outfile.write("status,metadata\\n")
+        item.metadata.update(pid=os.getpid(), cwd=os.getcwd())
+        return item
+"""
+
+FAKE_AUTO_ARCHIVER_CORE = """
+import datetime
+
+
+class Metadata:
+    def __init__(self):
+        self.metadata = {"_processed_at": datetime.datetime(2024, 1, 2, 3, 4, 5)}
+
+    def set_url(self, url):
+        self.metadata["url"] = url
+        return self
+"""
+
+
+@pytest.fixture
+def auto_archiver_config(tmp_path, monkeypatch):
+    """An auto-archiver config for a fake `auto_archiver` package, which archives URLs
+    by writing them to `page.html`, and fails, hangs or crashes for URLs ending in
+    `/fail`, `/hang` or `/crash`."""
+    package = tmp_path / "packages" / "auto_archiver"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text(FAKE_AUTO_ARCHIVER)
+    (package / "core.py").write_text(FAKE_AUTO_ARCHIVER_CORE)
+    # Child processes are started with the same path
+    monkeypatch.syspath_prepend(str(package.parent))
+
+    config = tmp_path / "auto_archiver_config.yaml"
+    config.write_text("steps: {}\n")
+    return str(config)
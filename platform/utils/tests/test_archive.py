@@ -0,0 +1,572 @@
+import hashlib
+import json
+import os
+import threading
+from time import monotonic
+
+import cv2
+import numpy as np
+import pytest
+
+# The archiver needs the perceptual hashing and browser automation libraries
+pytest.importorskip("perception")
+pytest.importorskip("selenium")
+
+import archive
+from archive import (
+    Workspace,
+    capture_tiled_screenshot,
+    find_json_objects,
+    iter_json_objects,
+)
+
+
+def test_workspace_paths_are_absolute_and_cleaned_up():
+    with Workspace() as workspace:
+        assert os.path.isabs(workspace.root)
+        assert os.path.isdir(workspace.root)
+        assert workspace.path("auto_archiver", "db.csv") == os.path.join(
+            workspace.root, "auto_archiver", "db.csv"
+        )
+
+        os.makedirs(workspace.path("selenium"))
+        with open(workspace.path("selenium", "page.html"), "w") as outfile:
+            outfile.write("<html></html>")
+
+    assert not os.path.exists(workspace.root)
+
+
+def test_workspaces_are_independent():
+    workspaces = []
+
+    def create():
+        workspace = Workspace()
+        with open(workspace.path("db.csv"), "w") as outfile:
+            outfile.write(workspace.root)
+        workspaces.append(workspace)
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({workspace.root for workspace in workspaces}) == 8
+    for workspace in workspaces:
+        with open(workspace.path("db.csv")) as infile:
+            assert infile.read() == workspace.root
+        workspace.close()
+
+
+def test_workspace_close_ignores_missing_files():
+    workspace = Workspace()
+    os.rmdir(workspace.root)
+    workspace.close()
+
+
+class FakeDriver:
+    """Just enough of a Chrome driver to scroll through, and take screenshots of, a page
+    that is given as an image (in device pixels)."""
+
+    def __init__(
+        self, page: np.ndarray, viewport_height: int, device_pixel_ratio: float
+    ):
+        self.page = page
+        self.viewport_height = viewport_height
+        self.ratio = device_pixel_ratio
+        self.page_height = round(len(page) / device_pixel_ratio)
+        self.scroll_y = 0
+        self.screenshots = 0
+
+    def execute_script(self, script: str, *args):
+        if script == archive.PAGE_ACTIVITY_SCRIPT:
+            return dict(readyState="complete", lastMutation=0, lastResponse=0, now=1e9)
+        if script == "return window.innerHeight":
+            return self.viewport_height
+        if script == "return window.scrollY":
+            return self.scroll_y
+        if script.startswith("window.scrollTo"):
+            target = args[0] if args else 0
+            # Browsers can't scroll past the end of the page
+            self.scroll_y = int(
+                max(0, min(target, self.page_height - self.viewport_height))
+            )
+            return None
+        raise AssertionError(f"unexpected script: {script}")
+
+    def get_screenshot_as_png(self) -> bytes:
+        self.screenshots += 1
+        top = round(self.scroll_y * self.ratio)
+        tile = self.page[top : top + round(self.viewport_height * self.ratio)]
+        # OpenCV encodes BGR
+        return cv2.imencode(".png", tile[:, :, ::-1])[1].tobytes()
+
+
+@pytest.mark.parametrize("device_pixel_ratio", [1, 1.5, 2])
+@pytest.mark.parametrize("height", [250, 1000, 5000])
+def test_tiled_screenshot_matches_the_page(tmp_path, device_pixel_ratio, height):
+    rng = np.random.default_rng(0)
+    page_height, width, viewport_height = 1000, 120, 300
+    page = rng.integers(
+        0,
+        256,
+        size=(
+            round(page_height * device_pixel_ratio),
+            round(width * device_pixel_ratio),
+            3,
+        ),
+        dtype=np.uint8,
+    )
+
+    driver = FakeDriver(page, viewport_height, device_pixel_ratio)
+    path = tmp_path / "screenshot.png"
+    result = capture_tiled_screenshot(driver, str(path), height)
+
+    expected = page[: round(min(height, page_height) * device_pixel_ratio)]
+    screenshot = cv2.imread(str(path), cv2.IMREAD_COLOR)[:, :, ::-1]
+    assert screenshot.shape == expected.shape
+    assert np.array_equal(screenshot, expected)
+
+    assert result["mode"] == "tiled"
+    assert result["tiles"] == driver.screenshots
+    assert driver.screenshots <= -(-min(height, page_height) // viewport_height) + 1
+    # It scrolls back to the top when it's done
+    assert driver.scroll_y == 0
+
+
+def test_worker_answers_invalid_jobs_and_keeps_going(tmp_path, monkeypatch):
+    def fake_archive(url, file, out, *args, **kwargs):
+        return dict(url=url)
+
+    monkeypatch.setattr(archive, "archive", fake_archive)
+    lines = [
+        "[1]",
+        "not json",
+        '"a string"',
+        "",
+        '{"id": "1", "url": "https://atlos.org"}',
+    ]
+    monkeypatch.setattr(archive.sys, "stdin", iter(line + "\n" for line in lines))
+
+    # The worker moves stdout aside for its responses, so it needs real files
+    with (
+        open(tmp_path / "stdout", "w") as stdout,
+        open(tmp_path / "stderr", "w") as stderr,
+    ):
+        monkeypatch.setattr(archive.sys, "stdout", stdout)
+        monkeypatch.setattr(archive.sys, "stderr", stderr)
+        archive.serve(None, pool=None, hash_pool=None, phash_cache=None)
+
+    with open(tmp_path / "stdout") as infile:
+        responses = [json.loads(line) for line in infile]
+    assert responses[0] == dict(ready=True)
+    assert [response["success"] for response in responses[1:4]] == [False] * 3
+    assert all(response["id"] is None for response in responses[1:4])
+    assert responses[4] == dict(
+        id="1", success=True, metadata=dict(url="https://atlos.org")
+    )
+
+
+@pytest.mark.parametrize("mode", ["persistent", "in_process"])
+def test_auto_archiver_metadata_is_handed_back(auto_archiver_config, mode):
+    try:
+        with Workspace() as workspace:
+            result = archive.archive_using_auto_archiver(
+                "https://atlos.org/a", workspace, config=auto_archiver_config, mode=mode
+            )
+            assert result["success"]
+            assert result["metadata"]["url"] == "https://atlos.org/a"
+            assert result["files"] == [workspace.path("auto_archiver", "page.html")]
+
+        with Workspace() as workspace:
+            result = archive.archive_using_auto_archiver(
+                "https://atlos.org/fail",
+                workspace,
+                config=auto_archiver_config,
+                mode=mode,
+            )
+            assert result == dict(success=False)
+    finally:
+        archive.PersistentAutoArchiver.close_all()
+
+
+def test_only_top_level_json_objects_are_found():
+    assert find_json_objects('x {"a": {"b": 1}} y {"c": [1, {"d": 2}]}') == [
+        {"a": {"b": 1}},
+        {"c": [1, {"d": 2}]},
+    ]
+    assert find_json_objects('{"a": 1}{"b": 2}\n{"c": 3}') == [
+        {"a": 1},
+        {"b": 2},
+        {"c": 3},
+    ]
+    assert find_json_objects("no objects [1, 2]") == []
+    assert find_json_objects("") == []
+
+
+def test_braces_in_json_strings_are_not_objects():
+    assert find_json_objects('{"a": "}{\\"}"} {"b": "{\\"c\\": 1}"}') == [
+        {"a": '}{"}'},
+        {"b": '{"c": 1}'},
+    ]
+
+
+def test_malformed_and_truncated_json_is_skipped():
+    assert find_json_objects('{bad} {"a": 1} {"b": } {"c": {"d": 2}} {"e": [1') == [
+        {"a": 1},
+        {"c": {"d": 2}},
+    ]
+    assert find_json_objects('{"truncated": {"a": 1}') == [{"a": 1}]
+    assert find_json_objects("}}}{{{") == []
+
+
+def test_json_scan_resumes_after_each_object(monkeypatch):
+    starts = []
+
+    class CountingDecoder(json.JSONDecoder):
+        def raw_decode(self, s, idx=0):
+            starts.append(idx)
+            return super().raw_decode(s, idx)
+
+    monkeypatch.setattr(archive.json, "JSONDecoder", CountingDecoder)
+    s = '{"a": {"b": {"c": {}}}} {"d": {"e": {}}}'
+    objects = iter_json_objects(s)
+
+    assert next(objects) == {"a": {"b": {"c": {}}}}
+    # Nothing has been scanned past the first object yet
+    assert starts == [0]
+    assert list(objects) == [{"d": {"e": {}}}]
+    # The nested objects were never decoded on their own
+    assert starts == [0, s.index('{"d"')]
+
+
+def test_perceptual_hash_cache_hits_and_misses(tmp_path, monkeypatch):
+    hashed = []
+
+    def fake_hash(paths, pool=None):
+        hashed.extend(paths)
+        # Hashing the empty file "fails"
+        return [[] if "empty" in path else [dict(hash=path)] for path in paths]
+
+    monkeypatch.setattr(archive, "generate_all_perceptual_hashes", fake_hash)
+    cache = archive.PerceptualHashCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+    out = str(tmp_path)
+
+    def artifacts():
+        return [
+            dict(file="a.png", sha256="a" * 64),
+            dict(file="copy-of-a.png", sha256="a" * 64),
+            dict(file="b.png", sha256="b" * 64),
+            dict(file="empty.png", sha256="e" * 64),
+        ]
+
+    first = artifacts()
+    assert archive.perceptually_hash_artifacts(first, out, cache=cache) == dict(
+        hits=0, misses=4
+    )
+    # Files with the same contents are only hashed once
+    assert hashed == [
+        os.path.join(out, name) for name in ["a.png", "b.png", "empty.png"]
+    ]
+    assert first[1]["perceptual_hashes"] == first[0]["perceptual_hashes"]
+
+    hashed.clear()
+    second = artifacts()
+    assert archive.perceptually_hash_artifacts(second, out, cache=cache) == dict(
+        hits=3, misses=1
+    )
+    # Empty results aren't cached, since they may have been failures
+    assert hashed == [os.path.join(out, "empty.png")]
+    assert [artifact["perceptual_hashes"] for artifact in second] == [
+        artifact["perceptual_hashes"] for artifact in first
+    ]
+
+
+def test_copies_are_checksummed(tmp_path, monkeypatch):
+    # Several chunks, the last of them partial
+    monkeypatch.setattr(archive, "CHUNK_SIZE", 1000)
+    contents = os.urandom(2500)
+    source, destination = tmp_path / "source.bin", tmp_path / "destination.bin"
+    source.write_bytes(contents)
+
+    checksum = archive.copy_with_checksum(str(source), str(destination))
+    assert checksum == hashlib.sha256(contents).hexdigest()
+    assert checksum == archive.compute_checksum(str(source))
+    assert destination.read_bytes() == contents == source.read_bytes()
+
+    (tmp_path / "empty.bin").write_bytes(b"")
+    assert (
+        archive.copy_with_checksum(
+            str(tmp_path / "empty.bin"), str(tmp_path / "empty-copy.bin")
+        )
+        == hashlib.sha256(b"").hexdigest()
+    )
+
+
+def test_failed_copies_leave_nothing_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "CHUNK_SIZE", 1000)
+    source, destination = tmp_path / "source.bin", tmp_path / "destination.bin"
+    source.write_bytes(os.urandom(2500))
+
+    real_open = open
+
+    class FailingFile:
+        """Writes the first chunk, then runs out of space"""
+
+        def __init__(self, path, mode):
+            self.file = real_open(path, mode)
+            self.writes = 0
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.file.close()
+
+        def write(self, data):
+            self.writes += 1
+            if self.writes > 1:
+                raise OSError(28, "No space left on device")
+            return self.file.write(data)
+
+    def fake_open(path, mode="r", *args, **kwargs):
+        if "w" in mode:
+            return FailingFile(path, mode)
+        return real_open(path, mode, *args, **kwargs)
+
+    (tmp_path / "out").mkdir()
+    monkeypatch.setattr("builtins.open", fake_open)
+    with pytest.raises(OSError, match="No space"):
+        archive.copy_with_checksum(str(source), str(destination))
+    with pytest.raises(OSError, match="No space"):
+        archive.finalize_artifact(str(source), str(tmp_path / "out"))
+    monkeypatch.undo()
+
+    assert not destination.exists()
+    assert os.listdir(tmp_path / "out") == []
+    assert source.exists()
+
+
+def test_finalized_artifacts_are_copied_or_moved_into_the_output(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    contents = b"artifact" * 1000
+    sha256 = hashlib.sha256(contents).hexdigest()
+
+    # Copied, and checksummed along the way
+    (tmp_path / "copied.png").write_bytes(contents)
+    assert archive.finalize_artifact(str(tmp_path / "copied.png"), str(out)) == dict(
+        kind="file", file="copied.png", sha256=sha256, perceptual_hashes=[]
+    )
+    assert (out / "copied.png").read_bytes() == contents
+    assert (tmp_path / "copied.png").exists()
+
+    # Moved, if the checksum is already known (e.g., from downloading it)
+    (tmp_path / "moved.png").write_bytes(contents)
+    assert archive.finalize_artifact(
+        str(tmp_path / "moved.png"), str(out), kind="direct_file", sha256=sha256
+    ) == dict(kind="direct_file", file="moved.png", sha256=sha256, perceptual_hashes=[])
+    assert (out / "moved.png").read_bytes() == contents
+    assert not (tmp_path / "moved.png").exists()
+
+    # Already in the output directory
+    assert (
+        archive.finalize_artifact(str(out / "copied.png"), str(out))["sha256"] == sha256
+    )
+    assert sorted(os.listdir(out)) == ["copied.png", "moved.png"]
+
+
+class FakeStreamingResponse:
+    """Just enough of a streamed `requests` response for `maybe_download_file`."""
+
+    def __init__(self, chunks, headers, status_code=200, error=None):
+        self.chunks = chunks
+        self.headers = headers
+        self.status_code = status_code
+        self.error = error
+        self.read = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def serve_download(monkeypatch):
+    def serve(*args, **kwargs):
+        response = FakeStreamingResponse(*args, **kwargs)
+        monkeypatch.setattr(archive.requests, "get", lambda *a, **kw: response)
+        return response
+
+    return serve
+
+
+def test_direct_downloads_are_kept(serve_download):
+    chunks = [b"\x89PNG\r\n", b"a" * 100, b"b" * 100]
+    serve_download(chunks, {"content-type": "image/png", "content-length": "206"})
+
+    with Workspace() as workspace:
+        result = archive.maybe_download_file("https://atlos.org/a.png", workspace)
+        assert result["file"] == workspace.path("file.png")
+        with open(result["file"], "rb") as infile:
+            assert infile.read() == b"".join(chunks)
+        assert result["sha256"] == hashlib.sha256(b"".join(chunks)).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "headers,status_code",
+    [
+        ({"content-type": "image/png"}, 404),
+        ({}, 200),
+        ({"content-type": "text/html; charset=utf-8"}, 200),
+        # Too large, by its own account; we don't read any of it
+        ({"content-type": "video/mp4", "content-length": "1001"}, 200),
+    ],
+)
+def test_direct_downloads_are_skipped_by_their_headers(
+    serve_download, headers, status_code
+):
+    response = serve_download([b"data"], headers, status_code=status_code)
+    with Workspace() as workspace:
+        assert (
+            archive.maybe_download_file("https://atlos.org", workspace, max_size=1000)
+            is None
+        )
+        assert os.listdir(workspace.root) == []
+    assert response.read == 0
+
+
+def test_html_is_sniffed_whatever_its_content_type(serve_download):
+    response = serve_download(
+        [b"\xef\xbb\xbf\n  <!DOCTYPE html><html>", b"<body>" * 1000],
+        {"content-type": "application/octet-stream"},
+    )
+    with Workspace() as workspace:
+        assert archive.maybe_download_file("https://atlos.org", workspace) is None
+        assert os.listdir(workspace.root) == []
+    # Only the first chunk was read
+    assert response.read == 1
+
+
+@pytest.mark.parametrize("timeout", [60, -1])
+def test_direct_downloads_that_are_too_large_or_slow_are_removed(
+    serve_download, timeout
+):
+    # No content length, so we only find out it's too large (or slow) as it downloads
+    response = serve_download([b"a" * 600] * 10, {"content-type": "video/mp4"})
+    with Workspace() as workspace:
+        assert (
+            archive.maybe_download_file(
+                "https://atlos.org", workspace, max_size=1000, timeout=timeout
+            )
+            is None
+        )
+        assert os.listdir(workspace.root) == []
+    # We stopped as soon as we knew
+    assert response.read == (2 if timeout > 0 else 1)
+    assert response.closed
+
+
+def test_interrupted_direct_downloads_are_removed(serve_download):
+    serve_download(
+        [b"a" * 600],
+        {"content-type": "video/mp4"},
+        error=archive.requests.ConnectionError("connection reset"),
+    )
+    with Workspace() as workspace:
+        with pytest.raises(archive.requests.ConnectionError):
+            archive.maybe_download_file("https://atlos.org", workspace)
+        assert os.listdir(workspace.root) == []
+
+
+def test_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def stage(value):
+        def run(cancellation):
+            # Both stages have to be running at once to get past this
+            barrier.wait()
+            return value
+
+        return run
+
+    results, outcomes = archive.run_stages(
+        dict(first=stage(1), second=stage(2)), dict(first=10, second=10)
+    )
+    assert results == dict(first=1, second=2)
+    for outcome in outcomes.values():
+        assert outcome["completed"] and not outcome["timed_out"]
+        assert outcome["duration"] < 5
+
+
+def test_failed_stages_dont_affect_others():
+    def fail(cancellation):
+        raise RuntimeError("stage failed")
+
+    results, outcomes = archive.run_stages(
+        dict(failing=fail, working=lambda cancellation: "ok"),
+        dict(failing=10, working=10),
+    )
+    assert results == dict(failing=None, working="ok")
+    assert outcomes["failing"]["completed"] is False
+    assert outcomes["failing"]["timed_out"] is False
+    assert outcomes["working"]["completed"] is True
+
+
+def test_stages_that_time_out_are_cancelled():
+    stopped = threading.Event()
+
+    def hang(cancellation):
+        with cancellation.on_cancel(stopped.set):
+            stopped.wait(30)
+        return "too late"
+
+    started = monotonic()
+    results, outcomes = archive.run_stages(
+        dict(hanging=hang, quick=lambda cancellation: "ok"),
+        dict(hanging=0.2, quick=10),
+    )
+    assert monotonic() - started < 5
+    assert stopped.is_set()
+    assert results == dict(hanging=None, quick="ok")
+    assert outcomes["hanging"]["timed_out"] is True
+    assert outcomes["hanging"]["completed"] is False
+    assert outcomes["quick"]["timed_out"] is False
+
+
+def test_cancellation_callbacks():
+    cancellation = archive.StageCancellation()
+    called = []
+
+    # Callbacks only apply while their context is open
+    with cancellation.on_cancel(lambda: called.append("finished")):
+        pass
+
+    def fail():
+        raise RuntimeError("can't cancel")
+
+    with (
+        cancellation.on_cancel(fail),
+        cancellation.on_cancel(lambda: called.append("running")),
+    ):
+        # A callback that fails doesn't stop the others
+        cancellation.cancel()
+        assert cancellation.cancelled
+        assert called == ["running"]
+
+    # Once cancelled, anything the stage goes on to do is cancelled straight away
+    with cancellation.on_cancel(lambda: called.append("late")):
+        assert called == ["running", "late"]
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from auto_archiver_process import PersistentAutoArchiver, archive_in_process
+
+
+@pytest.fixture
+def auto_archiver(auto_archiver_config):
+    auto_archiver = PersistentAutoArchiver(auto_archiver_config)
+    yield auto_archiver
+    if auto_archiver._process is not None:
+        auto_archiver._stop()
+
+
+def archive(auto_archiver, directory, url, timeout=30):
+    save_to = os.path.join(directory, "auto_archiver")
+    os.makedirs(save_to, exist_ok=True)
+    with auto_archiver.lock:
+        return auto_archiver.archive(url, str(directory), save_to, timeout=timeout)
+
+
+def test_metadata_comes_back_as_json(auto_archiver, tmp_path):
+    result = archive(auto_archiver, tmp_path, "https://atlos.org/a")
+
+    assert result["success"]
+    metadata = result["metadata"]
+    assert metadata["url"] == "https://atlos.org/a"
+    assert metadata["_processed_at"] == "2024-01-02 03:04:05"
+    # It ran in the workspace, saving to the given directory
+    assert metadata["cwd"] == str(tmp_path)
+    assert (
+        tmp_path / "auto_archiver" / "page.html"
+    ).read_text() == "https://atlos.org/a"
+    assert (tmp_path / "db.csv").exists()
+    assert metadata["pid"] != os.getpid()
+
+
+def test_child_is_reused(auto_archiver, tmp_path):
+    first = archive(auto_archiver, tmp_path / "1", "https://atlos.org/a")
+    second = archive(auto_archiver, tmp_path / "2", "https://atlos.org/b")
+    assert first["metadata"]["pid"] == second["metadata"]["pid"]
+    assert second["metadata"]["cwd"] == str(tmp_path / "2")
+
+    # A failed archive doesn't need a new child either
+    assert archive(auto_archiver, tmp_path / "3", "https://atlos.org/fail") == dict(
+        success=False
+    )
+    third = archive(auto_archiver, tmp_path / "4", "https://atlos.org/c")
+    assert third["metadata"]["pid"] == first["metadata"]["pid"]
+
+
+@pytest.mark.parametrize(
+    "url,timeout", [("https://atlos.org/crash", 30), ("https://atlos.org/hang", 2)]
+)
+def test_child_is_restarted_after_crashing_or_hanging(
+    auto_archiver, tmp_path, url, timeout
+):
+    first = archive(auto_archiver, tmp_path / "1", "https://atlos.org/a")
+    assert archive(auto_archiver, tmp_path / "2", url, timeout=timeout) == dict(
+        success=False
+    )
+
+    second = archive(auto_archiver, tmp_path / "3", "https://atlos.org/b")
+    assert second["success"]
+    assert second["metadata"]["pid"] != first["metadata"]["pid"]
+
+
+def test_unloadable_config_falls_back(tmp_path, auto_archiver_config):
+    with open(auto_archiver_config, "w") as outfile:
+        outfile.write("invalid\n")
+
+    auto_archiver = PersistentAutoArchiver(auto_archiver_config)
+    assert archive(auto_archiver, tmp_path, "https://atlos.org/a") is None
+    assert not auto_archiver.available
+    assert (
+        archive_in_process(
+            auto_archiver_config, "https://atlos.org/a", str(tmp_path), str(tmp_path)
+        )
+        is None
+    )
+
+
+def test_for_config_shares_instances(auto_archiver_config):
+    try:
+        auto_archiver = PersistentAutoArchiver.for_config(auto_archiver_config)
+        assert PersistentAutoArchiver.for_config(auto_archiver_config) is auto_archiver
+    finally:
+        PersistentAutoArchiver.close_all()
+    assert PersistentAutoArchiver.for_config(auto_archiver_config) is not auto_archiver
+    PersistentAutoArchiver.close_all()
+
+
+def test_archive_in_process(auto_archiver_config, tmp_path):
+    save_to = tmp_path / "auto_archiver"
+    save_to.mkdir()
+    cwd = os.getcwd()
+
+    result = archive_in_process(
+        auto_archiver_config, "https://atlos.org/a", str(tmp_path), str(save_to)
+    )
+    assert result["success"]
+    assert result["metadata"]["pid"] == os.getpid()
+    assert result["metadata"]["cwd"] == str(tmp_path)
+    assert (save_to / "page.html").exists()
+    assert os.getcwd() == cwd
+
+    assert archive_in_process(
+        auto_archiver_config, "https://atlos.org/fail", str(tmp_path), str(save_to)
+    ) == dict(success=False)
+    assert os.getcwd() == cwd
@@ -0,0 +1,249 @@
+import json
+import os
+import pickle
+
+import pytest
+from click.testing import CliRunner
+
+import bulk_converter
+import civharm_converter
+from bulk_converter import MappingError, RowTransformer, as_text
+
+CIVHARM_MAPPING = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "mappings",
+    "civharm.yaml",
+)
+
+
+def convert(runner: CliRunner, command, args: list) -> str:
+    result = runner.invoke(command, args)
+    assert result.exit_code == 0, result.output
+    return result.stdout
+
+
+def test_civharm_mapping_matches_civharm_converter(civharm_csv, tmp_path):
+    runner = CliRunner()
+    expected_messages = convert(
+        runner,
+        civharm_converter.run,
+        ["--civharm", str(civharm_csv), "--outfile", str(tmp_path / "expected.csv")],
+    )
+    messages = convert(
+        runner,
+        bulk_converter.run,
+        [
+            "--mapping",
+            CIVHARM_MAPPING,
+            "--input",
+            str(civharm_csv),
+            "--outfile",
+            str(tmp_path / "converted.csv"),
+        ],
+    )
+
+    assert (tmp_path / "converted.csv").read_bytes() == (
+        tmp_path / "expected.csv"
+    ).read_bytes()
+    assert messages == expected_messages
+    assert messages.count("Skipping") > 0
+
+
+def test_civharm_mapping_from_ndjson_and_xlsx(civharm_csv, tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+
+    rows = list(bulk_converter.iter_csv(str(civharm_csv), "utf-8"))
+    with open(tmp_path / "civharm.ndjson", "w") as outfile:
+        for row in rows:
+            outfile.write(json.dumps(row) + "\n")
+
+    # Only text cells, so that the XLSX reads back exactly like the CSV (date cells are
+    # read as the dates they are, unlike the CSV's text)
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.append(list(rows[0]))
+    for row in rows:
+        worksheet.append(list(row.values()))
+    workbook.save(tmp_path / "civharm.xlsx")
+
+    runner = CliRunner()
+    outputs = []
+    for name in ("civharm.csv", "civharm.ndjson", "civharm.xlsx"):
+        source = civharm_csv if name == "civharm.csv" else tmp_path / name
+        convert(
+            runner,
+            bulk_converter.run,
+            [
+                "--mapping",
+                CIVHARM_MAPPING,
+                "--input",
+                str(source),
+                "--outfile",
+                str(tmp_path / "out.csv"),
+            ],
+        )
+        outputs.append((tmp_path / "out.csv").read_bytes())
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_xlsx_date_cells_are_read_as_dates(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    from datetime import date, datetime
+
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.append(["Reported Date"])
+    worksheet.append([datetime(2022, 4, 1)])
+    worksheet.append([date(2022, 12, 5)])
+    worksheet.append([datetime(2022, 4, 1, 10, 30)])
+    # Text cells are still read the way the mapping says
+    worksheet.append(["2022-04-01"])
+    worksheet.append(["01/04/2022"])
+    workbook.save(tmp_path / "dates.xlsx")
+
+    # Day first, and not ISO 8601, like the CIVHARM mapping
+    transformer = RowTransformer(
+        dict(
+            fields=dict(
+                date=dict(
+                    column="Reported Date",
+                    date=dict(formats=["%d/%m/%Y"], dayfirst=True, iso=False),
+                )
+            )
+        )
+    )
+    rows = list(bulk_converter.iter_xlsx(str(tmp_path / "dates.xlsx")))
+    assert [row["Reported Date"] for row in rows[:3]] == [
+        "2022-04-01",
+        "2022-12-05",
+        "2022-04-01 10:30:00",
+    ]
+    assert [transformer(row)[0] for row in rows] == [
+        ["2022-04-01"],
+        ["2022-12-05"],
+        ["2022-04-01"],
+        ["2022-01-04"],
+        ["2022-04-01"],
+    ]
+    # The cache of parsed text doesn't mix up date cells and text that looks the same
+    assert [transformer(row)[0] for row in reversed(rows)] == [
+        ["2022-04-01"],
+        ["2022-01-04"],
+        ["2022-04-01"],
+        ["2022-12-05"],
+        ["2022-04-01"],
+    ]
+
+
+def test_fields_and_conditions():
+    transformer = RowTransformer(
+        dict(
+            include=[dict(column="id", startswith="A")],
+            skip_message="Skipping {id}",
+            fields=dict(
+                _name=dict(column="name", strip=True),
+                title=dict(
+                    value="{id}: {_name}", truncate=dict(length=10, suffix="...")
+                ),
+                kind=dict(
+                    choose=[
+                        dict(
+                            when=dict(column="kind", **{"in": ["a", "b"]}),
+                            value="known",
+                        )
+                    ],
+                    **{"else": "other"},
+                ),
+                flags=dict(
+                    flags=[
+                        dict(when=dict(column="x", equals="1"), value="X"),
+                        dict(
+                            when=dict(
+                                any=[dict(column="y", lower=True, contains="yes")]
+                            ),
+                            value="Y",
+                        ),
+                    ],
+                    default="none",
+                ),
+                count=dict(column="count", remove="[^0-9]", map={"": "0"}),
+                note=dict(column="note", default="-"),
+            ),
+            sources=dict(prefix="Link", slots=2, name="url_{n}"),
+        )
+    )
+
+    assert transformer.columns == [
+        "title",
+        "kind",
+        "flags",
+        "count",
+        "note",
+        "url_1",
+        "url_2",
+    ]
+    assert transformer.required_columns == {"id", "name", "kind", "x", "y", "count"}
+
+    row = dict(
+        id="A1",
+        name="  A long name ",
+        kind="b",
+        x="1",
+        y="Oh YES",
+        count="n/a",
+        Link1="",
+        Link2="l",
+    )
+    assert transformer(row) == (
+        ["A1: A l...", "known", "X, Y", "0", "-", "l", ""],
+        None,
+    )
+    assert transformer(dict(row, id="B1")) == (None, "Skipping B1")
+
+
+@pytest.mark.parametrize(
+    "spec, value, expected",
+    [
+        (dict(formats=["%d/%m/%Y"]), "01/04/2022", "2022-04-01"),
+        (dict(dayfirst=True), "2022-04-01", "2022-04-01"),
+        (dict(dayfirst=True, iso=False), "2022-04-01", "2022-01-04"),
+        (dict(dayfirst=True), "1 April 2022", "2022-04-01"),
+        (dict(fallback=False), "1 April 2022", ""),
+        (dict(output="%d.%m.%Y"), "2022-04-01T10:00:00", "01.04.2022"),
+        (dict(), "garbage", ""),
+    ],
+)
+def test_dates(spec, value, expected):
+    transformer = RowTransformer(dict(fields=dict(date=dict(column="date", date=spec))))
+    assert transformer(dict(date=value)) == ([expected], None)
+
+
+@pytest.mark.parametrize(
+    "mapping",
+    [
+        dict(unknown=1),
+        dict(fields=dict(a=dict(colum="x"))),
+        dict(fields=dict(a=dict(column="x", map={"TRUE": True}))),
+        dict(fields=dict(a=dict(column="x", date=dict(format="%Y")))),
+    ],
+)
+def test_invalid_mappings(mapping):
+    with pytest.raises(MappingError):
+        RowTransformer(mapping)
+
+
+def test_as_text():
+    from datetime import date, datetime
+
+    assert as_text(None) == ""
+    assert as_text(True) == "TRUE"
+    assert as_text(3.0) == "3"
+    assert as_text(3.5) == "3.5"
+    assert as_text(datetime(2022, 4, 1)) == "2022-04-01"
+    assert as_text(datetime(2022, 4, 1, 10, 30)) == "2022-04-01 10:30:00"
+    assert as_text(date(2022, 4, 1)) == "2022-04-01"
+    assert as_text(date(2022, 4, 1)).date == date(2022, 4, 1)
+    assert pickle.loads(pickle.dumps(as_text(date(2022, 4, 1)))).date == date(
+        2022, 4, 1
+    )
+    assert as_text(["a"]) == '["a"]'
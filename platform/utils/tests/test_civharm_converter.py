@@ -0,0 +1,109 @@
+from click.testing import CliRunner
+from dateutil.parser import parse as date_parse
+
+import civharm_converter
+from civharm_converter import convert_row, parse_date
+
+from conftest import CIVHARM_DATES
+
+
+def row(**values) -> dict:
+    base = {
+        "Incident no. ": "CIV0001",
+        "Narrative": "Shelling of a residential area",
+        "Comments": "",
+        "Location": " Kyiv ",
+        "Private Information Visible": "No",
+        "Graphic": "FALSE",
+        "Type of area affected": "Roads/Highways",
+        "Weapon System": "Undefined",
+        "Reported Date": "13/02/2024",
+        "BCAT\n (geolocated)": "TRUE",
+        "Lat": "50.45N",
+        "Lon": "30.52E",
+        "Source 1": "https://example.com/1",
+        "Source 2": "",
+        "Source 3": "https://example.com/3",
+    }
+    base.update(values)
+    return base
+
+
+def test_parse_date_matches_dateutil():
+    for value in CIVHARM_DATES + ["1/1/2000", "29/02/2024", "29/02/2023"]:
+        try:
+            expected = date_parse(value, dayfirst=True).strftime("%Y-%m-%d")
+        except (ValueError, OverflowError):
+            expected = ""
+        assert parse_date(value) == expected, value
+
+
+def test_convert_row():
+    values, skipped = convert_row(row())
+    assert skipped is None
+    assert values == {
+        "more_info": "Corresponds to **CIV0001**. Reported near Kyiv.",
+        "sensitive": "Not Sensitive",
+        "description": "CIV0001: Shelling of a residential area",
+        "type": "Civilian Harm",
+        "equipment": "",
+        "impact": "Roads/Highways/Transport",
+        "date": "2024-02-13",
+        "status": "Completed",
+        "latitude": "50.45",
+        "longitude": "30.52",
+        "location": "50.45, 30.52",
+        "tags": "CIVHARM, Bulk Import",
+        "source_1": "https://example.com/1",
+        "source_2": "https://example.com/3",
+    }
+
+
+def test_convert_row_flags_and_truncation():
+    values, _ = convert_row(
+        row(
+            **{
+                "Narrative": "Graphic footage " * 30,
+                "Private Information Visible": "Yes",
+                "BCAT\n (geolocated)": "FALSE",
+                "Lon": "",
+            }
+        )
+    )
+    assert values["sensitive"] == "Personal Information Visible, Graphic Violence"
+    assert len(values["description"]) == 238 and values["description"].endswith("…")
+    assert values["status"] == "To Do"
+    assert values["location"] == ""
+
+
+def test_convert_row_skips():
+    assert convert_row(row(**{"Incident no. ": "X1"})) == (
+        None,
+        "Skipping X1: Shelling of a residential area...",
+    )
+    assert convert_row(row(Narrative="short"))[0] is None
+
+
+def test_workers_produce_the_same_output(civharm_csv, tmp_path, monkeypatch):
+    # Small chunks, so that rows are actually split across processes
+    monkeypatch.setattr(civharm_converter, "CHUNK_SIZE", 7)
+    runner = CliRunner()
+    outputs = []
+    for workers in (1, 3):
+        outfile = tmp_path / f"out-{workers}.csv"
+        result = runner.invoke(
+            civharm_converter.run,
+            [
+                "--civharm",
+                str(civharm_csv),
+                "--outfile",
+                str(outfile),
+                "--workers",
+                str(workers),
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        outputs.append((outfile.read_bytes(), result.output))
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0][0].count(b"\r\n") > 20
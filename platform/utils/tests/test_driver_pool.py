@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import driver_pool
+from driver_pool import DriverPool, visited_origins
+
+
+def request_entry(url: str) -> dict:
+    message = dict(
+        method="Network.requestWillBeSent", params=dict(request=dict(url=url))
+    )
+    return dict(message=json.dumps(dict(message=message)))
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.current_window = handle
+
+
+class FakeDriver:
+    """Just enough of a Chrome driver to be reset, recording the CDP commands sent."""
+
+    def __init__(self, fail_cdp: bool = False):
+        self.fail_cdp = fail_cdp
+        self.window_handles = ["main"]
+        self.switch_to = FakeSwitchTo(self)
+        self.log = []
+        self.commands = []
+        self.quit_called = False
+
+    def get(self, url):
+        self.url = url
+
+    def get_log(self, kind):
+        assert kind == "performance"
+        log, self.log = self.log, []
+        return log
+
+    def execute_cdp_cmd(self, command, params):
+        if self.fail_cdp:
+            raise RuntimeError(f"{command} isn't supported")
+        self.commands.append((command, params))
+
+    def set_window_size(self, width, height):
+        pass
+
+    def close(self):
+        self.window_handles.remove(self.current_window)
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    drivers = []
+
+    def create_driver(fail_cdp=False):
+        drivers.append(FakeDriver(fail_cdp))
+        return drivers[-1]
+
+    monkeypatch.setattr(driver_pool, "create_driver", create_driver)
+    return drivers
+
+
+def test_visited_origins():
+    driver = FakeDriver()
+    driver.log = [
+        request_entry("https://atlos.org/a?b=c"),
+        request_entry("https://atlos.org/d"),
+        request_entry("http://cdn.example.com:8080/script.js"),
+        request_entry("data:image/png;base64,AAAA"),
+        dict(message=json.dumps(dict(message=dict(method="Network.dataReceived")))),
+        dict(message="not json"),
+    ]
+    assert visited_origins(driver) == {
+        "https://atlos.org",
+        "http://cdn.example.com:8080",
+    }
+    # The log is consumed
+    assert visited_origins(driver) == set()
+
+
+def test_reset_drivers_are_reused(launched):
+    pool = DriverPool(size=1)
+    with pool.driver() as driver:
+        driver.window_handles.append("popup")
+        driver.log = [
+            request_entry("https://atlos.org/"),
+            request_entry("https://tracker.example.com/pixel"),
+        ]
+
+    assert driver.window_handles == ["main"]
+    assert driver.url == "about:blank"
+    assert [
+        params["origin"]
+        for command, params in driver.commands
+        if command == "Storage.clearDataForOrigin"
+    ] == [
+        "https://atlos.org",
+        "https://tracker.example.com",
+    ]
+    assert ("Network.clearBrowserCookies", {}) in driver.commands
+
+    with pool.driver() as second:
+        assert second is driver
+    assert len(launched) == 1
+    assert not driver.quit_called
+    pool.close()
+    assert driver.quit_called
+
+
+def test_drivers_that_fail_to_reset_are_discarded(launched, monkeypatch):
+    monkeypatch.setattr(
+        driver_pool,
+        "create_driver",
+        lambda: launched.append(FakeDriver(fail_cdp=True)) or launched[-1],
+    )
+    pool = DriverPool(size=1)
+    with pool.driver() as driver:
+        pass
+    assert driver.quit_called
+
+    with pool.driver() as second:
+        assert second is not driver
+    pool.close()
+
+
+def test_drivers_are_recycled_after_max_uses(launched):
+    pool = DriverPool(size=1, max_uses=2)
+    for _ in range(3):
+        with pool.driver():
+            pass
+    assert len(launched) == 2
+    assert launched[0].quit_called
+    pool.close()
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+import pytest
+
+from phash_cache import PerceptualHashCache
+
+
+def sha256(name: str) -> str:
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def hashes(name: str) -> list:
+    return [dict(kind="phash", hash=name * 4)]
+
+
+def size_on_disk(cache: PerceptualHashCache) -> int:
+    return sum(size for _, _, size in cache._entries())
+
+
+def test_hashes_are_cached_by_checksum(tmp_path):
+    cache = PerceptualHashCache(str(tmp_path), max_size=1024 * 1024)
+    assert cache.get(sha256("a")) is None
+
+    cache.put(sha256("a"), hashes("a"))
+    assert cache.get(sha256("a")) == hashes("a")
+    assert cache.get(sha256("b")) is None
+
+    # Entries are shared with other instances (e.g., other workers) in the same
+    # directory
+    assert PerceptualHashCache(str(tmp_path), max_size=1024 * 1024).get(
+        sha256("a")
+    ) == hashes("a")
+
+
+def test_invalid_checksums_are_rejected(tmp_path):
+    cache = PerceptualHashCache(str(tmp_path), max_size=1024)
+    for checksum in ["", "abc", sha256("a").upper(), "../" + sha256("a")[3:]]:
+        with pytest.raises(ValueError):
+            cache.get(checksum)
+        with pytest.raises(ValueError):
+            cache.put(checksum, hashes("a"))
+
+
+def test_replacing_an_entry_keeps_the_size_accurate(tmp_path):
+    cache = PerceptualHashCache(str(tmp_path), max_size=1024 * 1024)
+    cache.put(sha256("a"), hashes("a"))
+    cache.put(sha256("b"), hashes("b"))
+    cache.put(sha256("a"), hashes("a") * 3)
+    cache.put(sha256("a"), hashes("aa"))
+
+    assert cache.get(sha256("a")) == hashes("aa")
+    assert cache._size == size_on_disk(cache)
+    # The size is picked up again on startup
+    assert PerceptualHashCache(str(tmp_path), max_size=1024 * 1024)._size == cache._size
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_size = len('[{"kind": "phash", "hash": "aaaa"}]')
+    cache = PerceptualHashCache(str(tmp_path), max_size=entry_size * 4)
+
+    names = ["a", "b", "c", "d"]
+    for age, name in enumerate(reversed(names)):
+        cache.put(sha256(name), hashes(name))
+        # Entries are ordered by modification time; make it unambiguous
+        path = cache._path(sha256(name))
+        os.utime(path, (1000 - age, 1000 - age))
+
+    # "a" is the oldest entry, but using it makes it the most recently used
+    assert cache.get(sha256("a")) == hashes("a")
+
+    # Evicting leaves some room, so that the next write doesn't have to evict again
+    cache.put(sha256("e"), hashes("e"))
+    for name in ["b", "c"]:
+        assert cache.get(sha256(name)) is None
+    for name in ["a", "d", "e"]:
+        assert cache.get(sha256(name)) == hashes(name)
+    assert cache._size == size_on_disk(cache) == entry_size * 3
+    assert cache._size <= cache.max_size * 0.9
@@ -0,0 +1,110 @@
+import base64
+import random
+
+import numpy as np
+import pytest
+
+from phash_dedupe import (
+    decode_hashes,
+    find_duplicate_groups,
+    hamming_distances,
+    iter_close_pairs,
+)
+
+
+def random_hashes(rng: random.Random, count: int, length: int = 8) -> list[str]:
+    """Random hashes, with some clustered near one another so that there are duplicates
+    to find."""
+    centers = [rng.getrandbits(length * 8) for _ in range(count // 8 + 1)]
+    hashes = []
+    for _ in range(count):
+        value = rng.choice(centers)
+        for _ in range(rng.randrange(0, 24)):
+            value ^= 1 << rng.randrange(length * 8)
+        hashes.append(base64.b64encode(value.to_bytes(length, "big")).decode())
+    return hashes
+
+
+def distance(a: str, b: str) -> int:
+    return (
+        int.from_bytes(base64.b64decode(a), "big")
+        ^ int.from_bytes(base64.b64decode(b), "big")
+    ).bit_count()
+
+
+def brute_force_groups(hashes: list[str], max_distance: int) -> list[list[int]]:
+    parents = list(range(len(hashes)))
+
+    def find(i):
+        while parents[i] != i:
+            i = parents[i]
+        return i
+
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            same_length = len(base64.b64decode(hashes[i])) == len(
+                base64.b64decode(hashes[j])
+            )
+            if same_length and distance(hashes[i], hashes[j]) <= max_distance:
+                parents[max(find(i), find(j))] = min(find(i), find(j))
+
+    groups = {}
+    for i in range(len(hashes)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(
+        (group for group in groups.values() if len(group) > 1), key=lambda g: g[0]
+    )
+
+
+@pytest.mark.parametrize("max_distance", [0, 8, 15])
+@pytest.mark.parametrize("block_words", [1, 64, 4 * 1024 * 1024])
+def test_groups_match_brute_force(max_distance, block_words):
+    rng = random.Random(max_distance)
+    hashes = random_hashes(rng, 200)
+    # Exact duplicates, and hashes of another length that mustn't be compared with the
+    # others
+    hashes += hashes[:5] + random_hashes(rng, 30, length=12)
+
+    assert find_duplicate_groups(
+        hashes, max_distance=max_distance, block_words=block_words
+    ) == brute_force_groups(hashes, max_distance)
+
+
+def test_invalid_hashes_are_skipped():
+    hashes = random_hashes(random.Random(1), 20)
+    groups = find_duplicate_groups(hashes + ["not base64!"] + hashes[:1])
+    assert [20 in group for group in groups] == [False] * len(groups)
+    assert any(0 in group and 21 in group for group in groups)
+
+
+def test_pairs_match_distances():
+    rng = random.Random(2)
+    hashes = random_hashes(rng, 60)
+    queries, rows = decode_hashes(hashes)
+    assert list(rows) == list(range(60))
+
+    expected = {
+        (i, j)
+        for i in range(60)
+        for j in range(i + 1, 60)
+        if distance(hashes[i], hashes[j]) <= 10
+    }
+    found = set()
+    for query_rows, corpus_rows, distances in iter_close_pairs(
+        queries, max_distance=10, block_words=8
+    ):
+        for i, j, d in zip(query_rows, corpus_rows, distances):
+            assert d == distance(hashes[i], hashes[j])
+            found.add((int(i), int(j)))
+    assert found == expected
+
+    assert hamming_distances(queries[:3], queries[:3]).diagonal().tolist() == [0, 0, 0]
+
+
+def test_decode_hashes_pads_to_whole_words():
+    matrix, rows = decode_hashes(
+        [base64.b64encode(b"\xff" * 3).decode(), "not base64!"]
+    )
+    assert rows.tolist() == [0]
+    assert matrix.dtype == np.uint64 and matrix.shape == (1, 1)
+    assert bin(int(matrix[0, 0])).count("1") == 24
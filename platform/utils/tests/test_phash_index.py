@@ -0,0 +1,120 @@
+import base64
+import random
+
+import pytest
+
+from phash_index import BKTree, PerceptualHashIndex, decode_hash
+
+
+def random_hashes(rng: random.Random, count: int, length: int = 8) -> list[int]:
+    """Random hashes, with some clustered near one another so that there are
+    matches to find."""
+    centers = [rng.getrandbits(length * 8) for _ in range(count // 10 + 1)]
+    hashes = []
+    for _ in range(count):
+        value = rng.choice(centers)
+        for _ in range(rng.randrange(0, 24)):
+            value ^= 1 << rng.randrange(length * 8)
+        hashes.append(value)
+    return hashes
+
+
+def encode(value: int, length: int = 8) -> str:
+    return base64.b64encode(value.to_bytes(length, "big")).decode()
+
+
+@pytest.mark.parametrize("max_distance", [0, 5, 15, 30])
+def test_bk_tree_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    values = random_hashes(rng, 500)
+
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, str(i))
+
+    for query in random_hashes(rng, 50) + values[:10]:
+        expected = {
+            str(i)
+            for i, value in enumerate(values)
+            if (value ^ query).bit_count() <= max_distance
+        }
+        found = set()
+        for value, keys, distance in tree.search(query, max_distance):
+            assert distance == (value ^ query).bit_count()
+            found |= keys
+        assert found == expected
+
+
+def test_bk_tree_groups_identical_values():
+    tree = BKTree()
+    tree.add(0b1010, "a")
+    tree.add(0b1010, "b")
+    tree.add(0b1011, "c")
+
+    assert sorted(
+        (value, sorted(keys), distance)
+        for value, keys, distance in tree.search(0b1010, 0)
+    ) == [(0b1010, ["a", "b"], 0)]
+    assert BKTree().search(0, 64) == []
+
+
+def test_index_query_matches_brute_force():
+    rng = random.Random(0)
+    values = random_hashes(rng, 300)
+
+    index = PerceptualHashIndex()
+    for i, value in enumerate(values):
+        index.add(f"key-{i}", "pdq", encode(value))
+
+    for query in values[:20]:
+        expected = sorted(
+            (((value ^ query).bit_count()), f"key-{i}")
+            for i, value in enumerate(values)
+            if (value ^ query).bit_count() <= 15
+        )
+        results = index.query("pdq", encode(query), max_distance=15)
+        assert [(result["distance"], result["key"]) for result in results] == expected
+
+
+def test_index_only_compares_hashes_of_the_same_kind_and_length():
+    index = PerceptualHashIndex()
+    index.add("a", "pdq", encode(0))
+    index.add("b", "phash", encode(0))
+    index.add("c", "pdq", encode(0, length=16))
+
+    assert [result["key"] for result in index.query("pdq", encode(0))] == ["a"]
+    assert [result["key"] for result in index.query("pdq", encode(0, 16))] == ["c"]
+
+
+def test_index_persists_and_skips_partial_lines(tmp_path):
+    path = tmp_path / "index.jsonl"
+
+    index = PerceptualHashIndex(str(path))
+    index.add("a", "pdq", encode(1))
+    assert (
+        index.add_metadata(
+            "b",
+            dict(
+                artifacts=[dict(perceptual_hashes=[dict(kind="pdq", hash=encode(3))])]
+            ),
+        )
+        == 1
+    )
+    index._log.close()
+
+    # As if we crashed partway through writing an entry
+    with open(path, "a") as outfile:
+        outfile.write('{"key": "c", "kin')
+
+    reloaded = PerceptualHashIndex(str(path))
+    assert reloaded.size == 2
+    assert [result["key"] for result in reloaded.query("pdq", encode(1), 1)] == [
+        "a",
+        "b",
+    ]
+
+
+def test_decode_hash_rejects_invalid_base64():
+    assert decode_hash(encode(5, 2)) == (5, 2)
+    with pytest.raises(ValueError):
+        decode_hash("not base64!")
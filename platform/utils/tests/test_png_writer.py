@@ -0,0 +1,65 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+from png_writer import PNG_SIGNATURE, StreamingPngWriter
+
+
+def read_chunks(path) -> list[tuple[bytes, bytes]]:
+    with open(path, "rb") as infile:
+        data = infile.read()
+    assert data[: len(PNG_SIGNATURE)] == PNG_SIGNATURE
+
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        (length,) = struct.unpack(">I", data[offset : offset + 4])
+        kind = data[offset + 4 : offset + 8]
+        body = data[offset + 8 : offset + 8 + length]
+        (crc,) = struct.unpack(">I", data[offset + 8 + length : offset + 12 + length])
+        assert crc == zlib.crc32(body, zlib.crc32(kind))
+        chunks.append((kind, body))
+        offset += 12 + length
+    return chunks
+
+
+@pytest.mark.parametrize("bands", [[1], [3, 1, 50, 7], [64]])
+def test_round_trip(tmp_path, bands):
+    rng = np.random.default_rng(len(bands))
+    width = 37
+    image = rng.integers(0, 256, size=(sum(bands), width, 3), dtype=np.uint8)
+    # Flat areas and repeated rows, like a real screenshot
+    image[: len(image) // 2, :10] = 255
+
+    path = tmp_path / "image.png"
+    writer = StreamingPngWriter(str(path), width)
+    start = 0
+    for band in bands:
+        writer.write_rows(image[start : start + band])
+        start += band
+    writer.close()
+
+    decoded = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    assert decoded is not None
+    assert np.array_equal(decoded[:, :, ::-1], image)
+
+    chunks = read_chunks(path)
+    assert chunks[0][0] == b"IHDR" and chunks[-1] == (b"IEND", b"")
+    assert struct.unpack(">II", chunks[0][1][:8]) == (width, len(image))
+
+
+def test_rejects_bad_rows(tmp_path):
+    writer = StreamingPngWriter(str(tmp_path / "image.png"), 4)
+    with pytest.raises(ValueError):
+        writer.write_rows(np.zeros((2, 5, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.write_rows(np.zeros((2, 4), dtype=np.uint8))
+
+    # Empty bands are fine, but an image needs at least one row
+    writer.write_rows(np.zeros((0, 4, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+    writer.abort()
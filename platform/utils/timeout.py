@@ -4,6 +4,7 @@ import errno
 import os
 import signal
 import functools
+import threading
 
 
 class TimeoutError(Exception):
@@ -17,6 +18,12 @@ def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            # Signals are only delivered to the main thread, so there's no way to
+            # interrupt a call in any other thread; there, the function has to keep to
+            # its own deadlines
+            if threading.current_thread() is not threading.main_thread():
+                return func(*args, **kwargs)
+
             signal.signal(signal.SIGALRM, _handle_timeout)
             signal.alarm(seconds)
             try: